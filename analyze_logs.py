@@ -1,17 +1,330 @@
+import argparse
+import json
+import re
+import sys
+import time
+from collections import OrderedDict
 
-try:
-    with open('tail_logs.txt', 'r', encoding='utf-8') as f:
-        content = f.read()
-except:
-    with open('tail_logs.txt', 'r') as f:
-        content = f.read()
-
-print(f"Log length: {len(content)}")
-found = False
-for line in content.splitlines():
-    if "Bedrock Error" in line or "Error" in line:
-        print(f"FOUND ERROR: {line}")
-        found = True
-
-if not found:
-    print("No errors found in captured logs.")
+from load_test import Histogram
+
+# Streaming analysis of the backend's CloudWatch logs: per-route duration and memory percentiles,
+# cold starts, error breakdowns and our own markers, one event at a time in bounded memory: sparse
+# histograms (at most a few thousand buckets each, however many values), counters with a capped
+# number of keys, and a capped map of requests still waiting for their REPORT line.
+#   python analyze_logs.py                                 # tail_logs.txt, as before
+#   python analyze_logs.py events.jsonl all_logs.json      # local files / fixtures
+#   python analyze_logs.py --fetch --since 6h --workers 8  # straight from CloudWatch (get_logs.py)
+# Inputs: JSON lines from get_logs.py ({timestamp, logStreamName, message}), AWS CLI / boto3 dumps
+# ({"events": [...]}, loaded whole, so keep those small), or text with one message per line,
+# optionally after an ISO timestamp (tail_logs.txt).
+# Lines understood:
+#   START / END / REPORT / INIT_START / "Task timed out" - Lambda platform lines; REPORT gives Duration,
+#       Max Memory Used and, on a cold start, Init Duration
+#   JSON lines from logs.py - level/msg/requestId/route, and the per-request EMF record (Route, status,
+#       Latency and counters such as RagFallback or QuizFallback)
+#   older print() output - "Event: {...}" for the route, "... Error: ..." lines for errors
+# A REPORT is attributed to the route of the same request id, or, for older logs without request
+# ids on every line, to the last "Event:" route seen in the same log stream.
+
+MAX_PENDING = 50000
+MAX_ERROR_KEYS = 200
+REPORT_RE = re.compile(r'REPORT RequestId: (\S+)\s+Duration: ([\d.]+) ms\s+Billed Duration: (\d+) ms\s+'
+                       r'Memory Size: (\d+) MB\s+Max Memory Used: (\d+) MB(?:\s+Init Duration: ([\d.]+) ms)?')
+REQUEST_ID_RE = re.compile(r'RequestId: (\S+)')
+TIMEOUT_RE = re.compile(r'Task timed out after ([\d.]+) seconds')
+ROUTE_KEY_RE = re.compile(r'"routeKey": "([^"]+)"')
+RAW_ROUTE_RE = re.compile(r'"method": "(\w+)", "path": "([^"]+)"')
+AWS_CODE_RE = re.compile(r'\(([A-Z][A-Za-z]+)\)')
+ERROR_TYPE_RE = re.compile(r'^(\w+(?:Error|Exception)):')
+LEGACY_ERROR_RE = re.compile(r'^([A-Z][\w ]{0,40}?(?:Error|failed|Failed))\b:?\s*(.*)')
+TIMESTAMP_RE = re.compile(r'^﻿?(\d{4}-\d{2}-\d{2}T[\d:.]+Z?)\s(.*)$')
+THROTTLE_RE = re.compile(r'Throttl|TooManyRequests|ProvisionedThroughputExceeded|Rate exceeded|SlowDown')
+TRANSCRIBE_MSGS = {'Voice job failed', 'Transcribe stream result failed'}
+# logs.count() counters, read from EMF records (per request, or standalone outside one)
+COUNTER_MARKERS = {'RagFallback': 'rag_fallback', 'LocalRagError': 'local_rag_error', 'QuizFallback': 'quiz_fallback'}
+
+class RouteStats:
+    def __init__(self):
+        self.requests = 0
+        self.duration = Histogram()   # microseconds, from REPORT
+        self.memory = Histogram()     # MB, from REPORT
+        self.init = Histogram()       # microseconds, cold starts only
+        self.latency = Histogram()    # microseconds, handler-measured (EMF Latency)
+        self.billed_ms = 0
+        self.memory_size = 0
+        self.cold_starts = 0
+        self.server_errors = 0
+        self.client_errors = 0
+        self.timeouts = 0
+
+class LogAnalyzer:
+    def __init__(self, max_pending=MAX_PENDING):
+        self.routes = {}
+        self.errors = {}
+        self.markers = {}
+        self.pending = OrderedDict()   # requestId -> {'route', 'report'} until both halves are in
+        self.stream_route = {}         # logStreamName -> route of its current request (older logs)
+        self.stream_request = {}       # logStreamName -> current requestId (older logs)
+        self.max_pending = max_pending
+        self.lines = 0
+        self.first_ts = None
+        self.last_ts = None
+
+    def route(self, name):
+        stats = self.routes.get(name)
+        if stats is None:
+            stats = self.routes[name] = RouteStats()
+        return stats
+
+    def mark(self, name, n=1):
+        self.markers[name] = self.markers.get(name, 0) + n
+
+    def error(self, route, msg, detail=''):
+        # The AWS error code when there is one ("... (ThrottlingException) ..."), else the exception type
+        match = AWS_CODE_RE.search(detail or '') or ERROR_TYPE_RE.search(detail or '')
+        code = match.group(1) if match else ''
+        key = (route or 'unknown', msg[:80], code)
+        if key not in self.errors and len(self.errors) >= MAX_ERROR_KEYS:
+            key = (route or 'unknown', 'other', '')
+        self.errors[key] = self.errors.get(key, 0) + 1
+        if THROTTLE_RE.search(detail or '') or THROTTLE_RE.search(msg):
+            self.mark('throttled')
+
+    def _pending(self, request_id):
+        entry = self.pending.get(request_id)
+        if entry is None:
+            entry = self.pending[request_id] = {'route': None, 'report': None}
+            if len(self.pending) > self.max_pending:
+                self._complete(*self.pending.popitem(last=False))
+        return entry
+
+    def _attach(self, request_id, route=None, report=None):
+        entry = self._pending(request_id)
+        if route:
+            entry['route'] = route
+        if report:
+            entry['report'] = report
+        if entry['route'] and entry['report']:
+            self._complete(request_id, self.pending.pop(request_id))
+
+    def _complete(self, request_id, entry):
+        report = entry['report']
+        if report is None:
+            return
+        stats = self.route(entry['route'] or 'unknown')
+        duration_ms, billed_ms, memory_size, memory_used, init_ms = report
+        stats.requests += 1
+        stats.duration.record(duration_ms * 1000)
+        stats.memory.record(memory_used)
+        stats.billed_ms += billed_ms
+        stats.memory_size = memory_size
+        if init_ms is not None:
+            stats.cold_starts += 1
+            stats.init.record(init_ms * 1000)
+
+    def feed(self, message, stream='', timestamp=None):
+        self.lines += 1
+        if timestamp is not None:
+            self.first_ts = timestamp if self.first_ts is None else min(self.first_ts, timestamp)
+            self.last_ts = timestamp if self.last_ts is None else max(self.last_ts, timestamp)
+        message = message.strip()
+        if not message:
+            return
+        if message[0] == '{':
+            try:
+                record = json.loads(message)
+            except ValueError:
+                record = None
+            if isinstance(record, dict):
+                self._structured(record, stream)
+                return
+        if message.startswith('REPORT '):
+            match = REPORT_RE.match(message)
+            if match:
+                request_id = match.group(1)
+                report = (float(match.group(2)), int(match.group(3)), int(match.group(4)), int(match.group(5)),
+                          float(match.group(6)) if match.group(6) else None)
+                if report[4] is not None:
+                    self.mark('cold_start')
+                route = self.stream_route.pop(stream, None) if self.stream_request.get(stream) == request_id else None
+                self._attach(request_id, route=route, report=report)
+            return
+        if message.startswith('START '):
+            match = REQUEST_ID_RE.search(message)
+            if match:
+                self.stream_request[stream] = match.group(1)
+                self.stream_route.pop(stream, None)
+            return
+        if message.startswith(('END ', 'INIT_START', 'INIT_REPORT', 'EXTENSION', 'TELEMETRY')):
+            return
+        if message.startswith('Event: '):
+            route = self._legacy_route(message)
+            if route:
+                self.stream_route[stream] = route
+                request_id = self.stream_request.get(stream)
+                if request_id:
+                    self._attach(request_id, route=route)
+            return
+        timeout = TIMEOUT_RE.search(message)
+        if timeout:
+            request_id = REQUEST_ID_RE.search(message)
+            route = self._route_for(request_id.group(1) if request_id else self.stream_request.get(stream), stream)
+            self.route(route or 'unknown').timeouts += 1
+            self.mark('lambda_timeout')
+            if route in ('aws.transcribe', 'GET /ask/status', 'POST /ask/stream'):
+                self.mark('transcription_timeout')
+            self.error(route, 'Task timed out')
+            return
+        legacy = LEGACY_ERROR_RE.match(message)
+        if legacy or message.startswith('[ERROR]'):
+            msg, detail = (legacy.group(1), legacy.group(2)) if legacy else ('[ERROR]', message[8:])
+            self.error(self.stream_route.get(stream), msg, detail)
+            if 'RAG' in msg:
+                self.mark('rag_fallback')
+
+    def _route_for(self, request_id, stream):
+        entry = self.pending.get(request_id) if request_id else None
+        return (entry or {}).get('route') or self.stream_route.get(stream)
+
+    def _legacy_route(self, message):
+        match = ROUTE_KEY_RE.search(message)
+        if match and match.group(1) != '$default':
+            return match.group(1)
+        match = RAW_ROUTE_RE.search(message)
+        if match:
+            return f"{match.group(1)} {match.group(2)}"
+        return None
+
+    def _structured(self, record, stream):
+        request_id = record.get('requestId')
+        if '_aws' in record:
+            # The request's EMF record (logs.end_request) or a standalone metric
+            route = record.get('Route')
+            for name, marker in COUNTER_MARKERS.items():
+                if record.get(name):
+                    self.mark(marker, record[name])
+            if route and 'Latency' in record:
+                stats = self.route(route)
+                stats.latency.record(record['Latency'] * 1000)
+                status = record.get('status', 200)
+                if status >= 500:
+                    stats.server_errors += 1
+                elif status >= 400:
+                    stats.client_errors += 1
+                if request_id:
+                    self._attach(request_id, route=route)
+            return
+        msg = str(record.get('msg', ''))
+        route = record.get('route')
+        if request_id and route:
+            self._attach(request_id, route=route)
+        if record.get('level') == 'ERROR' or (record.get('level') == 'WARNING' and 'failed' in msg):
+            error = str(record.get('error', ''))
+            self.error(route, msg, error)
+            if msg in TRANSCRIBE_MSGS and re.search(r'timed out|Timeout', error, re.IGNORECASE):
+                self.mark('transcription_timeout')
+
+    def finish(self):
+        # Requests whose REPORT never arrived only counted through their EMF record
+        while self.pending:
+            self._complete(*self.pending.popitem(last=False))
+
+    def summary(self):
+        ms = lambda value: round(value / 1000, 1)
+        routes = {}
+        for name, s in sorted(self.routes.items(), key=lambda kv: -kv[1].requests):
+            routes[name] = {
+                'requests': s.requests,
+                'cold_starts': s.cold_starts,
+                'duration_ms': {'p50': ms(s.duration.percentile(50)), 'p95': ms(s.duration.percentile(95)),
+                                'p99': ms(s.duration.percentile(99)), 'max': ms(s.duration.max)},
+                'init_ms': {'p50': ms(s.init.percentile(50)), 'max': ms(s.init.max)},
+                'latency_ms': {'p50': ms(s.latency.percentile(50)), 'p99': ms(s.latency.percentile(99))},
+                'memory_mb': {'p50': s.memory.percentile(50), 'max': s.memory.max, 'size': s.memory_size},
+                'billed_s': round(s.billed_ms / 1000, 1),
+                'errors_5xx': s.server_errors,
+                'errors_4xx': s.client_errors,
+                'timeouts': s.timeouts
+            }
+        errors = [{'route': route, 'msg': msg, 'code': code, 'count': n}
+                  for (route, msg, code), n in sorted(self.errors.items(), key=lambda kv: -kv[1])]
+        return {'lines': self.lines, 'first_ts': self.first_ts, 'last_ts': self.last_ts, 'routes': routes,
+                'markers': dict(sorted(self.markers.items())), 'errors': errors}
+
+def read_file(path):
+    # (message, stream, timestamp) from a JSON lines file, an {"events": [...]} dump, or plain text
+    with open(path, 'r', encoding='utf-8-sig', errors='replace') as f:
+        first = f.read(1)
+        f.seek(0)
+        if first == '{' and not path.endswith(('.jsonl', '.ndjson')):
+            try:
+                events = json.load(f).get('events')
+            except ValueError:
+                events = None
+            if events is not None:
+                for event in events:
+                    yield event.get('message', ''), event.get('logStreamName', path), event.get('timestamp')
+                return
+            f.seek(0)
+        for line in f:
+            if line.startswith('{"timestamp"') or line.startswith('{"logStreamName"'):
+                event = json.loads(line)
+                yield event.get('message', ''), event.get('logStreamName', path), event.get('timestamp')
+                continue
+            match = TIMESTAMP_RE.match(line)
+            yield (match.group(2), path, None) if match else (line, path, None)
+
+def analyze(source, analyzer=None):
+    analyzer = analyzer or LogAnalyzer()
+    for message, stream, timestamp in source:
+        analyzer.feed(message, stream, timestamp)
+    analyzer.finish()
+    return analyzer
+
+def print_report(summary, elapsed):
+    print(f"{summary['lines']} lines in {elapsed:.1f}s ({summary['lines'] / max(elapsed, 1e-9):,.0f} lines/s)")
+    print(f"\n{'route':<26} {'reqs':>6} {'cold':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+          f"{'init p50':>8} {'mem p50':>7} {'mem max':>7} {'billed s':>8} {'5xx':>5} {'4xx':>5} {'t/o':>4}")
+    for name, r in summary['routes'].items():
+        d = r['duration_ms']
+        print(f"{name:<26} {r['requests']:>6} {r['cold_starts']:>5} {d['p50']:>8.1f} {d['p95']:>8.1f} {d['p99']:>8.1f} "
+              f"{d['max']:>8.1f} {r['init_ms']['p50']:>8.1f} {r['memory_mb']['p50']:>7} {r['memory_mb']['max']:>7} "
+              f"{r['billed_s']:>8.1f} {r['errors_5xx']:>5} {r['errors_4xx']:>5} {r['timeouts']:>4}")
+    if summary['markers']:
+        print('\nMarkers: ' + ', '.join(f"{k}={v}" for k, v in summary['markers'].items()))
+    if summary['errors']:
+        print(f"\n{'count':>6}  {'route':<26} error")
+        for e in summary['errors'][:25]:
+            print(f"{e['count']:>6}  {e['route']:<26} {e['msg']}" + (f" ({e['code']})" if e['code'] else ''))
+    else:
+        print('\nNo errors found.')
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-route latency, memory and error report from Lambda logs')
+    parser.add_argument('files', nargs='*', help='Log files (default: tail_logs.txt)')
+    parser.add_argument('--fetch', action='store_true', help='Read from CloudWatch instead of files')
+    parser.add_argument('--group', default='/aws/lambda/TacMed_Backend')
+    parser.add_argument('--since', default='1h')
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--json', metavar='FILE', help='Write the summary as JSON')
+    args = parser.parse_args()
+
+    started = time.time()
+    if args.fetch:
+        import get_logs
+        start_ms = get_logs.parse_time(args.start or args.since)
+        end_ms = get_logs.parse_time(args.end) if args.end else int(time.time() * 1000)
+        events = get_logs.fetch_events(args.group, start_ms, end_ms, workers=args.workers)
+        source = ((e['message'], e['logStreamName'], e['timestamp']) for e in events)
+    else:
+        source = (event for path in (args.files or ['tail_logs.txt']) for event in read_file(path))
+    summary = analyze(source).summary()
+    print_report(summary, time.time() - started)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import logs
+
+# Two-tier answer cache for /ask: an in-process LRU in front of a DynamoDB table.
+# Keys are derived from the normalized question plus the KB document version
+# (a hash of the PDF manifest ETags), so uploading a new PDF invalidates every
+# cached answer without an explicit purge; stale DynamoDB rows expire via TTL.
+
+# Cyrillic letters that look like Latin ones, folded so that mixed keyboard layouts
+# ("турнiкет" typed with a Latin i) map to the same key
+_HOMOGLYPHS = str.maketrans({
+    'a': 'а', 'c': 'с', 'e': 'е', 'i': 'і', 'k': 'к', 'm': 'м', 'o': 'о',
+    'p': 'р', 't': 'т', 'x': 'х', 'y': 'у', 'h': 'н', 'b': 'в'
+})
+_CYRILLIC_RE = re.compile(r'[Ѐ-ӿ]')
+_PUNCT_RE = re.compile(r"[^\w\s]", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+def _fold_word(word):
+    # Only words that already contain Cyrillic are folded; pure Latin words stay English
+    if _CYRILLIC_RE.search(word):
+        return word.translate(_HOMOGLYPHS)
+    return word
+
+def normalize_question(question):
+    text = unicodedata.normalize('NFKC', question).lower()
+    text = text.replace('’', '').replace("'", '').replace('ʼ', '')
+    text = _PUNCT_RE.sub(' ', text)
+    words = [_fold_word(w) for w in _SPACE_RE.split(text) if w]
+    return ' '.join(words)
+
+def doc_version(manifest):
+    if not manifest:
+        return 'none'
+    digest = hashlib.sha1()
+    for doc in sorted(manifest, key=lambda d: d['key']):
+        digest.update(f"{doc['key']}:{doc.get('etag', '')}\n".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+class AnswerCache:
+    def __init__(self, table=None, max_entries=256, ttl_seconds=7 * 24 * 3600):
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'dynamo_hits': 0, 'misses': 0, 'saved_ms': 0.0}
+
+    def _key(self, question, version):
+        digest = hashlib.sha256(normalize_question(question).encode('utf-8')).hexdigest()
+        return f"{version}#{digest}"
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._lru[key] = entry
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def get(self, question, version):
+        key = self._key(question, version)
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                self._lru.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                self.stats['saved_ms'] += entry['latency_ms']
+                return entry['payload'], 'memory'
+
+        if self.table is not None:
+            try:
+                item = self.table.get_item(Key={'QuestionKey': key}).get('Item')
+                if item and int(item.get('ExpiresAt', 0)) > time.time():
+                    entry = {'payload': json.loads(item['Payload']), 'latency_ms': float(item.get('LatencyMs', 0))}
+                    self._remember(key, entry)
+                    with self._lock:
+                        self.stats['dynamo_hits'] += 1
+                        self.stats['saved_ms'] += entry['latency_ms']
+                    return entry['payload'], 'dynamo'
+            except Exception as e:
+                logs.warning('Answer cache read failed', error=e)
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None, 'miss'
+
+    def put(self, question, version, payload, latency_ms):
+        key = self._key(question, version)
+        self._remember(key, {'payload': payload, 'latency_ms': latency_ms})
+        if self.table is not None:
+            try:
+                self.table.put_item(Item={
+                    'QuestionKey': key,
+                    'DocVersion': version,
+                    'Question': normalize_question(question),
+                    'Payload': json.dumps(payload, ensure_ascii=False),
+                    'LatencyMs': int(latency_ms),
+                    'ExpiresAt': int(time.time() + self.ttl_seconds)
+                })
+            except Exception as e:
+                logs.warning('Answer cache write failed', error=e)
+
+    def summary(self):
+        with self._lock:
+            hits = self.stats['memory_hits'] + self.stats['dynamo_hits']
+            total = hits + self.stats['misses']
+            return {
+                'memory_hits': self.stats['memory_hits'],
+                'dynamo_hits': self.stats['dynamo_hits'],
+                'misses': self.stats['misses'],
+                'hit_rate': round(hits / total, 3) if total else 0.0,
+                'saved_ms': int(self.stats['saved_ms']),
+                'entries': len(self._lru)
+            }
@@ -0,0 +1,61 @@
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+
+# boto3 clients built on first use instead of at import, so a cold start only pays for the
+# services its route actually calls (GET /leaderboard never builds Transcribe or Bedrock clients).
+# All clients come from one session and share two tuned configs:
+#   API_CONFIG   - DynamoDB, S3, Transcribe, Lambda: short timeouts, standard retries
+#   MODEL_CONFIG - Bedrock: long read timeout for generation, fewer retries (a retry repeats the whole answer)
+# init_ms records how long each client took to build, for logs and profile_cold_start.py
+# (a table's time includes the DynamoDB resource when it is the first thing to need it).
+
+API_CONFIG = Config(
+    connect_timeout=2,
+    read_timeout=10,
+    retries={'max_attempts': 3, 'mode': 'standard'},
+    tcp_keepalive=True,
+    max_pool_connections=25
+)
+MODEL_CONFIG = Config(
+    connect_timeout=2,
+    read_timeout=120,
+    retries={'max_attempts': 2, 'mode': 'standard'},
+    tcp_keepalive=True,
+    max_pool_connections=25
+)
+
+session = boto3.session.Session()
+init_ms = {}
+# Client creation on a shared session is not thread-safe; quiz generation builds from worker threads
+_lock = threading.RLock()
+
+class LazyClient:
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+        self._obj = None
+
+    def _get(self):
+        if self._obj is None:
+            with _lock:
+                if self._obj is None:
+                    started = time.perf_counter()
+                    self._obj = self._factory()
+                    init_ms[self._name] = round((time.perf_counter() - started) * 1000, 1)
+        return self._obj
+
+    def __getattr__(self, attr):
+        return getattr(self._get(), attr)
+
+def client(service, config=API_CONFIG):
+    return LazyClient(service, lambda: session.client(service, config=config))
+
+def resource(service, config=API_CONFIG):
+    return LazyClient(f"{service}-resource", lambda: session.resource(service, config=config))
+
+def table(resource_proxy, name):
+    # A DynamoDB Table that does not build the resource until the first call on it
+    return LazyClient(f"table:{name}", lambda: resource_proxy.Table(name))
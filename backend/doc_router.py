@@ -0,0 +1,131 @@
+import json
+import math
+import os
+import unicodedata
+
+from kb_retrieval import BM25_B, BM25_K1, STEM_PREFIX, tokenize
+
+# Document-level routing for the EXTERNAL_SOURCES path of /ask: rank the KB PDFs for a question and
+# send only the best few, instead of the first five keys in S3 listing order.
+# Built offline by build_doc_router.py from the extract_kb.py chunks and shipped as
+# kb_index/router.json:
+#   docs      - [{'key', 'title', 'pages'}]
+#   sections  - [doc index, heading] per section; one extra pseudo-section per document holds its
+#               title and top-level headings
+#   terms     - term -> [[section, weight], ...]: each section's keyword signature, its
+#               SIGNATURE_TERMS highest BM25 term weights (idf and length normalization precomputed)
+# A question scores every section by summing the weights of its terms, a document scores its best
+# section plus half its second best, so one focused chapter outweighs scattered mentions across a
+# long handbook. That is a few dict lookups per question term: microseconds, no model call.
+
+ROUTER_VERSION = 1
+SIGNATURE_TERMS = 80
+HEADING_BOOST = 3
+SECOND_SECTION = 0.5
+MIN_SHARE = 0.35
+# Function words: with only one English document, "how" or "should" would otherwise route every
+# English question to it
+STOP_WORDS = frozenset(tokenize(
+    'the and or of to in on at by for with from as is are be do does did can could should would will '
+    'what when where which who how why if not no this that these those it its my your our their there '
+    'about after before during into than then use used using way best '
+    'та або що як який яка яке які коли чи це для при не по за про після під над між якщо його її їх '
+    'треба потрібно можна слід чому де хто того цього той ця цей також ще вже'))
+
+def _terms(text):
+    return [term for term in tokenize(text) if term not in STOP_WORDS]
+
+def _file_name(key):
+    # kb/ names copied from macOS are decomposed (NFD); S3 keys usually are not
+    return unicodedata.normalize('NFC', os.path.basename(key))
+
+def write_router(path, docs, sections, signature_terms=SIGNATURE_TERMS):
+    # docs: [{'key', 'title', 'pages'}]; sections: [{'doc', 'heading', 'text'}]
+    counts = []
+    for section in sections:
+        tf = {}
+        for term in _terms(section['text']):
+            tf[term] = tf.get(term, 0) + 1
+        for term in _terms(section['heading']):
+            tf[term] = tf.get(term, 0) + HEADING_BOOST
+        counts.append(tf)
+    df = {}
+    for tf in counts:
+        for term in tf:
+            df[term] = df.get(term, 0) + 1
+    n = len(counts)
+    avg_len = (sum(sum(tf.values()) for tf in counts) / n) if n else 1.0
+
+    terms = {}
+    for section_id, tf in enumerate(counts):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * sum(tf.values()) / (avg_len or 1.0))
+        weights = {term: math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5)) * f * (BM25_K1 + 1) / (f + norm)
+                   for term, f in tf.items()}
+        for term in sorted(weights, key=weights.get, reverse=True)[:signature_terms]:
+            terms.setdefault(term, []).append([section_id, round(weights[term], 3)])
+
+    router = {
+        'version': ROUTER_VERSION,
+        'stem_prefix': STEM_PREFIX,
+        'docs': docs,
+        'sections': [[s['doc'], s['heading'][:120]] for s in sections],
+        'terms': terms
+    }
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(router, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, path)
+    return {'docs': len(docs), 'sections': n, 'terms': len(terms),
+            'postings': sum(len(p) for p in terms.values()), 'bytes': os.path.getsize(path)}
+
+class DocRouter:
+    def __init__(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            router = json.load(f)
+        if router.get('version') != ROUTER_VERSION or router.get('stem_prefix') != STEM_PREFIX:
+            raise ValueError(f"Incompatible document router in {path}")
+        self.docs = router['docs']
+        self.sections = router['sections']
+        self.terms = router['terms']
+
+    def rank(self, question):
+        # [{'key', 'title', 'score', 'section'}], best first; only documents sharing a term with the question
+        scores = {}
+        for term in set(_terms(question)):
+            for section_id, weight in self.terms.get(term, ()):
+                scores[section_id] = scores.get(section_id, 0.0) + weight
+        best = {}
+        for section_id, score in scores.items():
+            doc = self.sections[section_id][0]
+            top = best.get(doc)
+            if top is None:
+                best[doc] = [score, 0.0, section_id]
+            elif score > top[0]:
+                best[doc] = [score, top[0], section_id]
+            elif score > top[1]:
+                top[1] = score
+        ranked = sorted(best.items(), key=lambda kv: kv[1][0] + SECOND_SECTION * kv[1][1], reverse=True)
+        return [{'key': self.docs[doc]['key'], 'title': self.docs[doc]['title'],
+                 'score': round(first + SECOND_SECTION * second, 3), 'section': self.sections[section_id][1]}
+                for doc, (first, second, section_id) in ranked]
+
+    def route(self, question, keys, k=3, min_share=MIN_SHARE):
+        # The keys (S3 object keys, matched on NFC file name) of at most k documents, best first, cut
+        # at min_share of the best score; [] when the question matches none of them
+        available = {}
+        for key in keys:
+            available.setdefault(_file_name(key), key)
+        routed = []
+        top = None
+        for hit in self.rank(question):
+            key = available.get(_file_name(hit['key']))
+            if key is None:
+                continue
+            if top is None:
+                top = hit['score']
+            elif hit['score'] < min_share * top:
+                break
+            routed.append(key)
+            if len(routed) == k:
+                break
+        return routed
@@ -0,0 +1,122 @@
+import threading
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+import logs
+
+# Write-behind recorder for HISTORY_TABLE (UserId HASH, Timestamp RANGE).
+# record() only appends to an in-memory queue and wakes a daemon thread, which starts writing it
+# with batch_writer (25 items per BatchWriteItem) while the handler carries on with its own calls.
+# Timestamp is '<ISO-8601 UTC with microseconds>#<kind>#<suffix>': it sorts by time, so a
+# user's history for any time range is one Query (UserId = :u AND Timestamp BETWEEN :from AND :to),
+# and the suffix keeps two records written in the same microsecond apart.
+# Lambda may freeze or retire the container once the invocation is over, so every invocation ends
+# with flush(): it waits for a write the thread has in flight and writes what is left. It runs on
+# the post-invoke extension (post_invoke.py) after the response has been sent, so it costs no
+# latency, only billed duration (one BatchWriteItem, ~10 ms). Without the extension (outside
+# Lambda, or if registration failed) lambda_handler flushes before returning, and routes that
+# record after their last call (/ask, /ask/stream) pay that round trip: bench_history.py measures
+# both, per route. Items whose write failed go back to the front of the queue and are retried by
+# the next flush.
+
+MAX_QUEUE = 5000
+MAX_TEXT = 2000
+
+def history_timestamp(kind, now=None):
+    now = now or datetime.now(timezone.utc)
+    return f"{now.strftime('%Y-%m-%dT%H:%M:%S.%fZ')}#{kind}#{uuid.uuid4().hex[:6]}"
+
+def _clip(value):
+    if isinstance(value, str) and len(value) > MAX_TEXT:
+        return value[:MAX_TEXT]
+    return value
+
+class HistoryWriter:
+    def __init__(self, table):
+        self.table = table
+        self._queue = deque()
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.stats = {'recorded': 0, 'written': 0, 'dropped': 0, 'batches': 0, 'errors': 0}
+
+    def record(self, user_id, kind, **fields):
+        # Never raises and never blocks on the network
+        if self.table is None or not user_id:
+            return
+        if len(self._queue) >= MAX_QUEUE:
+            self.stats['dropped'] += 1
+            return
+        item = {'UserId': user_id, 'Timestamp': history_timestamp(kind), 'Kind': kind}
+        item.update({k: _clip(v) for k, v in fields.items() if v is not None})
+        self._queue.append(item)
+        self.stats['recorded'] += 1
+        self._ensure_thread()
+        self._wake.set()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._queue:
+                self.flush()
+
+    def flush(self):
+        # Writes everything queued so far, after any write already in flight; returns the number
+        # of items written
+        with self._flush_lock:
+            items = []
+            while self._queue:
+                items.append(self._queue.popleft())
+            if not items:
+                return 0
+            try:
+                with self.table.batch_writer() as batch:
+                    for item in items:
+                        batch.put_item(Item=item)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logs.error('History write failed', items=len(items), error=e)
+                # batch_writer retries unprocessed items itself; this is a failed call. Keep the
+                # items (oldest first, within MAX_QUEUE) for the next flush
+                requeue = items[:max(0, MAX_QUEUE - len(self._queue))]
+                self.stats['dropped'] += len(items) - len(requeue)
+                self._queue.extendleft(reversed(requeue))
+                return 0
+            self.stats['written'] += len(items)
+            self.stats['batches'] += (len(items) + 24) // 25
+            return len(items)
+
+    def query(self, user_id, start=None, end=None, limit=50, newest_first=True):
+        # One Query on the table key: a user's records between two ISO timestamps (inclusive)
+        condition = 'UserId = :u'
+        values = {':u': user_id}
+        if start and end:
+            condition += ' AND #ts BETWEEN :start AND :end'
+            values.update({':start': start, ':end': end + '\uffff'})
+        elif start:
+            condition += ' AND #ts >= :start'
+            values[':start'] = start
+        elif end:
+            condition += ' AND #ts <= :end'
+            values[':end'] = end + '\uffff'
+        kwargs = {
+            'KeyConditionExpression': condition,
+            'ExpressionAttributeValues': values,
+            'ScanIndexForward': not newest_first,
+            'Limit': limit
+        }
+        if '#ts' in condition:
+            kwargs['ExpressionAttributeNames'] = {'#ts': 'Timestamp'}
+        return self.table.query(**kwargs).get('Items', [])
+
+    def summary(self):
+        return dict(self.stats, queued=len(self._queue))
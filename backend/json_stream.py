@@ -0,0 +1,102 @@
+import json
+import re
+
+# Incremental extraction of JSON objects from streamed model output.
+# The extractor tracks brace depth outside of strings, so it knows the moment a
+# top-level object closes and the caller can stop the generation right there.
+
+class IncrementalJSONExtractor:
+    def __init__(self):
+        self.text = ''
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.start = None
+        self.pos = 0
+        self.array_closed = False
+        self.objects = []
+        self.errors = []
+
+    def feed(self, chunk):
+        # Returns the objects completed by this chunk (already json-decoded)
+        self.text += chunk
+        completed = []
+        text = self.text
+        for i in range(self.pos, len(text)):
+            ch = text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            if ch == '"':
+                if self.depth > 0:
+                    self.in_string = True
+            elif ch == '{':
+                if self.depth == 0:
+                    self.start = i
+                self.depth += 1
+            elif ch == '}' and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    raw = text[self.start:i + 1]
+                    try:
+                        completed.append(json.loads(raw))
+                    except json.JSONDecodeError:
+                        repaired = repair_json_text(raw)
+                        if repaired is not None:
+                            completed.append(repaired)
+                        else:
+                            self.errors.append(raw)
+                    self.start = None
+            elif ch == ']' and self.depth == 0 and (self.objects or completed):
+                self.array_closed = True
+        self.pos = len(text)
+        self.objects.extend(completed)
+        return completed
+
+    def pending(self):
+        # Text of an object that was opened but never closed (truncated output)
+        return self.text[self.start:] if self.start is not None else None
+
+_SMART_QUOTES = str.maketrans({'“': '"', '”': '"', '„': '"'})
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+
+def repair_json_text(raw, truncated=False):
+    # Cheap local fixes for the usual model mistakes; returns the decoded object or None.
+    # truncated: raw is an object the generation never closed. It is only closed when it stops
+    # between two complete fields; cut inside a string, a number or a nested list, the object
+    # would decode to a shortened value (an explanation that ends mid-word) that still validates
+    text = raw.translate(_SMART_QUOTES)
+    text = _TRAILING_COMMA_RE.sub(r'\1', text)
+
+    # Close whatever was left open by a truncated generation
+    stack = []
+    in_string = False
+    escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+        elif ch in '}]' and stack:
+            stack.pop()
+    if truncated and (in_string or stack != ['}'] or text.rstrip()[-1:] not in ',"}]'):
+        return None
+    if in_string:
+        text += '"'
+    text = _TRAILING_COMMA_RE.sub(r'\1', text.rstrip().rstrip(',') + ''.join(reversed(stack)))
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return None
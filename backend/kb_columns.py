@@ -0,0 +1,160 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from array import array
+
+# Columnar chunk file produced by extract_kb.py: one file, memory-mapped by the stages that read it
+# (build_kb_index.py --chunks, the embedding and routing builds), so opening it costs one header
+# parse however large the corpus is.
+#   magic (8 bytes) | header length (uint64) | header JSON | columns, each 8-byte aligned
+# The header holds the documents, the interned section headings and, per column, its array
+# typecode, offset and length. Numeric columns are raw native-endian arrays, read in place through
+# memoryview.cast; chunk texts are zlib-compressed in blocks of BLOCK_ROWS rows, so reading one
+# chunk inflates one block instead of the whole text column.
+#   doc        uint16  document index
+#   page       uint32  page the chunk starts on (1-based)
+#   page_end   uint32  page it ends on
+#   section    uint32  index into header['sections'] (heading path, e.g. "1. ... > 1.1.5. ...")
+#   words      uint32  word count
+#   text_len   uint32  UTF-8 byte length of the text, to split a block back into rows
+#   text_block uint64  byte offsets of the compressed blocks, relative to the text data (blocks + 1)
+
+MAGIC = b'TMCOLS01'
+COLUMNS_VERSION = 1
+BLOCK_ROWS = 16
+NUMERIC = (('doc', 'H'), ('page', 'I'), ('page_end', 'I'), ('section', 'I'), ('words', 'I'), ('text_len', 'I'))
+
+def _pad(n):
+    return -n % 8
+
+def write_columns(path, docs, chunks, block_rows=BLOCK_ROWS, level=6):
+    # docs: [{'key', 'title', 'pages'}]; chunks: [{'doc', 'page', 'page_end', 'section', 'text'}]
+    # with section as a heading string
+    sections = {}
+    columns = {name: array(typecode) for name, typecode in NUMERIC}
+    encoded = []
+    for chunk in chunks:
+        data = chunk['text'].encode('utf-8')
+        encoded.append(data)
+        columns['doc'].append(chunk['doc'])
+        columns['page'].append(chunk['page'])
+        columns['page_end'].append(chunk.get('page_end', chunk['page']))
+        columns['section'].append(sections.setdefault(chunk.get('section', ''), len(sections)))
+        columns['words'].append(len(chunk['text'].split()))
+        columns['text_len'].append(len(data))
+
+    blocks = [zlib.compress(b''.join(encoded[i:i + block_rows]), level) for i in range(0, len(encoded), block_rows)]
+    columns['text_block'] = array('Q', [0])
+    for block in blocks:
+        columns['text_block'].append(columns['text_block'][-1] + len(block))
+
+    # Offsets are relative to the end of the header, which is only known once its own size is
+    layout = {}
+    offset = 0
+    for name, values in columns.items():
+        layout[name] = [values.typecode, offset, len(values)]
+        offset += len(values) * values.itemsize
+        offset += _pad(offset)
+    text_offset = offset
+    header = json.dumps({
+        'version': COLUMNS_VERSION,
+        'rows': len(chunks),
+        'block_rows': block_rows,
+        'codec': 'zlib',
+        'docs': docs,
+        'sections': list(sections),
+        'columns': layout,
+        'text_offset': text_offset
+    }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    header += b' ' * _pad(len(MAGIC) + 8 + len(header))
+
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for values in columns.values():
+            values.tofile(f)
+            f.write(b'\0' * _pad(len(values) * values.itemsize))
+        for block in blocks:
+            f.write(block)
+    os.replace(tmp, path)
+    return {'rows': len(chunks), 'sections': len(sections), 'blocks': len(blocks),
+            'text_bytes': sum(columns['text_len']), 'file_bytes': os.path.getsize(path)}
+
+class ChunkColumns:
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"Not a chunk columns file: {path}")
+        (header_len,) = struct.unpack_from('<Q', self._mm, len(MAGIC))
+        base = len(MAGIC) + 8
+        header = json.loads(self._mm[base:base + header_len])
+        if header['version'] != COLUMNS_VERSION:
+            self.close()
+            raise ValueError(f"Incompatible chunk columns file: {path}")
+        base += header_len
+
+        self.docs = header['docs']
+        self.sections = header['sections']
+        self.rows = header['rows']
+        self.block_rows = header['block_rows']
+        self._view = memoryview(self._mm)
+        self.columns = {}
+        for name, (typecode, offset, count) in header['columns'].items():
+            size = array(typecode).itemsize
+            self.columns[name] = self._view[base + offset:base + offset + count * size].cast(typecode)
+        self._text_base = base + header['text_offset']
+        self._block = (None, None)
+
+    def __len__(self):
+        return self.rows
+
+    def _inflate(self, block):
+        # The last block read stays inflated; rows are decoded one at a time
+        if self._block[0] != block:
+            bounds = self.columns['text_block']
+            data = zlib.decompress(self._view[self._text_base + bounds[block]:self._text_base + bounds[block + 1]])
+            starts = [0]
+            for row in range(block * self.block_rows, min((block + 1) * self.block_rows, self.rows)):
+                starts.append(starts[-1] + self.columns['text_len'][row])
+            self._block = (block, (data, starts))
+        return self._block[1]
+
+    def text(self, row):
+        data, starts = self._inflate(row // self.block_rows)
+        i = row % self.block_rows
+        return data[starts[i]:starts[i + 1]].decode('utf-8')
+
+    def row(self, row):
+        return {
+            'doc': self.docs[self.columns['doc'][row]]['key'],
+            'page': self.columns['page'][row],
+            'page_end': self.columns['page_end'][row],
+            'section': self.sections[self.columns['section'][row]],
+            'words': self.columns['words'][row],
+            'text': self.text(row)
+        }
+
+    def __iter__(self):
+        # In row order, so each block is inflated once
+        for row in range(self.rows):
+            yield self.row(row)
+
+    def close(self):
+        for view in self.__dict__.get('columns', {}).values():
+            view.release()
+        if '_view' in self.__dict__:
+            self._view.release()
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,180 @@
+import json
+import math
+import mmap
+import os
+import re
+from array import array
+
+# Local retrieval over the kb/ PDFs.
+# The index is produced at build time by build_kb_index.py and shipped inside the Lambda zip:
+#   meta.json       - documents, vocabulary (term -> [postings offset, df]) and corpus stats
+#   postings.bin    - uint32 chunk ids, grouped per term
+#   tfs.bin         - uint16 term frequencies, parallel to postings.bin
+#   chunk_doc.bin   - uint32 document index per chunk
+#   chunk_page.bin  - uint32 page number (1-based) per chunk
+#   chunk_len.bin   - uint32 token count per chunk
+#   text_offsets.bin- uint64 byte offsets into texts.bin (n_chunks + 1 entries)
+#   texts.bin       - UTF-8 chunk texts, memory-mapped at query time
+#   embeddings.npy  - optional float32 (n_chunks, dim) unit vectors
+
+INDEX_VERSION = 1
+STEM_PREFIX = 6
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text):
+    # Lowercase word tokens truncated to a fixed prefix: a cheap stemmer that copes
+    # with Ukrainian inflections (турнікет/турнікета/турнікетом) as well as English
+    tokens = []
+    for tok in _TOKEN_RE.findall(text.lower().replace("'", "").replace("’", "")):
+        if len(tok) < 2 or tok.isdigit():
+            continue
+        tokens.append(tok[:STEM_PREFIX])
+    return tokens
+
+def _read_array(path, typecode):
+    arr = array(typecode)
+    with open(path, 'rb') as f:
+        arr.frombytes(f.read())
+    return arr
+
+def _write_array(path, typecode, values):
+    with open(path, 'wb') as f:
+        array(typecode, values).tofile(f)
+
+def write_index(out_dir, docs, chunks, embeddings=None):
+    # docs: [{'key', 'title', 'pages'}]; chunks: [{'doc', 'page', 'text'}]
+    os.makedirs(out_dir, exist_ok=True)
+
+    term_postings = {}
+    chunk_lens = []
+    for chunk_id, chunk in enumerate(chunks):
+        counts = {}
+        tokens = tokenize(chunk['text'])
+        for tok in tokens:
+            counts[tok] = counts.get(tok, 0) + 1
+        for tok, tf in counts.items():
+            term_postings.setdefault(tok, []).append((chunk_id, min(tf, 65535)))
+        chunk_lens.append(len(tokens))
+
+    vocab = {}
+    postings = array('I')
+    tfs = array('H')
+    for term in sorted(term_postings):
+        entries = term_postings[term]
+        vocab[term] = [len(postings), len(entries)]
+        for chunk_id, tf in entries:
+            postings.append(chunk_id)
+            tfs.append(tf)
+
+    offsets = [0]
+    with open(os.path.join(out_dir, 'texts.bin'), 'wb') as f:
+        for chunk in chunks:
+            data = chunk['text'].encode('utf-8')
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+
+    with open(os.path.join(out_dir, 'postings.bin'), 'wb') as f:
+        postings.tofile(f)
+    with open(os.path.join(out_dir, 'tfs.bin'), 'wb') as f:
+        tfs.tofile(f)
+    _write_array(os.path.join(out_dir, 'chunk_doc.bin'), 'I', [c['doc'] for c in chunks])
+    _write_array(os.path.join(out_dir, 'chunk_page.bin'), 'I', [c['page'] for c in chunks])
+    _write_array(os.path.join(out_dir, 'chunk_len.bin'), 'I', chunk_lens)
+    _write_array(os.path.join(out_dir, 'text_offsets.bin'), 'Q', offsets)
+
+    if embeddings is not None:
+        import numpy as np
+        np.save(os.path.join(out_dir, 'embeddings.npy'), np.asarray(embeddings, dtype=np.float32))
+
+    meta = {
+        'version': INDEX_VERSION,
+        'stem_prefix': STEM_PREFIX,
+        'docs': docs,
+        'n_chunks': len(chunks),
+        'avg_len': (sum(chunk_lens) / len(chunk_lens)) if chunk_lens else 0.0,
+        'vocab': vocab
+    }
+    with open(os.path.join(out_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, separators=(',', ':'))
+    return meta
+
+class KBIndex:
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != INDEX_VERSION or meta.get('stem_prefix') != STEM_PREFIX:
+            raise ValueError(f"Incompatible KB index in {index_dir}")
+
+        self.docs = meta['docs']
+        self.vocab = meta['vocab']
+        self.n_chunks = meta['n_chunks']
+        self.avg_len = meta['avg_len'] or 1.0
+        self.postings = _read_array(os.path.join(index_dir, 'postings.bin'), 'I')
+        self.tfs = _read_array(os.path.join(index_dir, 'tfs.bin'), 'H')
+        self.chunk_doc = _read_array(os.path.join(index_dir, 'chunk_doc.bin'), 'I')
+        self.chunk_page = _read_array(os.path.join(index_dir, 'chunk_page.bin'), 'I')
+        self.chunk_len = _read_array(os.path.join(index_dir, 'chunk_len.bin'), 'I')
+        self.text_offsets = _read_array(os.path.join(index_dir, 'text_offsets.bin'), 'Q')
+
+        self._texts_file = open(os.path.join(index_dir, 'texts.bin'), 'rb')
+        self.texts = mmap.mmap(self._texts_file.fileno(), 0, access=mmap.ACCESS_READ) if self.text_offsets[-1] else b''
+
+        self.embeddings = None
+        emb_path = os.path.join(index_dir, 'embeddings.npy')
+        if os.path.exists(emb_path):
+            try:
+                import numpy as np
+                self.embeddings = np.load(emb_path, mmap_mode='r')
+            except ImportError:
+                pass
+
+    def chunk_text(self, chunk_id):
+        start, end = self.text_offsets[chunk_id], self.text_offsets[chunk_id + 1]
+        return self.texts[start:end].decode('utf-8')
+
+    def bm25_scores(self, question):
+        scores = {}
+        for term in set(tokenize(question)):
+            entry = self.vocab.get(term)
+            if not entry:
+                continue
+            start, df = entry
+            idf = math.log(1 + (self.n_chunks - df + 0.5) / (df + 0.5))
+            for i in range(start, start + df):
+                chunk_id = self.postings[i]
+                tf = self.tfs[i]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.chunk_len[chunk_id] / self.avg_len)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, question, k=5, query_embedding=None, alpha=0.5):
+        scores = self.bm25_scores(question)
+
+        if query_embedding is not None and self.embeddings is not None:
+            import numpy as np
+            q = np.asarray(query_embedding, dtype=np.float32)
+            q /= (np.linalg.norm(q) or 1.0)
+            cosine = self.embeddings @ q
+            top_lexical = max(scores.values()) if scores else 1.0
+            candidates = set(scores) | set(int(i) for i in np.argsort(-cosine)[:k * 4])
+            scores = {
+                c: alpha * scores.get(c, 0.0) / top_lexical + (1 - alpha) * float(cosine[c])
+                for c in candidates
+            }
+
+        ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+        results = []
+        for chunk_id, score in ranked:
+            doc = self.docs[self.chunk_doc[chunk_id]]
+            results.append({
+                'chunk': chunk_id,
+                'doc': doc['key'],
+                'title': doc.get('title', doc['key']),
+                'page': self.chunk_page[chunk_id],
+                'score': round(score, 4),
+                'text': self.chunk_text(chunk_id)
+            })
+        return results
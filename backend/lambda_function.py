@@ -1,220 +1,826 @@
 import json
-import boto3
 import base64
 import os
-from datetime import datetime
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from decimal import Decimal
 
-# Initialize clients
-bedrock_agent_runtime = boto3.client('bedrock-agent-runtime') # For knowledge base
-bedrock_runtime = boto3.client('bedrock-runtime') # For quiz generation
-transcribe = boto3.client('transcribe')
-dynamodb = boto3.resource('dynamodb')
+import aws_clients
+import logs
+import post_invoke
+import tracing
+from aws_clients import MODEL_CONFIG
+from answer_cache import AnswerCache, doc_version, normalize_question
+from history import HistoryWriter
+from leaderboard import WINDOWS, Leaderboard, rank_key, score_shard, window_board
+from json_stream import IncrementalJSONExtractor, repair_json_text
+from quiz_pool import QuizPool, normalize_quiz, question_id, validate_quiz
+from routing import HTTPError, Router, cors, json_body, map_errors, server_timing
+from speech_stream import SUPPORTED_LANGUAGES, SessionLost, UnsupportedEncoding, feed_session
+from timing import stage
+
+# Initialize clients (built lazily on first use, see aws_clients.py)
+bedrock_agent_runtime = aws_clients.client('bedrock-agent-runtime', MODEL_CONFIG) # For knowledge base
+bedrock_runtime = aws_clients.client('bedrock-runtime', MODEL_CONFIG) # For quiz generation
+transcribe = aws_clients.client('transcribe')
+dynamodb = aws_clients.resource('dynamodb')
+lambda_client = aws_clients.client('lambda') # For async quiz pool refills
+# Per-call AWS spans (TRACE_SAMPLE_RATE); hooks go on the session before any client is built
+tracer = tracing.Tracer()
+tracer.install(aws_clients.session)
 
 USERS_TABLE = os.environ.get('USERS_TABLE', 'TacMed_Users')
 HISTORY_TABLE = os.environ.get('HISTORY_TABLE', 'TacMed_History')
+VOICE_JOBS_TABLE = os.environ.get('VOICE_JOBS_TABLE', 'TacMed_VoiceJobs')
+QUIZ_POOL_TABLE = os.environ.get('QUIZ_POOL_TABLE', 'TacMed_QuizPool')
+QUIZ_REFILL_SOURCE = 'tacmed.quiz-refill'
+LEADERBOARD_TABLE = os.environ.get('LEADERBOARD_TABLE', 'TacMed_Leaderboard')
+LEADERBOARD_SHARDS = int(os.environ.get('LEADERBOARD_SHARDS', '10'))
+LEADERBOARD_PAGE_MAX = 50
+SCORE_BATCH_MAX = 200
+SCORE_INCREMENT = 100
+ANSWER_CACHE_TABLE = os.environ.get('ANSWER_CACHE_TABLE', 'TacMed_AnswerCache')
 # KB_ID = os.environ.get('KB_ID') # TODO: Configure Knowledge Base ID
-s3 = boto3.client('s3')
+s3 = aws_clients.client('s3')
 
-def get_kb_bucket():
+def discover_kb_bucket():
     # Priority: Env Var -> Discovery
     env_bucket = os.environ.get('KB_BUCKET')
-    print(f"DEBUG: Env Bucket: {env_bucket}")
     if env_bucket:
         return env_bucket
         
     # Find bucket starting with tacmed-kb-
     try:
-        buckets = s3.list_buckets().get('Buckets', [])
+        with stage('s3'):
+            buckets = s3.list_buckets().get('Buckets', [])
         for b in buckets:
             if b['Name'].startswith('tacmed-kb-'):
                 return b['Name']
     except Exception as e:
-        print(f"Bucket Discovery Error: {e}")
+        logs.error('Bucket discovery failed', error=e)
     return None
 
-def lambda_handler(event, context):
-    print("Event:", json.dumps(event))
-    
-    path = event.get('rawPath')
-    http_method = event.get('requestContext', {}).get('http', {}).get('method')
-    
-    headers = {
-        'Content-Type': 'application/json',
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'OPTIONS,POST,GET',
-        'Access-Control-Allow-Headers': 'Content-Type,Authorization'
-    }
-    
-    if http_method == 'OPTIONS':
-        return {'statusCode': 200, 'headers': headers, 'body': ''}
-        
-    try:
-        if path == '/ask' and http_method == 'POST':
-            return handle_ask(event, headers)
-        elif path == '/quiz' and http_method == 'POST':
-            return handle_quiz(event, headers)
-        elif path == '/leaderboard' and http_method == 'GET':
-            return handle_leaderboard(headers)
-        elif path == '/score' and http_method == 'POST':
-            return handle_score_update(event, headers)
+# Warm-container cache for the KB bucket name and its PDF manifest.
+# Entries older than the TTL are served stale while a background thread refreshes them.
+# A failed discovery or listing is cached too, for KB_CACHE_FAILURE_TTL: until then requests get
+# what the cache has (possibly nothing) instead of each retrying S3 synchronously.
+KB_CACHE_TTL = int(os.environ.get('KB_CACHE_TTL', '300'))
+KB_CACHE_FAILURE_TTL = int(os.environ.get('KB_CACHE_FAILURE_TTL', '30'))
+_kb_cache = {'bucket': None, 'manifest': None, 'loaded_at': 0.0, 'failed_at': 0.0, 'refreshing': False}
+_kb_cache_lock = threading.Lock()
+_kb_cache_stats = {'hits': 0, 'misses': 0, 'stale': 0, 'failed': 0, 'refreshes': 0}
+
+def _kb_recently_failed():
+    return time.time() - _kb_cache['failed_at'] < KB_CACHE_FAILURE_TTL
+
+def get_kb_bucket():
+    # Bucket name only (voice and upload paths), through the same cache as get_kb_resources
+    with _kb_cache_lock:
+        if _kb_cache['bucket'] or _kb_recently_failed():
+            return _kb_cache['bucket']
+    bucket_name = discover_kb_bucket()
+    with _kb_cache_lock:
+        if bucket_name:
+            _kb_cache['bucket'] = bucket_name
         else:
-            return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Not Found'})}
+            _kb_cache['failed_at'] = time.time()
+    return bucket_name
+
+def list_pdf_manifest(bucket_name):
+    manifest = []
+    paginator = s3.get_paginator('list_objects_v2')
+    with stage('s3'):
+        for page in paginator.paginate(Bucket=bucket_name):
+            for obj in page.get('Contents', []):
+                if obj['Key'].endswith('.pdf'):
+                    manifest.append({
+                        'key': obj['Key'],
+                        'etag': obj.get('ETag', '').strip('"'),
+                        'size': obj.get('Size', 0)
+                    })
+    return manifest
+
+def _refresh_kb_cache():
+    try:
+        bucket_name = get_kb_bucket()
+        if not bucket_name:
+            return
+        manifest = list_pdf_manifest(bucket_name)
+        with _kb_cache_lock:
+            _kb_cache['manifest'] = manifest
+            _kb_cache['loaded_at'] = time.time()
+            _kb_cache['failed_at'] = 0.0
+            _kb_cache_stats['refreshes'] += 1
+        logs.info('KB cache refreshed', bucket=bucket_name, pdfs=len(manifest))
     except Exception as e:
-        print("Error:", str(e))
-        return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': str(e)})}
+        logs.error('S3 list failed', error=e)
+        with _kb_cache_lock:
+            _kb_cache['failed_at'] = time.time()
+    finally:
+        with _kb_cache_lock:
+            _kb_cache['refreshing'] = False
+
+def get_kb_resources():
+    # Returns (bucket_name, manifest); manifest is None if the listing has never succeeded
+    with _kb_cache_lock:
+        loaded = _kb_cache['bucket'] is not None and _kb_cache['manifest'] is not None
+        expired = time.time() - _kb_cache['loaded_at'] > KB_CACHE_TTL
+        failed = _kb_recently_failed()
+        if loaded and not expired:
+            _kb_cache_stats['hits'] += 1
+            state = 'hit'
+        elif loaded:
+            _kb_cache_stats['stale'] += 1
+            state = 'stale'
+            if not _kb_cache['refreshing'] and not failed:
+                _kb_cache['refreshing'] = True
+                threading.Thread(target=_refresh_kb_cache, daemon=True).start()
+        elif failed:
+            _kb_cache_stats['failed'] += 1
+            state = 'failed'
+        else:
+            _kb_cache_stats['misses'] += 1
+            state = 'miss'
+            _kb_cache['refreshing'] = True
+
+    if state == 'miss':
+        _refresh_kb_cache()
+
+    logs.count(f"KBCache{state.capitalize()}")
+    with _kb_cache_lock:
+        logs.debug('KB cache', state=state, **_kb_cache_stats)
+        return _kb_cache['bucket'], _kb_cache['manifest']
+
+# Bundled local retrieval index (built by build_kb_index.py, shipped in the zip)
+KB_INDEX_DIR = os.environ.get('KB_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kb_index'))
+KB_TOP_K = int(os.environ.get('KB_TOP_K', '5'))
+KB_USE_EMBEDDINGS = os.environ.get('KB_USE_EMBEDDINGS', '0') == '1'
+# 'local': answer from the local index, and from the routed PDFs (EXTERNAL_SOURCES) only when it
+# has nothing; 'external': every question goes to the routed PDFs, which Bedrock reads whole
+KB_RAG_MODE = os.environ.get('KB_RAG_MODE', 'local')
+_local_index = {'loaded': False, 'index': None}
+
+def get_local_index():
+    if not _local_index['loaded']:
+        _local_index['loaded'] = True
+        try:
+            if os.path.exists(os.path.join(KB_INDEX_DIR, 'meta.json')):
+                from kb_retrieval import KBIndex
+                started = time.time()
+                _local_index['index'] = KBIndex(KB_INDEX_DIR)
+                logs.info('Local KB index loaded', chunks=_local_index['index'].n_chunks,
+                          ms=round((time.time() - started) * 1000))
+            else:
+                logs.warning('Local KB index not found', path=KB_INDEX_DIR)
+        except Exception as e:
+            logs.error('Local KB index load failed', error=e)
+    return _local_index['index']
+
+# Document router (built by build_doc_router.py, shipped next to the local index): which PDFs
+# go to EXTERNAL_SOURCES for a question
+ROUTER_PATH = os.path.join(KB_INDEX_DIR, 'router.json')
+ROUTER_TOP_DOCS = int(os.environ.get('ROUTER_TOP_DOCS', '3'))
+_doc_router = {'loaded': False, 'router': None}
+
+def get_doc_router():
+    if not _doc_router['loaded']:
+        _doc_router['loaded'] = True
+        try:
+            if os.path.exists(ROUTER_PATH):
+                from doc_router import DocRouter
+                _doc_router['router'] = DocRouter(ROUTER_PATH)
+                logs.info('Document router loaded', docs=len(_doc_router['router'].docs))
+            else:
+                logs.warning('Document router not found', path=ROUTER_PATH)
+        except Exception as e:
+            logs.error('Document router load failed', error=e)
+    return _doc_router['router']
+
+def route_documents(question, manifest):
+    # PDF keys for EXTERNAL_SOURCES (at most 5): byte-identical copies once, then the router's
+    # top documents for the question; listing order when there is no router or nothing matches
+    seen = set()
+    pdf_files = []
+    for doc in manifest:
+        if doc.get('etag') and doc['etag'] in seen:
+            continue
+        seen.add(doc.get('etag'))
+        pdf_files.append(doc['key'])
+    router = get_doc_router()
+    if router is None:
+        return pdf_files[:5]
+    with stage('retrieval'):
+        routed = router.route(question, pdf_files, k=min(ROUTER_TOP_DOCS, 5))
+    if not routed:
+        logs.count('RouterNoMatch')
+        return pdf_files[:5]
+    logs.debug('KB routing', docs=routed, candidates=len(pdf_files))
+    return routed
+
+leaderboard = Leaderboard(
+    aws_clients.table(dynamodb, LEADERBOARD_TABLE),
+    aws_clients.table(dynamodb, USERS_TABLE),
+    size=int(os.environ.get('LEADERBOARD_SIZE', '100')),
+    shards=LEADERBOARD_SHARDS,
+    bucket_width=int(os.environ.get('LEADERBOARD_BUCKET', str(SCORE_INCREMENT))),
+    score_step=SCORE_INCREMENT
+)
+
+history = HistoryWriter(aws_clients.table(dynamodb, HISTORY_TABLE) if HISTORY_TABLE else None)
+# History is written after the response goes out (see post_invoke.py), or before it when the
+# extension is not available
+post_invoke.register(lambda: history.flush())
+
+answer_cache = AnswerCache(
+    table=aws_clients.table(dynamodb, ANSWER_CACHE_TABLE) if ANSWER_CACHE_TABLE else None,
+    max_entries=int(os.environ.get('ANSWER_CACHE_SIZE', '256'))
+)
+
+LLAMA_MODEL_ID = 'eu.meta.llama3-2-3b-instruct-v1:0'
+EMBED_MODEL_ID = 'amazon.titan-embed-text-v2:0'
+
+ASK_SYSTEM_PROMPT = """You are an expert TCCC AI Assistant. 
+Answer in the same language as the user. If they ask about 'турнікет', they mean medical tourniquet.
+Respond concisely but accurately based on TCCC standards."""
+
+def llama_prompt(system_prompt, user_prompt):
+    return f"""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+{system_prompt}<|eot_id|><|start_header_id|>user<|end_header_id|>
+{user_prompt}<|eot_id|><|start_header_id|>assistant<|end_header_id|>"""
+
+def invoke_llama(prompt, max_gen_len=512, temperature=0.5, on_token=None):
+    request_body = json.dumps({
+        "prompt": prompt,
+        "max_gen_len": max_gen_len,
+        "temperature": temperature,
+        "top_p": 0.9
+    })
+    if on_token is None:
+        with stage('generation'):
+            response = bedrock_runtime.invoke_model(modelId=LLAMA_MODEL_ID, body=request_body)
+            return json.loads(response.get('body').read())['generation']
+
+    # Streaming: hand each generated fragment to on_token as soon as Bedrock emits it.
+    # A truthy return from on_token stops the generation early.
+    parts = []
+    with stage('generation'):
+        response = bedrock_runtime.invoke_model_with_response_stream(modelId=LLAMA_MODEL_ID, body=request_body)
+        stream = response['body']
+        for event in stream:
+            chunk = event.get('chunk')
+            if not chunk:
+                continue
+            text = json.loads(chunk['bytes']).get('generation', '')
+            if text:
+                parts.append(text)
+                if on_token(text):
+                    if hasattr(stream, 'close'):
+                        stream.close()
+                    break
+    return ''.join(parts)
+
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def wants_stream(event, body):
+    accept = (event.get('headers') or {}).get('accept', '')
+    return bool(body.get('stream')) or 'text/event-stream' in accept
+
+def embed_question(question):
+    response = bedrock_runtime.invoke_model(
+        modelId=EMBED_MODEL_ID,
+        body=json.dumps({'inputText': question, 'normalize': True})
+    )
+    return json.loads(response['body'].read())['embedding']
+
+def retrieve_passages(question):
+    index = get_local_index()
+    if index is None:
+        return []
+    query_embedding = None
+    started = time.time()
+    with stage('retrieval'):
+        if KB_USE_EMBEDDINGS and index.embeddings is not None:
+            try:
+                query_embedding = embed_question(question)
+            except Exception as e:
+                logs.warning('Embedding failed', error=e)
+        passages = index.search(normalize_question(question), k=KB_TOP_K, query_embedding=query_embedding)
+    logs.debug('Local retrieval', passages=len(passages), ms=round((time.time() - started) * 1000, 1))
+    return passages
+
+def build_rag_prompt(question, passages):
+    context = "\n\n".join(
+        f"[{i}] {p['title']} (p. {p['page']}):\n{p['text']}" for i, p in enumerate(passages, start=1)
+    )
+    user_prompt = f"""Use the following excerpts from TCCC guidelines to answer the question.
+If the excerpts do not contain the answer, say so and answer from standard TCCC protocols.
+
+{context}
+
+Question: {question}"""
+    return llama_prompt(ASK_SYSTEM_PROMPT, user_prompt)
+
+def lambda_handler(event, context):
+    tracer.start_request()
+    request_id = getattr(context, 'aws_request_id', None)
+    source = event.get('source')
+    try:
+        if source in ('aws.transcribe', QUIZ_REFILL_SOURCE):
+            logs.start_request(request_id, source)
+            started = time.time()
+            # Transcribe job completion, delivered by the EventBridge rule on "Transcribe Job State Change";
+            # quiz pool refill, from an async self-invocation or the EventBridge schedule
+            result = handle_transcription_event(event) if source == 'aws.transcribe' else run_quiz_refill()
+            logs.end_request(200, (time.time() - started) * 1000)
+            return result
+
+        logs.start_request(request_id, router.route_name(event))
+        # Sampled request shape; the body itself (possibly megabytes of base64 audio) is never logged
+        logs.debug('Request', query=event.get('queryStringParameters'), headers=event.get('headers'),
+                   bodyBytes=len(event.get('body') or ''))
+        return router(event)
+    finally:
+        # The container may be frozen for good once we return: history is written by the post-invoke
+        # extension before that, or here
+        if not post_invoke.after_response():
+            history.flush()
+        tracer.end_request()
 
 def handle_ask(event, headers):
     try:
-        body = json.loads(event.get('body', '{}'))
+        body = event['parsedBody']
         if not body:
             return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Body required'})}
 
         question = body.get('question')
+        audio_key = body.get('audioKey')
         audio_data = body.get('audio')
         
-        if audio_data:
-            # Handle audio transcription
+        if audio_key or audio_data:
+            # Voice queries are asynchronous: start transcription and hand back a job id to poll.
+            # audioKey (presigned upload) is preferred; inline base64 audio is kept for older clients
             try:
-                bucket_name = get_kb_bucket()
-                if not bucket_name:
-                    raise Exception("Storage bucket not found")
-                    
-                # Decode and save to /tmp
-                audio_bytes = base64.b64decode(audio_data)
-                timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-                file_name = f"audio_{timestamp}.webm"
-                s3_key = f"audio-temp/{file_name}"
-                
-                # Upload to S3
-                s3.put_object(Bucket=bucket_name, Key=s3_key, Body=audio_bytes)
-                
-                # Start Transcription
-                job_name = f"Transcribe_{timestamp}"
-                media_uri = f"s3://{bucket_name}/{s3_key}"
-                
-                transcribe.start_transcription_job(
-                    TranscriptionJobName=job_name,
-                    Media={'MediaFileUri': media_uri},
-                    MediaFormat='webm',
-                    LanguageCode='en-US'
-                )
-                
-                # Polling for completion (Max 20 seconds for prototype)
-                import time
-                max_retries = 20
-                for _ in range(max_retries):
-                    status = transcribe.get_transcription_job(TranscriptionJobName=job_name)
-                    job_status = status['TranscriptionJob']['TranscriptionJobStatus']
-                    if job_status in ['COMPLETED', 'FAILED']:
-                        break
-                    time.sleep(1)
-                
-                if job_status == 'COMPLETED':
-                    transcript_uri = status['TranscriptionJob']['Transcript']['TranscriptFileUri']
-                    import urllib.request
-                    with urllib.request.urlopen(transcript_uri) as url:
-                        data = json.loads(url.read().decode())
-                        # Check if transcripts exist
-                        if data['results']['transcripts']:
-                            question = data['results']['transcripts'][0]['transcript']
-                            print(f"DEBUG: Transcribed text: '{question}'")
-                        else:
-                            print("DEBUG: Empty transcript")
-                            question = ""
-                            
-                        if not question:
-                             return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'answer': "Radio check. converting... I heard nothing. Please check your microphone."})}
+                if audio_key:
+                    job = start_voice_job(language_code=voice_language(body), audio_key=audio_key, user_id=body.get('userId'))
                 else:
-                    raise Exception("Transcription timed out or failed")
-                    
+                    job = start_voice_job(base64.b64decode(audio_data), voice_language(body), voice_format(body),
+                                          user_id=body.get('userId'))
+                return {'statusCode': 202, 'headers': headers, 'body': json.dumps({
+                    'jobId': job['JobId'],
+                    'status': job['Status'],
+                    'answer': "Voice query received. Transcribing..."
+                })}
             except Exception as e:
-                print(f"Transcribe Error: {e}")
+                logs.error('Voice job start failed', error=e)
                 return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'answer': f"Voice Systems Offline: {str(e)} (Check logs)"})}
 
         if not question:
             return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Question required'})}
             
-        # RAG Logic: Use Bedrock's retrieve_and_generate with multiple TCCC documents from S3
-        bucket_name = get_kb_bucket()
-        if not bucket_name:
-             return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'answer': "Storage error: KB bucket not found."})}
-        
-        # Get all PDF files from the bucket (EXTERNAL_SOURCES supports up to 5 files)
-        try:
-            pdf_files = []
-            response = s3.list_objects_v2(Bucket=bucket_name)
-            for obj in response.get('Contents', []):
-                key = obj['Key']
-                if key.endswith('.pdf'):
-                    pdf_files.append(key)
-            print(f"DEBUG: Found {len(pdf_files)} PDF files in bucket")
-        except Exception as e:
-            print(f"S3 list error: {e}")
-            pdf_files = ['clinical-guidelines-2024-ua.pdf']  # Fallback to known file
-        
-        # Build sources list (max 5 for EXTERNAL_SOURCES API)
-        sources = []
-        for pdf_key in pdf_files[:5]:
-            sources.append({
-                'sourceType': 'S3',
-                's3Location': {
-                    'uri': f"s3://{bucket_name}/{pdf_key}"
-                }
-            })
-        
-        if not sources:
-            return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'answer': "No training documents found in storage."})}
-        
-        # Use regional model ID as base for ARN
-        region = 'eu-central-1'
-        # Note: EXTERNAL_SOURCES is a cost-effective way to do RAG on small sets of files
-        model_arn = f"arn:aws:bedrock:{region}::foundation-model/meta.llama3-2-3b-instruct-v1:0"
-        
-        try:
-            response = bedrock_agent_runtime.retrieve_and_generate(
-                input={'text': question},
-                retrieveAndGenerateConfiguration={
-                    'type': 'EXTERNAL_SOURCES',
-                    'externalSourcesConfiguration': {
-                        'modelArn': model_arn,
-                        'sources': sources
-                    }
-                }
-            )
-            answer = response['output']['text']
-        except Exception as rag_err:
-            print(f"RAG Error (External Sources): {rag_err}")
-            # Fallback to direct invocation if RAG fails (e.g. region lack of support)
-            system_prompt = """You are an expert TCCC AI Assistant. 
-Answer in the same language as the user. If they ask about 'турнікет', they mean medical tourniquet.
-Respond concisely but accurately based on TCCC standards."""
-            
-            final_prompt = f"""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
-{system_prompt}<|eot_id|><|start_header_id|>user<|end_header_id|>
-{question}<|eot_id|><|start_header_id|>assistant<|end_header_id|>"""
-
-            fallback_resp = bedrock_runtime.invoke_model(
-                modelId='eu.meta.llama3-2-3b-instruct-v1:0',
-                body=json.dumps({
-                    "prompt": final_prompt,
-                    "max_gen_len": 512,
-                    "temperature": 0.5,
-                    "top_p": 0.9
-                })
-            )
-            answer = json.loads(fallback_resp.get('body').read())['generation']
-        
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'answer': answer})}
+        stream = wants_stream(event, body)
+        started = time.time()
+        tokens = []
+        first_token = {}
+
+        def on_token(text):
+            if not first_token:
+                # When the model produced its first token; the client only sees it with the rest of
+                # the body (see stream_response)
+                first_token['ms'] = (time.time() - started) * 1000
+                logs.measure('ModelFirstToken', round(first_token['ms'], 1))
+            tokens.append(text)
+
+        payload = cached_answer(question, on_token=on_token if stream else None)
+        history.record(body.get('userId'), 'ask', Question=question, Answer=payload.get('answer'), Channel='text')
+        if stream:
+            if ''.join(tokens) != payload.get('answer'):
+                # Cache hits and canned replies never went through the model, and a stream that failed
+                # partway was replaced by a full answer
+                tokens = [payload.get('answer') or '']
+            events = [sse_event({'token': text}) for text in tokens]
+            events.append(sse_event(payload, event='done'))
+            return stream_response(headers, events)
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(payload)}
         
     except Exception as e:
-        print(f"Error in ask: {e}")
+        logs.error('Ask failed', error=e)
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'answer': f"HQ Offline: {str(e)}"})}
 
-def handle_quiz(event, headers):
+def cached_answer(question, on_token=None):
+    # Answer cache: keyed on the normalized question and the KB document version
+    bucket_name, manifest = get_kb_resources()
+    version = doc_version(manifest)
+    with stage('cache'):
+        cached, tier = answer_cache.get(question, version)
+    if cached is not None:
+        logs.count('AnswerCacheHit')
+        logs.debug('Answer cache hit', tier=tier, cache=answer_cache.summary())
+        return cached
+
+    started = time.time()
+    payload, cacheable = answer_question(question, bucket_name, manifest, on_token=on_token)
+    latency_ms = (time.time() - started) * 1000
+    if cacheable and manifest is not None:
+        with stage('cache'):
+            answer_cache.put(question, version, payload, latency_ms)
+    logs.count('AnswerCacheMiss')
+    logs.debug('Answer cache miss', ms=round(latency_ms), cache=answer_cache.summary())
+    return payload
+
+# Voice jobs: /ask stores the audio and starts Transcribe, the completion event (or a
+# status poll, when no event has arrived yet) runs RAG and stores the answer in VOICE_JOBS_TABLE
+VOICE_JOB_PREFIX = 'TacMed_'
+VOICE_JOB_TTL = int(os.environ.get('VOICE_JOB_TTL', '86400'))
+
+def voice_language(body):
+    language = body.get('language', 'en-US')
+    return language if language in SUPPORTED_LANGUAGES else 'en-US'
+
+def voice_format(body):
+    media_format = body.get('format', 'webm')
+    return media_format if media_format in ['webm', 'ogg'] else 'webm'
+
+AUDIO_KEY_RE = re.compile(r'^audio-temp/([0-9a-f]{32})\.(webm|ogg)$')
+UPLOAD_URL_TTL = 300
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_PART_SIZE = 5 * 1024 * 1024
+S3_MAX_PARTS = 10000
+# Longest recording /ask/upload signs URLs for; a voice question is seconds of Opus, this is hours.
+# Never more than S3 can assemble from MULTIPART_PART_SIZE parts
+UPLOAD_MAX_BYTES = min(int(os.environ.get('UPLOAD_MAX_BYTES', str(200 * 1024 * 1024))), MULTIPART_PART_SIZE * S3_MAX_PARTS)
+# complete_multipart_upload errors caused by what the client sent, answered with 400
+UPLOAD_CLIENT_ERRORS = {'NoSuchUpload', 'InvalidPart', 'InvalidPartOrder', 'EntityTooSmall'}
+
+def start_voice_job(audio_bytes=None, language_code='en-US', media_format='webm', audio_key=None, user_id=None):
+    bucket_name = get_kb_bucket()
+    if not bucket_name:
+        raise Exception("Storage bucket not found")
+
+    if audio_key:
+        # Audio was uploaded straight to S3 through a presigned URL from /ask/upload
+        match = AUDIO_KEY_RE.match(audio_key)
+        if not match:
+            raise ValueError("Invalid audio key")
+        job_id, media_format = match.group(1), match.group(2)
+        s3_key = audio_key
+    else:
+        # uuid4 ids cannot collide when several medics talk in the same second
+        job_id = uuid.uuid4().hex
+        s3_key = f"audio-temp/{job_id}.{media_format}"
+        with stage('s3'):
+            s3.put_object(Bucket=bucket_name, Key=s3_key, Body=audio_bytes)
+
+    with stage('transcribe'):
+        transcribe.start_transcription_job(
+            TranscriptionJobName=f"{VOICE_JOB_PREFIX}{job_id}",
+            Media={'MediaFileUri': f"s3://{bucket_name}/{s3_key}"},
+            MediaFormat=media_format,
+            LanguageCode=language_code
+        )
+
+    job = {
+        'JobId': job_id,
+        'Status': 'TRANSCRIBING',
+        'Bucket': bucket_name,
+        'AudioKey': s3_key,
+        'CreatedAt': datetime.now(timezone.utc).isoformat(),
+        'ExpiresAt': int(time.time()) + VOICE_JOB_TTL
+    }
+    if user_id:
+        job['UserId'] = user_id
+    with stage('db'):
+        dynamodb.Table(VOICE_JOBS_TABLE).put_item(Item=job)
+    return job
+
+def _int_param(value, minimum=1):
+    # JSON integers and digit strings; None for anything else (floats, booleans, values below minimum)
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        return None
+    return value
+
+def upload_size(body):
+    size = _int_param(body.get('size'))
+    if size is None:
+        raise HTTPError(400, 'size must be a positive integer (bytes)')
+    if size > UPLOAD_MAX_BYTES:
+        raise HTTPError(400, f"size must be at most {UPLOAD_MAX_BYTES} bytes")
+    return size
+
+def upload_parts(parts):
+    # The client's [{'PartNumber', 'ETag'}] list, checked before it reaches S3
+    if not isinstance(parts, list) or not parts or len(parts) > S3_MAX_PARTS:
+        raise HTTPError(400, f"parts must be a list of 1 to {S3_MAX_PARTS} parts")
+    checked = []
+    for part in parts:
+        number = _int_param(part.get('PartNumber')) if isinstance(part, dict) else None
+        if number is None or number > S3_MAX_PARTS:
+            raise HTTPError(400, f"PartNumber must be an integer from 1 to {S3_MAX_PARTS}")
+        if checked and number <= checked[-1]['PartNumber']:
+            raise HTTPError(400, 'parts must be in ascending PartNumber order')
+        etag = part.get('ETag')
+        if not isinstance(etag, str) or not etag or len(etag) > 128:
+            raise HTTPError(400, 'every part needs its ETag')
+        checked.append({'PartNumber': number, 'ETag': etag})
+    return checked
+
+def handle_ask_upload(event, headers):
+    # Hands out presigned PUT URLs so recordings go straight to S3 and the Lambda only sees a key
+    body = event['parsedBody']
+    size = upload_size(body)
+    bucket_name = get_kb_bucket()
+    if not bucket_name:
+        return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': 'Storage bucket not found'})}
+
+    media_format = voice_format(body)
+    s3_key = f"audio-temp/{uuid.uuid4().hex}.{media_format}"
+    content_type = f"audio/{media_format}"
+
+    if size <= MULTIPART_THRESHOLD:
+        upload_url = s3.generate_presigned_url(
+            'put_object',
+            Params={'Bucket': bucket_name, 'Key': s3_key, 'ContentType': content_type},
+            ExpiresIn=UPLOAD_URL_TTL
+        )
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
+            'audioKey': s3_key, 'uploadUrl': upload_url, 'contentType': content_type
+        })}
+
+    upload_id = s3.create_multipart_upload(Bucket=bucket_name, Key=s3_key, ContentType=content_type)['UploadId']
+    part_count = (size + MULTIPART_PART_SIZE - 1) // MULTIPART_PART_SIZE
+    part_urls = [
+        s3.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': bucket_name, 'Key': s3_key, 'UploadId': upload_id, 'PartNumber': part_number},
+            ExpiresIn=UPLOAD_URL_TTL
+        )
+        for part_number in range(1, part_count + 1)
+    ]
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
+        'audioKey': s3_key, 'uploadId': upload_id, 'partSize': MULTIPART_PART_SIZE, 'partUrls': part_urls
+    })}
+
+def handle_ask_upload_complete(event, headers):
+    body = event['parsedBody']
+    audio_key = body.get('audioKey')
+    upload_id = body.get('uploadId')
+    if not isinstance(audio_key, str) or not AUDIO_KEY_RE.match(audio_key) or not isinstance(upload_id, str) \
+            or not upload_id or not body.get('parts'):
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'audioKey, uploadId and parts required'})}
+    parts = upload_parts(body['parts'])
+
+    try:
+        with stage('s3'):
+            s3.complete_multipart_upload(
+                Bucket=get_kb_bucket(),
+                Key=audio_key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+    except Exception as e:
+        code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+        if code in UPLOAD_CLIENT_ERRORS:
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f"Upload rejected by storage: {code}"})}
+        raise
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'audioKey': audio_key})}
+
+def read_transcript(transcript_uri):
+    import urllib.request # Only the batch voice path needs it; kept off the cold-start import
+    with urllib.request.urlopen(transcript_uri) as url:
+        data = json.loads(url.read().decode())
+    transcripts = data['results']['transcripts']
+    return transcripts[0]['transcript'] if transcripts else ""
+
+def complete_voice_job(job_id, transcription_job):
+    table = dynamodb.Table(VOICE_JOBS_TABLE)
+    # Claim the job so the event handler and a concurrent status poll never both run RAG
+    try:
+        job = table.update_item(
+            Key={'JobId': job_id},
+            UpdateExpression="SET #s = :answering",
+            ConditionExpression="#s = :transcribing",
+            ExpressionAttributeNames={'#s': 'Status'},
+            ExpressionAttributeValues={':answering': 'ANSWERING', ':transcribing': 'TRANSCRIBING'},
+            ReturnValues="ALL_NEW"
+        )['Attributes']
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
+
+    question = ""
+    try:
+        if transcription_job['TranscriptionJobStatus'] == 'COMPLETED':
+            question = read_transcript(transcription_job['Transcript']['TranscriptFileUri'])
+            logs.debug('Transcribed', question=question)
+            if question:
+                answer = cached_answer(question)
+            else:
+                answer = {'answer': "Radio check. converting... I heard nothing. Please check your microphone."}
+        else:
+            reason = transcription_job.get('FailureReason', 'unknown error')
+            answer = {'answer': f"Voice Systems Offline: Transcription failed ({reason})"}
+    except Exception as e:
+        logs.error('Voice job failed', job=job_id, error=e)
+        answer = {'answer': f"Voice Systems Offline: {str(e)} (Check logs)"}
+    finally:
+        cleanup_voice_job(job)
+
+    answer = dict(answer, question=question)
+    history.record(job.get('UserId'), 'ask', Question=question, Answer=answer.get('answer'), Channel='voice')
+    table.update_item(
+        Key={'JobId': job_id},
+        UpdateExpression="SET #s = :done, Answer = :answer",
+        ExpressionAttributeNames={'#s': 'Status'},
+        ExpressionAttributeValues={':done': 'DONE', ':answer': json.dumps(answer, ensure_ascii=False)}
+    )
+    return answer
+
+def cleanup_voice_job(job):
+    try:
+        s3.delete_object(Bucket=job['Bucket'], Key=job['AudioKey'])
+        transcribe.delete_transcription_job(TranscriptionJobName=f"{VOICE_JOB_PREFIX}{job['JobId']}")
+    except Exception as e:
+        logs.warning('Voice job cleanup failed', job=job['JobId'], error=e)
+
+def handle_transcription_event(event):
+    detail = event.get('detail', {})
+    job_name = detail.get('TranscriptionJobName', '')
+    if not job_name.startswith(VOICE_JOB_PREFIX):
+        return {'status': 'ignored'}
+    transcription_job = transcribe.get_transcription_job(TranscriptionJobName=job_name)['TranscriptionJob']
+    complete_voice_job(job_name[len(VOICE_JOB_PREFIX):], transcription_job)
+    return {'status': 'ok'}
+
+def handle_ask_stream(event, headers):
+    # One MediaRecorder chunk per call; returns the partial transcript, and the answer once final
+    body = event['parsedBody']
+    session_id = body.get('sessionId')
+    if not session_id or 'seq' not in body:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'sessionId and seq required'})}
+
+    seq = _int_param(body['seq'], minimum=0)
+    if seq is None:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'seq must be a non-negative integer'})}
+    try:
+        chunk = base64.b64decode(body.get('audio') or '', validate=True)
+    except (TypeError, ValueError):
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'audio must be base64'})}
+
+    try:
+        with stage('transcribe'):
+            transcript, final = feed_session(
+                session_id, seq, chunk,
+                voice_language(body), body.get('encoding', 'ogg-opus'),
+                final=bool(body.get('final'))
+            )
+    except SessionLost:
+        return {'statusCode': 409, 'headers': headers, 'body': json.dumps({'error': 'Session lost', 'sessionId': session_id})}
+    except UnsupportedEncoding as e:
+        return {'statusCode': 415, 'headers': headers, 'body': json.dumps({'error': str(e)})}
+
+    if not final:
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'sessionId': session_id, 'partial': transcript})}
+
+    logs.debug('Streamed transcript', transcript=transcript)
+    if not transcript:
+        payload = {'answer': "Radio check. converting... I heard nothing. Please check your microphone."}
+    else:
+        payload = cached_answer(transcript)
+    history.record(body.get('userId'), 'ask', Question=transcript, Answer=payload.get('answer'), Channel='voice-stream')
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps(dict(payload, sessionId=session_id, question=transcript))}
+
+def handle_ask_status(event, headers):
+    job_id = (event.get('queryStringParameters') or {}).get('jobId')
+    if not job_id:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'jobId required'})}
+
+    with stage('db'):
+        job = dynamodb.Table(VOICE_JOBS_TABLE).get_item(Key={'JobId': job_id}).get('Item')
+    if not job:
+        return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Job not found'})}
+
+    if job['Status'] == 'DONE':
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
+            'jobId': job_id, 'status': 'DONE', **json.loads(job['Answer'])
+        })}
+
+    if job['Status'] == 'TRANSCRIBING':
+        # Local stand-in for the completion event: check Transcribe once, never sleep
+        with stage('transcribe'):
+            transcription_job = transcribe.get_transcription_job(
+                TranscriptionJobName=f"{VOICE_JOB_PREFIX}{job_id}"
+            )['TranscriptionJob']
+        if transcription_job['TranscriptionJobStatus'] in ['COMPLETED', 'FAILED']:
+            answer = complete_voice_job(job_id, transcription_job)
+            if answer is not None:
+                return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
+                    'jobId': job_id, 'status': 'DONE', **answer
+                })}
+
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'jobId': job_id, 'status': job['Status']})}
+
+def stream_response(headers, events):
+    # The SSE events are buffered and returned as one body: the managed Python runtime has no Lambda
+    # response streaming and API Gateway proxy integrations buffer the response anyway, so the client
+    # gets every token at once, when generation is done. The format lets app.js render tokens
+    # incrementally once the function sits behind a streaming front end (Function URL with
+    # RESPONSE_STREAM through the Lambda Web Adapter); until then it does not shorten time to first token.
+    stream_headers = dict(headers)
+    stream_headers['Content-Type'] = 'text/event-stream; charset=utf-8'
+    stream_headers['Cache-Control'] = 'no-cache'
+    return {'statusCode': 200, 'headers': stream_headers, 'body': ''.join(events)}
+
+def answer_question(question, bucket_name, manifest, on_token=None):
+    # Returns (payload, cacheable); with on_token the answer is generated through the streaming APIs
+    # Local RAG: send only the top-k chunks from the bundled index to the model
+    # A stream that fails partway falls back exactly like a failed call: the SSE body is buffered
+    # (stream_response), so no token has reached the client, and handle_ask rebuilds the events
+    # from the final answer
+    try:
+        passages = retrieve_passages(question) if KB_RAG_MODE != 'external' else []
+        if passages:
+            answer = invoke_llama(build_rag_prompt(question, passages), on_token=on_token)
+            sources = [{'document': p['doc'], 'page': p['page']} for p in passages]
+            return {'answer': answer, 'sources': sources}, True
+    except Exception as local_err:
+        logs.error('Local RAG failed', error=local_err)
+        logs.count('LocalRagError')
+
+    # RAG Logic: Use Bedrock's retrieve_and_generate with multiple TCCC documents from S3
+    if not bucket_name:
+        return {'answer': "Storage error: KB bucket not found."}, False
+    
+    # PDF manifest comes from the warm-container cache (EXTERNAL_SOURCES supports up to 5 files);
+    # until a listing succeeds, the router's own document list stands in for it
+    router = get_doc_router()
+    if manifest is None and router is None:
+        pdf_files = ['clinical-guidelines-2024-ua.pdf']  # Fallback to known file
+    else:
+        pdf_files = route_documents(question, manifest if manifest is not None else router.docs)
+    logs.debug('KB sources', pdfs=len(pdf_files))
+    
+    # Build sources list (max 5 for EXTERNAL_SOURCES API)
+    sources = []
+    for pdf_key in pdf_files:
+        sources.append({
+            'sourceType': 'S3',
+            's3Location': {
+                'uri': f"s3://{bucket_name}/{pdf_key}"
+            }
+        })
+    
+    if not sources:
+        return {'answer': "No training documents found in storage."}, False
+    
+    # Use regional model ID as base for ARN
+    region = 'eu-central-1'
+    # Note: EXTERNAL_SOURCES is a cost-effective way to do RAG on small sets of files
+    model_arn = f"arn:aws:bedrock:{region}::foundation-model/meta.llama3-2-3b-instruct-v1:0"
+    
+    rag_config = {
+        'type': 'EXTERNAL_SOURCES',
+        'externalSourcesConfiguration': {
+            'modelArn': model_arn,
+            'sources': sources
+        }
+    }
+    streamed = []
     try:
-        # Prompt for TCCC scenario generation (Llama 3 Format)
-        system_prompt = "You are an expert military medical instructor teaching Tactical Combat Casualty Care (TCCC)."
-        user_prompt = """Generate a multiple-choice quiz question based on standard TCCC protocols (MARCH-PAWS).
+        with stage('generation'):
+            if on_token is None:
+                response = bedrock_agent_runtime.retrieve_and_generate(
+                    input={'text': question},
+                    retrieveAndGenerateConfiguration=rag_config
+                )
+                answer = response['output']['text']
+            else:
+                response = bedrock_agent_runtime.retrieve_and_generate_stream(
+                    input={'text': question},
+                    retrieveAndGenerateConfiguration=rag_config
+                )
+                for event in response['stream']:
+                    text = event.get('output', {}).get('text')
+                    if text:
+                        streamed.append(text)
+                        on_token(text)
+                answer = ''.join(streamed)
+    except Exception as rag_err:
+        logs.warning('External-sources RAG failed, answering without retrieval', error=rag_err)
+        logs.count('RagFallback')
+        # Fallback to direct invocation if RAG fails (e.g. region lack of support), also after a
+        # partial stream; not cached, so it does not outlive the outage that caused it
+        return {'answer': invoke_llama(llama_prompt(ASK_SYSTEM_PROMPT, question), on_token=on_token)}, False
+
+    return {'answer': answer}, True
+
+QUIZ_SYSTEM_PROMPT = "You are an expert military medical instructor teaching Tactical Combat Casualty Care (TCCC)."
+QUIZ_USER_PROMPT = """Generate a multiple-choice quiz question based on standard TCCC protocols (MARCH-PAWS).
         Return purely JSON with the following structure:
         {
             "question": "The scenario text...",
@@ -223,105 +829,409 @@ def handle_quiz(event, headers):
             "explanation": "Why this is the correct answer."
         }
         Do not output any markdown formatting, just the raw JSON string."""
-        
-        final_prompt = f"""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
-{system_prompt}<|eot_id|><|start_header_id|>user<|end_header_id|>
-{user_prompt}<|eot_id|><|start_header_id|>assistant<|end_header_id|>"""
 
-        body = json.dumps({
-            "prompt": final_prompt,
-            "max_gen_len": 1000,
-            "temperature": 0.5,
-            "top_p": 0.9
-        })
+FALLBACK_QUIZ = {
+    "question": "Fallback: During Care Under Fire, what is the only medically indicated intervention?",
+    "options": ["Airway management", "Tourniquet application", "Needle decompression", "IV access"],
+    "correct_index": 1,
+    "explanation": "Hemorrhage control via tourniquet is the only approved intervention in CUF."
+}
 
-        # Invoke Llama 3 (EU region)
-        model_id = 'eu.meta.llama3-2-3b-instruct-v1:0'
-        
-        response = bedrock_runtime.invoke_model(
-            modelId=model_id,
-            body=body
-        )
-        
-        response_body = json.loads(response.get('body').read())
-        content_text = response_body['generation']
-        
-        # Parse JSON from model output (handling potential markdown wrapper and preambles)
-        import re
-        clean_json = content_text.strip()
-        
-        # Try to find JSON block in markdown
-        json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', clean_json, re.DOTALL)
-        if json_match:
-            clean_json = json_match.group(1)
+quiz_pool = QuizPool(
+    aws_clients.table(dynamodb, QUIZ_POOL_TABLE),
+    low_watermark=int(os.environ.get('QUIZ_POOL_LOW_WATERMARK', '20'))
+)
+QUIZ_POOL_TARGET = int(os.environ.get('QUIZ_POOL_TARGET', '60'))
+QUIZ_REFILL_BATCH = int(os.environ.get('QUIZ_REFILL_BATCH', '10'))
+QUIZ_REFILL_COOLDOWN = 30
+_quiz_refill_state = {'last_trigger': 0.0}
+
+QUIZ_REPAIR_PROMPT = """The following quiz question is invalid: {problems}.
+        Return the corrected question as a single raw JSON object with "question", "options" (exactly four distinct strings),
+        "correct_index" (an integer from 0 to 3) and "explanation" (non-empty). Do not output anything else.
+
+        {raw}"""
+QUIZ_REPAIR_RETRIES = int(os.environ.get('QUIZ_REPAIR_RETRIES', '1'))
+quiz_gen_stats = {'generations': 0, 'model_calls': 0, 'early_stops': 0, 'stream_chunks': 0,
+                  'local_repairs': 0, 'repair_calls': 0, 'failures': 0}
+
+def stream_quiz_objects(prompt, max_gen_len, wanted):
+    # Streams one generation through the incremental extractor, validating objects as they close;
+    # stops the model as soon as `wanted` valid questions arrived or the JSON array closed.
+    # Returns (valid, rejected) where rejected holds (raw_text, problems) pairs for repair.
+    extractor = IncrementalJSONExtractor()
+    valid = []
+    rejected = []
+    state = {'stopped': False}
+
+    def on_token(text):
+        quiz_gen_stats['stream_chunks'] += 1
+        for obj in extractor.feed(text):
+            quiz = normalize_quiz(obj)
+            problems = validate_quiz(quiz)
+            if problems:
+                rejected.append((json.dumps(obj, ensure_ascii=False), problems))
+            else:
+                valid.append(quiz)
+        state['stopped'] = len(valid) >= wanted or extractor.array_closed
+        return state['stopped']
+
+    quiz_gen_stats['model_calls'] += 1
+    invoke_llama(prompt, max_gen_len=max_gen_len, on_token=on_token)
+    if state['stopped']:
+        quiz_gen_stats['early_stops'] += 1
+
+    rejected.extend((raw, ['invalid JSON']) for raw in extractor.errors)
+    pending = extractor.pending()
+    if pending and len(valid) < wanted:
+        # Generation ran out of tokens mid-object: close it locally if it stopped between fields
+        repaired = normalize_quiz(repair_json_text(pending, truncated=True))
+        if repaired is not None and not validate_quiz(repaired):
+            quiz_gen_stats['local_repairs'] += 1
+            valid.append(repaired)
         else:
-             # Fallback: Try to find the first { and last }
-            json_match = re.search(r'(\{.*\})', clean_json, re.DOTALL)
-            if json_match:
-                clean_json = json_match.group(1)
-            
+            rejected.append((pending, ['truncated JSON']))
+    return valid, rejected
+
+def generate_quiz_question():
+    # Invoke Llama 3 (EU region); a rejected answer gets a bounded number of repair calls
+    quiz_gen_stats['generations'] += 1
+    try:
+        valid, rejected = stream_quiz_objects(llama_prompt(QUIZ_SYSTEM_PROMPT, QUIZ_USER_PROMPT), 1000, 1)
+        for _ in range(QUIZ_REPAIR_RETRIES):
+            if valid:
+                break
+            quiz_gen_stats['repair_calls'] += 1
+            if rejected:
+                raw, problems = rejected[-1]
+                prompt = llama_prompt(QUIZ_SYSTEM_PROMPT, QUIZ_REPAIR_PROMPT.format(problems='; '.join(problems), raw=raw[:3000]))
+            else:
+                # Nothing JSON-like came back at all: ask again from scratch
+                prompt = llama_prompt(QUIZ_SYSTEM_PROMPT, QUIZ_USER_PROMPT)
+            valid, rejected = stream_quiz_objects(prompt, 1000, 1)
+        if not valid:
+            problems = rejected[-1][1] if rejected else ['no JSON in model output']
+            raise ValueError(f"Invalid quiz: {', '.join(problems)}")
+    except Exception:
+        quiz_gen_stats['failures'] += 1
+        raise
+    return valid[0]
+
+def quiz_gen_summary():
+    generations = quiz_gen_stats['generations']
+    return dict(
+        quiz_gen_stats,
+        fallback_rate=round(quiz_gen_stats['failures'] / generations, 3) if generations else 0.0
+    )
+
+QUIZ_BATCH_PROMPT = """Generate {count} different multiple-choice quiz questions based on standard TCCC protocols (MARCH-PAWS).
+        Cover different phases of care and different injuries; do not repeat scenarios.
+        Return purely a JSON array where every element has the following structure:
+        {{
+            "question": "The scenario text...",
+            "options": ["Option A", "Option B", "Option C", "Option D"],
+            "correct_index": 0,
+            "explanation": "Why this is the correct answer."
+        }}
+        Do not output any markdown formatting, just the raw JSON array."""
+QUIZ_MAX_COUNT = 20
+QUIZ_QUESTIONS_PER_CALL = int(os.environ.get('QUIZ_QUESTIONS_PER_CALL', '5'))
+QUIZ_MAX_WORKERS = int(os.environ.get('QUIZ_MAX_WORKERS', '4'))
+QUIZ_TOKENS_PER_QUESTION = 300
+
+def generate_quiz_batch(count):
+    # One model call for up to QUIZ_QUESTIONS_PER_CALL questions; returns only the valid ones
+    prompt = llama_prompt(QUIZ_SYSTEM_PROMPT, QUIZ_BATCH_PROMPT.format(count=count))
+    valid, rejected = stream_quiz_objects(prompt, min(2048, QUIZ_TOKENS_PER_QUESTION * count + 100), count)
+    for _, problems in rejected:
+        logs.debug('Quiz item rejected', problems=problems)
+    return valid[:count]
+
+def generate_quiz_questions(count):
+    # Splits count into batched calls, run concurrently on a bounded pool; one top-up round for rejects
+    questions = []
+    seen = set()
+    for _ in range(2):
+        missing = count - len(questions)
+        if missing <= 0:
+            break
+        sizes = [min(QUIZ_QUESTIONS_PER_CALL, missing - i) for i in range(0, missing, QUIZ_QUESTIONS_PER_CALL)]
+        with ThreadPoolExecutor(max_workers=min(QUIZ_MAX_WORKERS, len(sizes))) as executor:
+            futures = [executor.submit(generate_quiz_batch, size) for size in sizes]
+            for future in as_completed(futures):
+                try:
+                    batch = future.result()
+                except Exception as e:
+                    logs.error('Quiz batch failed', error=e)
+                    continue
+                for quiz in batch:
+                    qid = question_id(quiz)
+                    if qid not in seen:
+                        seen.add(qid)
+                        questions.append(quiz)
+    return questions[:count]
+
+def handle_quiz(event, headers):
+    body = event['parsedBody']
+    try:
+        count = int(body.get('count', 1))
+    except (TypeError, ValueError):
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'count must be an integer'})}
+    if count > 1:
+        return handle_quiz_drill(min(count, QUIZ_MAX_COUNT), headers)
+
+    quiz_data = None
+    try:
+        with stage('db'):
+            quiz_data = quiz_pool.take()
+    except Exception as e:
+        logs.error('Quiz pool read failed', error=e)
+
+    if quiz_data is None:
+        # Pool empty or unavailable: generate synchronously as before
         try:
-            quiz_data = json.loads(clean_json)
-        except json.JSONDecodeError:
-            print(f"JSON Parse Error. Raw content: {content_text}")
-            raise
-        
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(quiz_data)}
-        
+            quiz_data = generate_quiz_question()
+            quiz_served(live=1)
+        except Exception as e:
+            logs.error('Quiz generation failed, serving fallback', error=e)
+            # Fallback for demo purposes if Bedrock fails or permissions issue
+            quiz_data = FALLBACK_QUIZ
+            quiz_served(fallback=1)
+        trigger_quiz_refill()
+    else:
+        quiz_served(pooled=1)
+        if quiz_pool.needs_refill():
+            trigger_quiz_refill()
+
+    logs.debug('Quiz served', pool=quiz_pool.summary(), generation=quiz_gen_summary())
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps(quiz_data)}
+
+def quiz_served(pooled=0, live=0, fallback=0):
+    # Where the questions came from and the pool depth, as EMF metrics on the request record (the
+    # 'Quiz served' debug line with the full summary is sampled)
+    quiz_pool.stats['served_live'] += live
+    quiz_pool.stats['served_fallback'] += fallback
+    logs.count('QuizServedPool', pooled)
+    logs.count('QuizServedLive', live)
+    if fallback:
+        logs.count('QuizFallback', fallback)
+    if quiz_pool.depth is not None:
+        logs.measure('QuizPoolDepth', quiz_pool.depth, unit='Count')
+
+def handle_quiz_drill(count, headers):
+    # Multi-question drill: pooled questions first, the rest generated in batched calls
+    questions = []
+    try:
+        while len(questions) < count:
+            with stage('db'):
+                quiz_data = quiz_pool.take()
+            if quiz_data is None:
+                break
+            questions.append(quiz_data)
     except Exception as e:
-        print(f"Bedrock Error: {e}")
-        # Fallback for demo purposes if Bedrock fails or permissions issue
-        fallback_quiz = {
-            "question": "Fallback: During Care Under Fire, what is the only medically indicated intervention?",
-            "options": ["Airway management", "Tourniquet application", "Needle decompression", "IV access"],
-            "correct_index": 1,
-            "explanation": "Hemorrhage control via tourniquet is the only approved intervention in CUF."
-        }
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(fallback_quiz)}
+        logs.error('Quiz pool read failed', error=e)
+
+    missing = count - len(questions)
+    if missing:
+        started = time.time()
+        # Batches run on worker threads; time the wait for all of them here
+        with stage('generation'):
+            generated = generate_quiz_questions(missing)
+        questions.extend(generated)
+        logs.info('Quiz drill generated', generated=len(generated), missing=missing,
+                  seconds=round(time.time() - started, 1))
+    else:
+        generated = []
+    if not questions:
+        questions.append(FALLBACK_QUIZ)
+        quiz_served(fallback=1)
+    else:
+        quiz_served(pooled=len(questions) - len(generated), live=len(generated))
+    if missing or quiz_pool.needs_refill():
+        trigger_quiz_refill()
+
+    logs.debug('Quiz drill served', pool=quiz_pool.summary())
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'questions': questions})}
+
+def trigger_quiz_refill():
+    now = time.time()
+    if now - _quiz_refill_state['last_trigger'] < QUIZ_REFILL_COOLDOWN:
+        return
+    _quiz_refill_state['last_trigger'] = now
+    function_name = os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+    try:
+        if function_name:
+            # Refill in a separate asynchronous invocation so /quiz never waits for Bedrock
+            lambda_client.invoke(
+                FunctionName=function_name,
+                InvocationType='Event',
+                Payload=json.dumps({'source': QUIZ_REFILL_SOURCE})
+            )
+        else:
+            # Local stand-in when running outside Lambda
+            threading.Thread(target=run_quiz_refill, daemon=True).start()
+    except Exception as e:
+        logs.error('Quiz refill trigger failed', error=e)
+
+def run_quiz_refill():
+    started = time.time()
+    depth = quiz_pool.count()
+    wanted = min(max(0, QUIZ_POOL_TARGET - depth), QUIZ_REFILL_BATCH)
+    questions = generate_quiz_questions(wanted) if wanted else []
+    accepted = quiz_pool.add(questions) if questions else 0
+    quiz_pool.depth = depth + accepted
+    quiz_pool.stats['refills'] += 1
+    elapsed = time.time() - started
+    logs.info('Quiz refill', depth_before=depth, depth=quiz_pool.depth, accepted=accepted, wanted=wanted,
+              seconds=round(elapsed, 1), pool=quiz_pool.summary())
+    logs.count('QuizRefillAccepted', accepted)
+    return {'status': 'ok', 'accepted': accepted, 'depth': quiz_pool.depth}
+
+# Handle Decimal serialization format
+class DecimalEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return float(obj)
+        return super(DecimalEncoder, self).default(obj)
+
+def update_leaderboards(user_id, new_score, amount):
+    # Rank index, histogram, top records and time windows for a total that just grew by amount
+    try:
+        leaderboard.index_user(user_id, new_score)
+        leaderboard.move_score(new_score - amount, new_score)
+        leaderboard.record(user_id, new_score)
+    except Exception as lb_err:
+        # The score itself is saved; the board catches up on the next write or rebuild
+        logs.error('Leaderboard update failed', user=user_id, error=lb_err)
+    window_scores = {}
+    for window in WINDOWS[1:]:
+        try:
+            window_scores[window] = leaderboard.add_to_window(user_id, amount, window)
+        except Exception as lb_err:
+            logs.error('Leaderboard window update failed', user=user_id, window=window, error=lb_err)
+    return window_scores
 
 def handle_score_update(event, headers):
     try:
-        body = json.loads(event.get('body', '{}'))
+        body = event['parsedBody']
         user_id = body.get('userId')
         if not user_id:
              return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'userId required'})}
+        if body.get('eventId'):
+            # Clients that send an event id get the idempotent batch path, so a retry cannot double-count
+            result = apply_score_events(user_id, [{'eventId': body['eventId'], 'question': body.get('question')}])
+            return {'statusCode': 200, 'headers': headers, 'body': json.dumps(dict(result, message='Score updated'))}
 
         table = dynamodb.Table(USERS_TABLE)
-        response = table.update_item(
-            Key={'UserId': user_id},
-            UpdateExpression="ADD TotalScore :inc",
-            ExpressionAttributeValues={':inc': 100},
-            ReturnValues="UPDATED_NEW"
-        )
-        # Handle Decimal serialization format
-        from decimal import Decimal
-        class DecimalEncoder(json.JSONEncoder):
-            def default(self, obj):
-                if isinstance(obj, Decimal):
-                    return float(obj)
-                return super(DecimalEncoder, self).default(obj)
+        with stage('db'):
+            response = table.update_item(
+                Key={'UserId': user_id},
+                UpdateExpression="ADD TotalScore :inc",
+                ExpressionAttributeValues={':inc': SCORE_INCREMENT},
+                ReturnValues="UPDATED_NEW"
+            )
+        new_score = int(response['Attributes']['TotalScore'])
+        history.record(user_id, 'quiz', Correct=True, Points=SCORE_INCREMENT, Question=body.get('question'))
+        with stage('db'):
+            window_scores = update_leaderboards(user_id, new_score, SCORE_INCREMENT)
 
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
             'message': 'Score updated', 
-            'newScore': response['Attributes']['TotalScore']
+            'newScore': new_score,
+            'windowScores': window_scores
         }, cls=DecimalEncoder)}
     except Exception as e:
-        print(f"Score Update Error: {e}")
+        logs.error('Score update failed', error=e)
         return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': str(e)})}
 
-def handle_leaderboard(headers):
+def apply_score_events(user_id, events):
+    # events: dicts with eventId (and optionally question) for correct answers
+    event_ids = [e['eventId'] for e in events]
+    with stage('db'):
+        new_score, applied, duplicates = leaderboard.apply_events(user_id, event_ids, SCORE_INCREMENT)
+    applied_ids = set(applied)
+    for e in events:
+        if e['eventId'] in applied_ids:
+            applied_ids.discard(e['eventId'])
+            history.record(user_id, 'quiz', Correct=True, Points=SCORE_INCREMENT, EventId=e['eventId'],
+                           Question=e.get('question'))
+    result = {'applied': len(applied), 'duplicates': len(duplicates), 'newScore': new_score}
+    if applied:
+        with stage('db'):
+            result['windowScores'] = update_leaderboards(user_id, new_score, SCORE_INCREMENT * len(applied))
+    return result
+
+def handle_score_batch(event, headers):
+    # Body: {"userId": "...", "events": [{"eventId": "...", "correct": true, "userId": optional}]}
+    body = event['parsedBody']
+    events = body.get('events')
+    if not isinstance(events, list) or not events:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'events required'})}
+    if len(events) > SCORE_BATCH_MAX:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f"At most {SCORE_BATCH_MAX} events per batch"})}
+
+    # Coalesce per user: one transaction per user (per 99 events) instead of a write per answer.
+    # The whole batch is validated before anything is written, so a 400 leaves no trace
+    by_user = {}
+    misses = []
+    for item in events:
+        if not isinstance(item, dict):
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'events must be objects'})}
+        user_id = item.get('userId') or body.get('userId')
+        event_id = item.get('eventId')
+        if not isinstance(user_id, str) or not user_id or not isinstance(event_id, str) or not event_id:
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'every event needs userId and eventId'})}
+        if item.get('correct', True) is not True:
+            misses.append((user_id, event_id, item.get('question')))
+            continue
+        by_user.setdefault(user_id, []).append({'eventId': event_id, 'question': item.get('question')})
+
+    # Wrong answers score nothing but still belong in the medic's history
+    for user_id, event_id, question in misses:
+        history.record(user_id, 'quiz', Correct=False, Points=0, EventId=event_id, Question=question)
+    ignored = len(misses)
+
+    started = time.time()
+    results = {}
+    try:
+        for user_id, user_events in by_user.items():
+            results[user_id] = apply_score_events(user_id, user_events)
+    except Exception as e:
+        logs.error('Score batch failed', error=e)
+        return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': str(e), 'results': results})}
+    logs.info('Score batch', events=len(events), users=len(by_user), ignored=ignored,
+              ms=round((time.time() - started) * 1000), leaderboard=leaderboard.summary())
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'results': results, 'ignored': ignored})}
+
+def handle_leaderboard(event, headers):
     table = dynamodb.Table(USERS_TABLE)
+    params = event.get('queryStringParameters') or {}
+    cursor = params.get('cursor')
+    window = params.get('window', 'alltime')
+    if window not in WINDOWS:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f"window must be one of {WINDOWS}"})}
+    board, _ = window_board(window)
     try:
-        # Scan or Query based on GSI
-        response = table.scan(
-            IndexName='TotalScoreIndex',
-            Limit=10,
-            ProjectionExpression='UserId, TotalScore'
-        )
-        items = response.get('Items', [])
+        limit = max(1, min(int(params.get('limit', 10)), LEADERBOARD_PAGE_MAX))
+    except ValueError:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'limit must be a number'})}
+    try:
+        try:
+            with stage('db'):
+                items, next_cursor = leaderboard.page(cursor=cursor, limit=limit, board=board)
+        except ValueError as e:
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': str(e)})}
+        if window != 'alltime':
+            # Window boards start empty and are never rebuilt or seeded
+            return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'leaderboard': items, 'nextCursor': next_cursor, 'window': board})}
+        if not items and not cursor:
+            # First read after deploy: build the record from the sharded GSI
+            with stage('db'):
+                leaderboard.rebuild()
+                items, next_cursor = leaderboard.page(limit=limit)
         
         # Seed mock data if empty
-        if not items:
+        if not items and not cursor:
             mock_users = [
                 {'UserId': 'Doc-1', 'TotalScore': 1500},
                 {'UserId': 'Medic-Alpha', 'TotalScore': 1200},
@@ -332,21 +1242,80 @@ def handle_leaderboard(headers):
             try:
                 with table.batch_writer() as batch:
                     for user in mock_users:
-                        batch.put_item(Item=user)
-                items = mock_users # Use mocks for immediate display
+                        batch.put_item(Item=dict(
+                            user,
+                            ScoreShard=score_shard(user['UserId'], LEADERBOARD_SHARDS),
+                            RankKey=rank_key(user['TotalScore'], user['UserId'])
+                        ))
+                leaderboard.rebuild_histogram()
+                for user in mock_users:
+                    leaderboard.record(user['UserId'], user['TotalScore'])
+                items = mock_users[:limit] # Use mocks for immediate display
             except Exception as seed_err:
-                print(f"Seeding Error: {seed_err}")
-
-        # Handle Decimal deserialization for existing DynamoDB items
-        for item in items:
-            if 'TotalScore' in item:
-                from decimal import Decimal
-                if isinstance(item['TotalScore'], Decimal):
-                    item['TotalScore'] = int(item['TotalScore'])
-
-        # Sort manually
-        items.sort(key=lambda x: int(x.get('TotalScore', 0)), reverse=True)
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'leaderboard': items})}
+                logs.error('Leaderboard seeding failed', error=seed_err)
+
+        logs.debug('Leaderboard served', leaderboard=leaderboard.summary())
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'leaderboard': items, 'nextCursor': next_cursor, 'window': board})}
     except Exception as e:
-        print("DB Error:", e)
+        logs.error('Leaderboard read failed', error=e)
         return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': 'Database error'})}
+
+def handle_rank(event, headers):
+    params = event.get('queryStringParameters') or {}
+    user_id = params.get('userId')
+    window = params.get('window', 'alltime')
+    if not user_id:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'userId required'})}
+    if window not in WINDOWS:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f"window must be one of {WINDOWS}"})}
+    try:
+        with stage('db'):
+            if window == 'alltime':
+                item = dynamodb.Table(USERS_TABLE).get_item(Key={'UserId': user_id}, ProjectionExpression='TotalScore').get('Item')
+                score = int(item.get('TotalScore', 0)) if item else 0
+            else:
+                score = leaderboard.window_score(user_id, window)
+            if not score:
+                return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'No score yet'})}
+            board, _ = window_board(window)
+            result = dict(leaderboard.rank(score, board), userId=user_id, score=score, window=board)
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(result)}
+    except Exception as e:
+        logs.error('Rank lookup failed', error=e)
+        return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': 'Database error'})}
+
+def handle_history(event, headers):
+    # GET /history?userId=...&from=2026-10-01&to=2026-10-18T23:59:59&limit=50
+    params = event.get('queryStringParameters') or {}
+    user_id = params.get('userId')
+    if not user_id:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'userId required'})}
+    try:
+        limit = max(1, min(int(params.get('limit', 50)), 200))
+    except ValueError:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'limit must be a number'})}
+    try:
+        with stage('db'):
+            items = history.query(user_id, params.get('from'), params.get('to'), limit=limit)
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'history': items}, cls=DecimalEncoder)}
+    except Exception as e:
+        logs.error('History query failed', error=e)
+        return {'statusCode': 500, 'headers': headers, 'body': json.dumps({'error': 'Database error'})}
+
+# Route table: (method, path, handler, *route middleware). Every request also runs through the
+# router middleware (CORS, Server-Timing and a structured timing record, error mapping), see routing.py.
+ROUTES = [
+    ('POST', '/ask', handle_ask, json_body),
+    ('POST', '/ask/stream', handle_ask_stream, json_body),
+    ('POST', '/ask/upload', handle_ask_upload, json_body),
+    ('POST', '/ask/upload/complete', handle_ask_upload_complete, json_body),
+    ('GET', '/ask/status', handle_ask_status),
+    ('POST', '/quiz', handle_quiz, json_body),
+    ('GET', '/leaderboard', handle_leaderboard),
+    ('GET', '/rank', handle_rank),
+    ('POST', '/score', handle_score_update, json_body),
+    ('POST', '/score/batch', handle_score_batch, json_body),
+    ('GET', '/history', handle_history)
+]
+
+router = Router(ROUTES, middleware=[cors, server_timing, map_errors])
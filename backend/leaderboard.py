@@ -0,0 +1,412 @@
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import logs
+
+# Materialized leaderboard kept in LEADERBOARD_TABLE (Board, Key):
+#   Board='alltime', Key='#top' - the top TOP_SIZE entries, sorted, with a Version for optimistic writes
+# Reading the leaderboard is one get_item whatever the user count. Score writes merge the user's
+# new total into the top record; the warm container remembers the lowest score on the board so
+# writes that cannot qualify skip the read entirely.
+#   Board='alltime', Key='#hist' - score histogram: one counter attribute per bucket ('s<bucket>') plus Users
+# The histogram answers "what is my rank" with one get_item: rank = 1 + users in higher buckets.
+# With buckets as wide as the score step the rank is exact; wider buckets give a rank range.
+# Time windows reuse the same records under their own board, e.g. Board='day#2026-10-18' or
+# 'week#2026-W42', plus one running counter per user (Key='u#<UserId>'). A score write costs a fixed
+# number of writes per window (counter, histogram, at most one top-record merge) and every window
+# item carries ExpiresAt, so DynamoDB TTL drops old windows without any cleanup job.
+# Scored answer events are made idempotent by a marker per client event id (Board='events#<UserId>',
+# Key=<eventId>, expiring after SCORE_EVENT_TTL); apply_events() writes the markers and the user's
+# coalesced increment in one transaction, so a retried request can never count twice.
+# The users table also carries ScoreShard and RankKey (write-sharded GSI ScoreShardIndex: ScoreShard/RankKey).
+# RankKey sorts ascending in leaderboard order (inverted zero-padded score, then user id), so
+# rebuild() and pages past the top record are plain range queries, one per shard.
+# Cost of one POST /score (bench_lambda.py measures about 11 DynamoDB calls):
+#   users table        2 writes (TotalScore, then RankKey), each also rewriting the user's index entries
+#   all-time board     1 histogram update, plus a read and a put of the top record only when the new
+#                      total reaches the cached floor
+#   each window        counter and histogram updates, plus the top-record read and put until the
+#                      window's board is full and its floor skips most writers; 4 calls while it fills
+# That is why setup.ps1 creates both tables on demand: at the old 5 WCU the users table throttled
+# after a few answers per second. POST /score/batch pays the same per user, not per answer.
+
+ALLTIME = 'alltime'
+TOP_KEY = '#top'
+HIST_KEY = '#hist'
+RANK_KEY_MAX = 10 ** 12 - 1
+WINDOWS = ['alltime', 'week', 'day']
+SCORE_EVENT_TTL = int(os.environ.get('SCORE_EVENT_TTL', str(7 * 24 * 3600)))
+# DynamoDB transactions take at most 100 items: the user update plus 99 event markers
+EVENTS_PER_TRANSACTION = 99
+# How long a finished window stays readable before TTL removes it
+WINDOW_RETENTION = {
+    'day': int(os.environ.get('LEADERBOARD_DAY_RETENTION', str(7 * 24 * 3600))),
+    'week': int(os.environ.get('LEADERBOARD_WEEK_RETENTION', str(35 * 24 * 3600)))
+}
+
+def score_shard(user_id, shards):
+    return int(hashlib.md5(user_id.encode('utf-8')).hexdigest(), 16) % shards
+
+def window_board(window, now=None):
+    # Returns (board, expires_at) for the window containing now; all-time boards never expire
+    if window == ALLTIME:
+        return ALLTIME, None
+    now = now or datetime.now(timezone.utc)
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if window == 'day':
+        board, end = f"day#{now.strftime('%Y-%m-%d')}", day_start + timedelta(days=1)
+    elif window == 'week':
+        year, week, weekday = now.isocalendar()
+        board, end = f"week#{year}-W{week:02d}", day_start + timedelta(days=8 - weekday)
+    else:
+        raise ValueError(f"unknown window: {window}")
+    return board, int(end.timestamp()) + WINDOW_RETENTION[window]
+
+def rank_key(score, user_id):
+    return f"{RANK_KEY_MAX - int(score):012d}#{user_id}"
+
+def _entry(user_id, score):
+    return {'UserId': user_id, 'TotalScore': int(score)}
+
+def _sort_key(entry):
+    return (-int(entry['TotalScore']), entry['UserId'])
+
+def _sort_entries(entries):
+    # Highest score first, ties broken by user id so every page boundary is stable
+    return sorted(entries, key=_sort_key)
+
+def encode_cursor(entry):
+    raw = json.dumps([int(entry['TotalScore']), entry['UserId']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    # Raises ValueError on anything that is not a cursor we issued
+    try:
+        score, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return int(score), str(user_id)
+    except Exception:
+        raise ValueError('invalid cursor')
+
+class Leaderboard:
+    def __init__(self, table, users_table, size=100, shards=10, bucket_width=100, score_step=100):
+        self.table = table
+        self.users_table = users_table
+        self.size = size
+        self.shards = shards
+        self.bucket_width = bucket_width
+        self.score_step = score_step
+        self._floor = {}
+        self._lock = threading.Lock()
+        self.stats = {'reads': 0, 'merges': 0, 'skipped': 0, 'conflicts': 0,
+                      'rank_lookups': 0, 'index_pages': 0, 'events_applied': 0, 'events_duplicate': 0,
+                      'transactions': 0}
+
+    def _get_top(self, board, consistent=False):
+        item = self.table.get_item(Key={'Board': board, 'Key': TOP_KEY}, ConsistentRead=consistent).get('Item')
+        if not item:
+            return [], 0
+        entries = [_entry(e['UserId'], e['TotalScore']) for e in item.get('Entries', [])]
+        return entries, int(item.get('Version', 0))
+
+    def _remember_floor(self, board, entries):
+        with self._lock:
+            if len(entries) >= self.size:
+                self._floor[board] = int(entries[-1]['TotalScore'])
+            else:
+                self._floor.pop(board, None)
+
+    def top(self, board=ALLTIME, limit=10):
+        self.stats['reads'] += 1
+        entries, _ = self._get_top(board)
+        self._remember_floor(board, entries)
+        return entries[:limit]
+
+    def record(self, user_id, score, board=ALLTIME, expires_at=None):
+        # Merges a user's new total into the top record; returns True if the board changed
+        with self._lock:
+            floor = self._floor.get(board)
+        # Scores only grow, so a cached floor is never above the real one: skipping is always safe
+        if floor is not None and score < floor:
+            self.stats['skipped'] += 1
+            return False
+
+        for attempt in range(5):
+            if attempt:
+                # Jittered backoff so concurrent writers stop colliding on the same record
+                time.sleep(random.uniform(0, 0.01 * attempt))
+            entries, version = self._get_top(board, consistent=True)
+            current = {e['UserId']: e for e in entries}
+            if user_id in current:
+                if current[user_id]['TotalScore'] >= score:
+                    self._remember_floor(board, entries)
+                    return False
+                current[user_id] = _entry(user_id, score)
+            elif len(entries) < self.size or _sort_key(_entry(user_id, score)) < _sort_key(entries[-1]):
+                current[user_id] = _entry(user_id, score)
+            else:
+                self._remember_floor(board, entries)
+                self.stats['skipped'] += 1
+                return False
+
+            merged = _sort_entries(current.values())[:self.size]
+            try:
+                item = {'Board': board, 'Key': TOP_KEY, 'Entries': merged, 'Version': version + 1}
+                if expires_at:
+                    item['ExpiresAt'] = expires_at
+                self.table.put_item(
+                    Item=item,
+                    ConditionExpression='attribute_not_exists(#v) OR #v = :v',
+                    ExpressionAttributeNames={'#v': 'Version'},
+                    ExpressionAttributeValues={':v': version}
+                )
+            except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+                # Another writer got in first; re-read and merge again
+                self.stats['conflicts'] += 1
+                continue
+            self.stats['merges'] += 1
+            self._remember_floor(board, merged)
+            return True
+        logs.warning('Leaderboard merge gave up after repeated conflicts', user=user_id, board=board)
+        return False
+
+    def rebuild(self, board=ALLTIME):
+        # Recreates the all-time top record from the sharded GSI: one query per shard
+        candidates = []
+        for shard in range(self.shards):
+            candidates += self._query_shard(shard, self.size)
+        if not candidates and self.backfill():
+            for shard in range(self.shards):
+                candidates += self._query_shard(shard, self.size)
+        merged = _sort_entries(candidates)[:self.size]
+        _, version = self._get_top(board, consistent=True)
+        self.table.put_item(Item={'Board': board, 'Key': TOP_KEY, 'Entries': merged, 'Version': version + 1})
+        self._remember_floor(board, merged)
+        return merged
+
+    def page(self, cursor=None, limit=10, board=ALLTIME):
+        # Returns (entries, next_cursor). Pages inside the top record cost one get_item;
+        # deeper pages (all-time only) are merged from one query per score shard.
+        self.stats['reads'] += 1
+        after = decode_cursor(cursor) if cursor else None
+        entries, _ = self._get_top(board)
+        self._remember_floor(board, entries)
+        # A record shorter than its size holds every user, so there is nothing past it
+        complete = len(entries) < self.size
+        if after:
+            entries = [e for e in entries if _sort_key(e) > (-after[0], after[1])]
+        page = entries[:limit]
+        if len(page) < limit and not complete and board == ALLTIME:
+            start = (page[-1]['TotalScore'], page[-1]['UserId']) if page else after
+            page += self._page_from_index(start, limit - len(page))
+        next_cursor = encode_cursor(page[-1]) if len(page) == limit else None
+        return page, next_cursor
+
+    def _page_from_index(self, after, limit):
+        self.stats['index_pages'] += 1
+        start = rank_key(*after) if after else None
+        candidates = []
+        for shard in range(self.shards):
+            candidates += self._query_shard(shard, limit, start)
+        return _sort_entries(candidates)[:limit]
+
+    def _query_shard(self, shard, limit=None, after_key=None):
+        kwargs = {
+            'IndexName': 'ScoreShardIndex',
+            'KeyConditionExpression': 'ScoreShard = :s' + (' AND RankKey > :after' if after_key else ''),
+            'ExpressionAttributeValues': {':s': shard, **({':after': after_key} if after_key else {})},
+            'ProjectionExpression': 'UserId, TotalScore'
+        }
+        items = []
+        while True:
+            if limit:
+                kwargs['Limit'] = limit - len(items)
+            resp = self.users_table.query(**kwargs)
+            items += [_entry(i['UserId'], i['TotalScore']) for i in resp.get('Items', [])]
+            if 'LastEvaluatedKey' not in resp or (limit and len(items) >= limit):
+                return items
+            kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+    def index_user(self, user_id, score):
+        # Points the user's RankKey at their new total; the condition keeps a slower concurrent
+        # write from overwriting the key of a newer score
+        try:
+            self.users_table.update_item(
+                Key={'UserId': user_id},
+                UpdateExpression='SET RankKey = :rk, ScoreShard = if_not_exists(ScoreShard, :shard)',
+                ConditionExpression='TotalScore = :score',
+                ExpressionAttributeValues={':rk': rank_key(score, user_id), ':score': score,
+                                           ':shard': score_shard(user_id, self.shards)}
+            )
+        except self.users_table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+
+    def backfill(self):
+        # One-time pass for users written before the index existed; returns how many were indexed
+        kwargs = {'ProjectionExpression': 'UserId, TotalScore', 'FilterExpression': 'attribute_not_exists(RankKey)'}
+        indexed = 0
+        while True:
+            resp = self.users_table.scan(**kwargs)
+            for item in resp.get('Items', []):
+                if item.get('TotalScore'):
+                    self.index_user(item['UserId'], int(item['TotalScore']))
+                    indexed += 1
+            if 'LastEvaluatedKey' not in resp:
+                return indexed
+            kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+    def _bucket(self, score):
+        return int(score) // self.bucket_width * self.bucket_width
+
+    def move_score(self, old_score, new_score, board=ALLTIME, expires_at=None):
+        # Moves one user between histogram buckets; old_score 0 means a new user
+        old_bucket = self._bucket(old_score) if old_score > 0 else None
+        new_bucket = self._bucket(new_score)
+        if old_bucket == new_bucket:
+            return
+        names = {'#new': f's{new_bucket}'}
+        values = {':one': 1}
+        expression = 'ADD #new :one'
+        if old_bucket is None:
+            expression += ', Users :one'
+        else:
+            names['#old'] = f's{old_bucket}'
+            values[':minus'] = -1
+            expression += ', #old :minus'
+        kwargs = {}
+        if expires_at:
+            expression += ' SET ExpiresAt = :exp'
+            values[':exp'] = expires_at
+        if board == ALLTIME:
+            # Window histograms start empty with their window; only the all-time one may need a rebuild
+            kwargs['ConditionExpression'] = 'attribute_exists(Users)'
+        try:
+            self.table.update_item(
+                Key={'Board': board, 'Key': HIST_KEY},
+                UpdateExpression=expression,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                **kwargs
+            )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            # No histogram yet: count the users table instead (it already holds this write)
+            self.rebuild_histogram(board)
+
+    def add_to_window(self, user_id, amount, window, now=None):
+        # Rolls one score event into a time window; returns the user's total for that window
+        board, expires_at = window_board(window, now)
+        resp = self.table.update_item(
+            Key={'Board': board, 'Key': f'u#{user_id}'},
+            UpdateExpression='ADD Score :amount SET ExpiresAt = :exp',
+            ExpressionAttributeValues={':amount': amount, ':exp': expires_at},
+            ReturnValues='UPDATED_NEW'
+        )
+        score = int(resp['Attributes']['Score'])
+        self.move_score(score - amount, score, board, expires_at)
+        self.record(user_id, score, board, expires_at)
+        self._prune_floors()
+        return score
+
+    def apply_events(self, user_id, event_ids, points):
+        # Adds points for every event id not seen before; returns (new_score, applied, duplicates).
+        # new_score is the user's current total, so a retried request still reports it.
+        client = self.table.meta.client
+        pending = list(dict.fromkeys(event_ids))
+        duplicates = [eid for i, eid in enumerate(event_ids) if eid in event_ids[:i]]
+        applied = []
+        expires_at = str(int(time.time()) + SCORE_EVENT_TTL)
+        while pending:
+            chunk = pending[:EVENTS_PER_TRANSACTION]
+            items = [{'Put': {
+                'TableName': self.table.name,
+                'Item': {'Board': {'S': f'events#{user_id}'}, 'Key': {'S': eid}, 'ExpiresAt': {'N': expires_at}},
+                'ConditionExpression': 'attribute_not_exists(#k)',
+                'ExpressionAttributeNames': {'#k': 'Key'}
+            }} for eid in chunk]
+            items.append({'Update': {
+                'TableName': self.users_table.name,
+                'Key': {'UserId': {'S': user_id}},
+                'UpdateExpression': 'ADD TotalScore :inc',
+                'ExpressionAttributeValues': {':inc': {'N': str(points * len(chunk))}}
+            }})
+            self.stats['transactions'] += 1
+            try:
+                client.transact_write_items(TransactItems=items)
+            except client.exceptions.TransactionCanceledException as e:
+                # Drop the events that were already counted and retry the rest
+                reasons = e.response.get('CancellationReasons', [])
+                seen = {chunk[i] for i, r in enumerate(reasons[:len(chunk)]) if r.get('Code') == 'ConditionalCheckFailed'}
+                if not seen:
+                    raise
+                duplicates += [eid for eid in chunk if eid in seen]
+                pending = [eid for eid in pending if eid not in seen]
+                continue
+            applied += chunk
+            pending = pending[len(chunk):]
+
+        self.stats['events_applied'] += len(applied)
+        self.stats['events_duplicate'] += len(duplicates)
+        item = self.users_table.get_item(Key={'UserId': user_id}, ConsistentRead=True,
+                                         ProjectionExpression='TotalScore').get('Item')
+        return (int(item['TotalScore']) if item else None), applied, duplicates
+
+    def window_score(self, user_id, window, now=None):
+        board, _ = window_board(window, now)
+        item = self.table.get_item(Key={'Board': board, 'Key': f'u#{user_id}'}).get('Item')
+        return int(item['Score']) if item else 0
+
+    def _prune_floors(self):
+        # Forget floors of windows that have rolled over in this warm container
+        current = {window_board(w)[0] for w in WINDOWS}
+        with self._lock:
+            for board in [b for b in self._floor if b not in current]:
+                del self._floor[board]
+
+    def _get_histogram(self, board):
+        item = self.table.get_item(Key={'Board': board, 'Key': HIST_KEY}).get('Item')
+        if item is None and board == ALLTIME:
+            item = self.rebuild_histogram()
+        if item is None:
+            return {}, 0
+        counts = {int(k[1:]): int(v) for k, v in item.items() if k.startswith('s') and int(v) > 0}
+        return counts, int(item.get('Users', 0))
+
+    def rank(self, score, board=ALLTIME):
+        # Returns rank info for a score; users with equal scores share a rank
+        self.stats['rank_lookups'] += 1
+        counts, total = self._get_histogram(board)
+        bucket = self._bucket(score)
+        above = sum(c for b, c in counts.items() if b > bucket)
+        same = counts.get(bucket, 0)
+        exact = self.bucket_width <= self.score_step
+        result = {
+            'rank': above + 1,
+            'exact': exact,
+            'totalUsers': total,
+            'percentile': round(100.0 * (total - above) / total, 1) if total else None
+        }
+        if not exact:
+            result['rankRange'] = [above + 1, above + max(same, 1)]
+        return result
+
+    def rebuild_histogram(self, board=ALLTIME):
+        # One pass over the sharded index; used once when the histogram item does not exist yet
+        counts = {}
+        total = 0
+        for shard in range(self.shards):
+            for entry in self._query_shard(shard):
+                if entry['TotalScore'] > 0:
+                    bucket = f"s{self._bucket(entry['TotalScore'])}"
+                    counts[bucket] = counts.get(bucket, 0) + 1
+                    total += 1
+        item = dict(counts, Board=board, Key=HIST_KEY, Users=total)
+        self.table.put_item(Item=item)
+        return item
+
+    def summary(self):
+        return dict(self.stats, floor=self._floor.get(ALLTIME))
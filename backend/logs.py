@@ -0,0 +1,167 @@
+import json
+import os
+import random
+import threading
+import time
+from decimal import Decimal
+
+# Structured logging for CloudWatch: one JSON object per line, so Logs Insights can filter and
+# aggregate on fields (level, msg, requestId, route, ...) instead of parsing free text.
+# - Bounded: values under sensitive keys (audio, credentials, presigned URLs) are replaced by their
+#   size, strings are cut to MAX_FIELD chars, lists to MAX_ITEMS, nesting to MAX_DEPTH, and a line
+#   that still exceeds MAX_LINE is reduced to its level/msg plus its original size.
+# - Levelled and sampled: LOG_LEVEL (default INFO); on top of that, debug lines are written for
+#   LOG_DEBUG_SAMPLE_RATE of requests, decided once per request so a sampled request logs fully.
+#   Fields are only serialized for lines that are written.
+# - Metrics in CloudWatch Embedded Metric Format: every HTTP request ends with one EMF record
+#   (end_request) in METRICS_NAMESPACE with the Route dimension: Latency, LogBytes (bytes this
+#   request logged before that record) and whatever count()/measure() recorded while handling it
+#   (cache hits, fallbacks, model first-token latency). CloudWatch turns the line into metrics itself;
+#   there are no PutMetricData calls. Outside a request (async refills, worker threads) count()
+#   and measure() write their own EMF record.
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+LOG_LEVEL = LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), LEVELS['INFO'])
+DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', '0.01'))
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'TacMed')
+
+MAX_FIELD = 512
+MAX_ITEMS = 20
+MAX_DEPTH = 4
+MAX_LINE = 8192
+REDACT_KEYS = {'audio', 'authorization', 'cookie', 'x-api-key', 'password', 'token', 'uploadurl', 'parturls'}
+
+_local = threading.local()
+
+class RequestLog:
+    def __init__(self, request_id=None, route=None):
+        self.request_id = request_id
+        self.route = route
+        self.sampled = random.random() < DEBUG_SAMPLE_RATE
+        self.bytes = 0
+        self.values = {}
+        self.units = {}
+
+def start_request(request_id=None, route=None):
+    _local.request = RequestLog(request_id, route)
+    return _local.request
+
+def current():
+    return getattr(_local, 'request', None)
+
+def _redacted(value):
+    size = len(value) if isinstance(value, (str, bytes)) else None
+    return f"<redacted {size} chars>" if size is not None else '<redacted>'
+
+def clean(value, depth=0):
+    # JSON-safe, size-bounded copy of a log field
+    if isinstance(value, dict):
+        if depth >= MAX_DEPTH:
+            return f"<{len(value)} keys>"
+        return {str(k): _redacted(v) if str(k).lower() in REDACT_KEYS else clean(v, depth + 1)
+                for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        if depth >= MAX_DEPTH:
+            return f"<{len(value)} items>"
+        items = [clean(v, depth + 1) for v in list(value)[:MAX_ITEMS]]
+        if len(value) > MAX_ITEMS:
+            items.append(f"<+{len(value) - MAX_ITEMS} items>")
+        return items
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, BaseException):
+        value = f"{type(value).__name__}: {value}"
+    elif isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    value = str(value)
+    if len(value) > MAX_FIELD:
+        return f"{value[:MAX_FIELD]}...<+{len(value) - MAX_FIELD} chars>"
+    return value
+
+def _write(record):
+    line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+    if len(line) > MAX_LINE:
+        kept = {k: record[k] for k in ('level', 'msg', 'requestId', 'route') if k in record}
+        line = json.dumps(dict(kept, truncated=len(line)), ensure_ascii=False, separators=(',', ':'))
+    request = current()
+    if request is not None:
+        request.bytes += len(line.encode('utf-8')) + 1
+    print(line)
+
+def enabled(level):
+    if LEVELS[level] >= LOG_LEVEL:
+        return True
+    request = current()
+    return level == 'DEBUG' and request is not None and request.sampled
+
+def log(level, msg, **fields):
+    if not enabled(level):
+        return
+    record = {'level': level, 'msg': msg}
+    request = current()
+    if request is not None:
+        if request.request_id:
+            record['requestId'] = request.request_id
+        if request.route:
+            record['route'] = request.route
+    record.update(clean(fields))
+    _write(record)
+
+def debug(msg, **fields):
+    log('DEBUG', msg, **fields)
+
+def info(msg, **fields):
+    log('INFO', msg, **fields)
+
+def warning(msg, **fields):
+    log('WARNING', msg, **fields)
+
+def error(msg, **fields):
+    log('ERROR', msg, **fields)
+
+def metrics(values, dimensions=None, units=None, **properties):
+    # One EMF record; values {name: number}, dimensions {name: value}, units {name: unit} (default Count)
+    dimensions = dimensions or {}
+    units = units or {}
+    record = {'_aws': {
+        'Timestamp': int(time.time() * 1000),
+        'CloudWatchMetrics': [{
+            'Namespace': METRICS_NAMESPACE,
+            'Dimensions': [list(dimensions)],
+            'Metrics': [{'Name': name, 'Unit': units.get(name, 'Count')} for name in values]
+        }]
+    }}
+    record.update(clean(properties))
+    record.update(dimensions)
+    record.update(values)
+    _write(record)
+
+def count(name, value=1):
+    request = current()
+    if request is None:
+        metrics({name: value})
+        return
+    request.values[name] = request.values.get(name, 0) + value
+    request.units[name] = 'Count'
+
+def measure(name, value, unit='Milliseconds'):
+    request = current()
+    if request is None:
+        metrics({name: value}, units={name: unit})
+        return
+    request.values[name] = value
+    request.units[name] = unit
+
+def end_request(status, latency_ms, **properties):
+    # The context stays until the next start_request, so lines written after the record
+    # (tracing's per-request summary) still carry requestId and route
+    request = current() or RequestLog()
+    values = dict(request.values, Latency=round(latency_ms, 1), LogBytes=request.bytes)
+    if status >= 500:
+        values['Errors'] = 1
+    units = dict(request.units, Latency='Milliseconds', LogBytes='Bytes')
+    if request.request_id:
+        properties['requestId'] = request.request_id
+    metrics(values, {'Route': request.route or 'unknown'}, units, status=status, **properties)
@@ -0,0 +1,70 @@
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+
+import logs
+
+# Work that runs after the response has been sent, on an internal Lambda extension.
+# An extension registered for INVOKE events keeps the execution environment running after the
+# handler returns, until it asks the Extensions API for the next event: the client has its
+# response, and the container is not frozen until the work is done. The billed duration still
+# includes it; the caller's latency does not.
+#   register(work) - at import time (extensions can only register during init); False outside
+#                    Lambda or when registration fails, and the caller then does the work inline
+#   after_response() - at the end of every invocation; True when the extension will run the work
+# Each INVOKE event waits for the handler of that invocation to call after_response(), then runs
+# the work once. Invocations never overlap in one environment, so one signal per event is enough.
+
+EXTENSION_NAME = 'tacmed-post-invoke'
+EXTENSION_API = '2020-01-01/extension'
+# Margin left before the invocation deadline when the handler never signals (it timed out)
+DEADLINE_MARGIN = 0.5
+
+_done = queue.Queue()
+_state = {'registered': False}
+
+def _request(api, path, extension_id=None, body=None):
+    headers = {'Lambda-Extension-Identifier': extension_id} if extension_id else {'Lambda-Extension-Name': EXTENSION_NAME}
+    request = urllib.request.Request(f"http://{api}/{EXTENSION_API}/{path}", headers=headers,
+                                     data=json.dumps(body).encode() if body is not None else None,
+                                     method='POST' if body is not None else 'GET')
+    return urllib.request.urlopen(request)
+
+def register(work):
+    api = os.environ.get('AWS_LAMBDA_RUNTIME_API')
+    if not api or _state['registered']:
+        return _state['registered']
+    try:
+        with _request(api, 'register', body={'events': ['INVOKE']}) as resp:
+            extension_id = resp.headers['Lambda-Extension-Identifier']
+    except Exception as e:
+        logs.warning('Post-invoke extension not registered', error=e)
+        return False
+    threading.Thread(target=_run, args=(api, extension_id, work), daemon=True).start()
+    _state['registered'] = True
+    return True
+
+def after_response():
+    if not _state['registered']:
+        return False
+    _done.put(True)
+    return True
+
+def _run(api, extension_id, work):
+    while True:
+        # Blocks until the next invocation; calling it is also what lets the environment freeze
+        with _request(api, 'event/next', extension_id) as resp:
+            event = json.load(resp)
+        if event.get('eventType') != 'INVOKE':
+            continue
+        try:
+            _done.get(timeout=max(event['deadlineMs'] / 1000 - time.time() - DEADLINE_MARGIN, 0))
+        except queue.Empty:
+            pass
+        try:
+            work()
+        except Exception as e:
+            logs.error('Post-invoke work failed', error=e)
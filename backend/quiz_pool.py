@@ -0,0 +1,186 @@
+import hashlib
+import os
+import re
+import threading
+import time
+
+import logs
+
+# Pre-generated quiz questions kept in DynamoDB (QUIZ_POOL_TABLE).
+#   Pool='quiz', QuestionId=<hash>  - a ready question; claimed (deleted) when served
+#   Pool='seen', QuestionId=<hash>  - dedupe marker, expires via TTL so questions can come back later
+# /quiz claims one question with a single delete_item(ReturnValues=ALL_OLD) from a list of
+# candidate ids the warm container fetched earlier; the refill worker tops the pool up in batches.
+
+POOL_PARTITION = 'quiz'
+SEEN_PARTITION = 'seen'
+SEEN_TTL = int(os.environ.get('QUIZ_SEEN_TTL', str(7 * 24 * 3600)))
+
+def validate_quiz(quiz):
+    # Returns a list of problems; empty when the question matches the quiz schema
+    if not isinstance(quiz, dict):
+        return ['not an object']
+    problems = []
+    if not isinstance(quiz.get('question'), str) or not quiz['question'].strip():
+        problems.append('question must be a non-empty string')
+    options = quiz.get('options')
+    if not isinstance(options, list) or len(options) != 4:
+        problems.append('options must be a list of four strings')
+    elif not all(isinstance(o, str) and o.strip() for o in options):
+        problems.append('options must be non-empty strings')
+    elif len(set(o.strip().lower() for o in options)) != 4:
+        problems.append('options must be distinct')
+    index = quiz.get('correct_index')
+    if isinstance(index, bool) or not isinstance(index, int) or not 0 <= index <= 3:
+        problems.append('correct_index must be an integer from 0 to 3')
+    if not isinstance(quiz.get('explanation'), str) or not quiz['explanation'].strip():
+        problems.append('explanation must be a non-empty string')
+    return problems
+
+_OPTION_PREFIX_RE = re.compile(r'^\s*(?:[A-Da-d]|[1-4])[\).:]\s+')
+
+def normalize_quiz(quiz):
+    # Coerces near-misses (string index, "A) " option prefixes, stray whitespace) before validation
+    if not isinstance(quiz, dict):
+        return quiz
+    quiz = dict(quiz)
+    index = quiz.get('correct_index')
+    if isinstance(index, str) and index.strip().isdigit():
+        quiz['correct_index'] = int(index.strip())
+    elif isinstance(index, float) and index.is_integer():
+        quiz['correct_index'] = int(index)
+    if isinstance(quiz.get('options'), list):
+        quiz['options'] = [_OPTION_PREFIX_RE.sub('', o).strip() if isinstance(o, str) else o for o in quiz['options']]
+    for field in ('question', 'explanation'):
+        if isinstance(quiz.get(field), str):
+            quiz[field] = quiz[field].strip()
+    return quiz
+
+def question_id(quiz):
+    normalized = re.sub(r'\W+', ' ', quiz['question'].lower()).strip()
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+class QuizPool:
+    def __init__(self, table, low_watermark=20, fetch_size=50):
+        self.table = table
+        self.low_watermark = low_watermark
+        self.fetch_size = fetch_size
+        self._candidates = []
+        self._lock = threading.Lock()
+        self.depth = None
+        self.stats = {'served_pool': 0, 'served_live': 0, 'served_fallback': 0, 'claim_conflicts': 0,
+                      'refills': 0, 'generated': 0, 'accepted': 0, 'rejected': 0, 'duplicates': 0}
+
+    def _fetch_candidates(self):
+        # Start at a random point in the hash-ordered partition so containers spread their claims
+        start = os.urandom(20).hex()
+        resp = self.table.query(
+            KeyConditionExpression='#p = :p AND QuestionId > :start',
+            ExpressionAttributeNames={'#p': 'Pool'},
+            ExpressionAttributeValues={':p': POOL_PARTITION, ':start': start},
+            ProjectionExpression='QuestionId',
+            Limit=self.fetch_size
+        )
+        ids = [item['QuestionId'] for item in resp.get('Items', [])]
+        if len(ids) < self.fetch_size:
+            resp = self.table.query(
+                KeyConditionExpression='#p = :p',
+                ExpressionAttributeNames={'#p': 'Pool'},
+                ExpressionAttributeValues={':p': POOL_PARTITION},
+                ProjectionExpression='QuestionId',
+                Limit=self.fetch_size - len(ids)
+            )
+            ids += [item['QuestionId'] for item in resp.get('Items', []) if item['QuestionId'] not in ids]
+        # A short read went round the whole partition, so it is the depth; a full one only says
+        # "at least fetch_size" (None, no refill needed while fetch_size >= low_watermark).
+        # The refill worker counts the pool itself; /quiz never pays for a COUNT query
+        self.depth = len(ids) if len(ids) < self.fetch_size else None
+        return ids
+
+    def count(self):
+        resp = self.table.query(
+            KeyConditionExpression='#p = :p',
+            ExpressionAttributeNames={'#p': 'Pool'},
+            ExpressionAttributeValues={':p': POOL_PARTITION},
+            Select='COUNT'
+        )
+        return resp.get('Count', 0)
+
+    def take(self):
+        # Returns a quiz dict, or None when the pool is empty
+        for _ in range(3):
+            with self._lock:
+                if not self._candidates:
+                    self._candidates = self._fetch_candidates()
+                if not self._candidates:
+                    return None
+                qid = self._candidates.pop()
+            item = self.table.delete_item(
+                Key={'Pool': POOL_PARTITION, 'QuestionId': qid},
+                ReturnValues='ALL_OLD'
+            ).get('Attributes')
+            if item:
+                with self._lock:
+                    self.stats['served_pool'] += 1
+                    if self.depth:
+                        self.depth -= 1
+                return {
+                    'question': item['Question'],
+                    'options': list(item['Options']),
+                    'correct_index': int(item['CorrectIndex']),
+                    'explanation': item['Explanation']
+                }
+            # Another container claimed it first; the rest of the list is as old, so read a fresh one
+            with self._lock:
+                self.stats['claim_conflicts'] += 1
+                self._candidates = []
+            logs.count('QuizClaimConflict')
+        return None
+
+    def needs_refill(self):
+        return self.depth is not None and self.depth < self.low_watermark
+
+    def add(self, questions, source='llama'):
+        # Validates and dedupes a batch of generated questions; returns how many were stored
+        now = int(time.time())
+        accepted = 0
+        seen_in_batch = set()
+        for quiz in questions:
+            self.stats['generated'] += 1
+            if validate_quiz(quiz):
+                self.stats['rejected'] += 1
+                continue
+            qid = question_id(quiz)
+            if qid in seen_in_batch:
+                self.stats['duplicates'] += 1
+                continue
+            seen_in_batch.add(qid)
+            try:
+                self.table.put_item(
+                    Item={'Pool': SEEN_PARTITION, 'QuestionId': qid, 'ExpiresAt': now + SEEN_TTL},
+                    ConditionExpression='attribute_not_exists(QuestionId)'
+                )
+            except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+                self.stats['duplicates'] += 1
+                continue
+            self.table.put_item(Item={
+                'Pool': POOL_PARTITION,
+                'QuestionId': qid,
+                'Question': quiz['question'].strip(),
+                'Options': [o.strip() for o in quiz['options']],
+                'CorrectIndex': quiz['correct_index'],
+                'Explanation': quiz['explanation'].strip(),
+                'Source': source,
+                'CreatedAt': now
+            })
+            accepted += 1
+        self.stats['accepted'] += accepted
+        return accepted
+
+    def summary(self):
+        served = self.stats['served_pool'] + self.stats['served_live'] + self.stats['served_fallback']
+        return dict(
+            self.stats,
+            depth=self.depth,
+            served_from_pool_ratio=round(self.stats['served_pool'] / served, 3) if served else 0.0
+        )
@@ -0,0 +1,100 @@
+import base64
+import json
+from functools import partial
+
+import logs
+import timing
+
+# Table-driven dispatch for the HTTP API (API Gateway v2 payloads).
+# A route is (method, path, handler, *middleware); handlers keep the (event, headers) signature.
+# Middleware is fn(event, headers, call_next) -> response and may short-circuit, rewrite the
+# event before calling call_next(event, headers), or post-process the response:
+#   cors          - CORS headers on every response, answers preflight OPTIONS itself
+#   server_timing - per-stage timers (timing.py) -> Server-Timing header + the request's EMF record (logs.py)
+#   map_errors    - HTTPError -> its status, anything else -> 500, never an unhandled exception
+#   json_body     - per route: decodes the body once (timed as 'parse') into event['parsedBody']
+# Router-level middleware wraps every request (including 404s); route middleware runs inside it.
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET',
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+    # Let the frontend (and the browser's resource timing API) read the stage breakdown
+    'Access-Control-Expose-Headers': 'Server-Timing',
+    'Timing-Allow-Origin': '*'
+}
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def route_key(event):
+    return event.get('requestContext', {}).get('http', {}).get('method'), event.get('rawPath')
+
+def error_response(status, headers, message):
+    return {'statusCode': status, 'headers': headers, 'body': json.dumps({'error': message})}
+
+def cors(event, headers, call_next):
+    headers.update(CORS_HEADERS)
+    if route_key(event)[0] == 'OPTIONS':
+        return {'statusCode': 200, 'headers': headers, 'body': ''}
+    return call_next(event, headers)
+
+def server_timing(event, headers, call_next):
+    timer = timing.start()
+    try:
+        response = call_next(event, headers)
+    finally:
+        timing.finish()
+    response = dict(response, headers=dict(response.get('headers') or {}, **{'Server-Timing': timer.server_timing()}))
+    logs.end_request(response.get('statusCode', 500), timer.total_ms(), stages=timer.record()['stages'])
+    return response
+
+def map_errors(event, headers, call_next):
+    try:
+        return call_next(event, headers)
+    except HTTPError as e:
+        return error_response(e.status, headers, str(e))
+    except Exception as e:
+        logs.error('Unhandled error', error=e)
+        return error_response(500, headers, str(e))
+
+def json_body(event, headers, call_next):
+    with timing.stage('parse'):
+        raw = event.get('body') or '{}'
+        try:
+            if event.get('isBase64Encoded'):
+                raw = base64.b64decode(raw)
+            body = json.loads(raw)
+        except ValueError:
+            raise HTTPError(400, 'Invalid JSON')
+        if not isinstance(body, dict):
+            raise HTTPError(400, 'Body must be a JSON object')
+    return call_next(dict(event, parsedBody=body), headers)
+
+def chain(middleware, handler):
+    call = handler
+    for mw in reversed(middleware):
+        call = partial(mw, call_next=call)
+    return call
+
+class Router:
+    def __init__(self, routes, middleware=()):
+        self.routes = {(method, path): chain(route_middleware, handler)
+                       for method, path, handler, *route_middleware in routes}
+        self._call = chain(list(middleware), self._dispatch)
+
+    def route_name(self, event):
+        # Metric dimension and log field: known routes only, so stray paths cannot add metrics
+        method, path = route_key(event)
+        return f"{method} {path}" if (method, path) in self.routes else 'unmatched'
+
+    def _dispatch(self, event, headers):
+        handler = self.routes.get(route_key(event))
+        if handler is None:
+            return error_response(404, headers, 'Not Found')
+        return handler(event, headers)
+
+    def __call__(self, event):
+        return self._call(event, {'Content-Type': 'application/json'})
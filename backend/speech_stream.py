@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import logs
+
+# Streaming speech recognition for /ask/stream.
+# The browser posts MediaRecorder chunks as they are produced; each session keeps a
+# recognizer alive in the warm container and returns the running (partial) transcript
+# after every chunk, so the question text is ready as soon as the medic releases the button.
+#
+# SPEECH_RECOGNIZER selects the backend:
+#   transcribe - Amazon Transcribe streaming (needs the amazon-transcribe package, ogg-opus or pcm audio)
+#   fake       - deterministic local stand-in that reveals FAKE_TRANSCRIPT as bytes arrive
+
+SUPPORTED_LANGUAGES = ['en-US', 'uk-UA']
+STREAMING_ENCODINGS = ['ogg-opus', 'pcm']
+SESSION_IDLE_TIMEOUT = int(os.environ.get('SPEECH_SESSION_TIMEOUT', '60'))
+
+class SessionLost(Exception):
+    pass
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+class StreamingRecognizer(ABC):
+    @abstractmethod
+    def feed(self, chunk):
+        # Returns the transcript so far (final segments plus the current partial)
+        ...
+
+    @abstractmethod
+    def finish(self):
+        # Returns the final transcript
+        ...
+
+    def close(self):
+        pass
+
+class FakeRecognizer(StreamingRecognizer):
+    def __init__(self, language_code, script=None, bytes_per_word=2000):
+        self.language_code = language_code
+        self.words = (script or os.environ.get('FAKE_TRANSCRIPT', 'how to apply a tourniquet')).split()
+        self.bytes_per_word = bytes_per_word
+        self.received = 0
+
+    def feed(self, chunk):
+        self.received += len(chunk)
+        return ' '.join(self.words[:self.received // self.bytes_per_word])
+
+    def finish(self):
+        return ' '.join(self.words)
+
+class TranscribeStreamingRecognizer(StreamingRecognizer):
+    def __init__(self, language_code, media_encoding='ogg-opus', sample_rate=48000, region=None):
+        # Imported here: asyncio and the SDK cost a noticeable slice of every cold start otherwise
+        import asyncio
+        from amazon_transcribe.client import TranscribeStreamingClient
+
+        self._lock = threading.Lock()
+        self._final = []
+        self._partial = ''
+        # The SDK is asyncio-based; run its loop on a private thread so handlers stay synchronous
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._submit = lambda coro: asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+        client = TranscribeStreamingClient(region=region or os.environ.get('AWS_REGION', 'eu-central-1'))
+        self._stream = self._run(client.start_stream_transcription(
+            language_code=language_code,
+            media_sample_rate_hz=sample_rate,
+            media_encoding=media_encoding
+        ))
+        self._reader = self._submit(self._read_results())
+
+    def _run(self, coro, timeout=10):
+        return self._submit(coro).result(timeout)
+
+    async def _read_results(self):
+        async for event in self._stream.output_stream:
+            for result in event.transcript.results:
+                if not result.alternatives:
+                    continue
+                text = result.alternatives[0].transcript
+                with self._lock:
+                    if result.is_partial:
+                        self._partial = text
+                    else:
+                        self._final.append(text)
+                        self._partial = ''
+
+    def _transcript(self):
+        with self._lock:
+            return ' '.join(self._final + ([self._partial] if self._partial else []))
+
+    def feed(self, chunk):
+        if chunk:
+            self._run(self._stream.input_stream.send_audio_event(audio_chunk=chunk))
+        return self._transcript()
+
+    def finish(self, timeout=5):
+        self._run(self._stream.input_stream.end_stream())
+        try:
+            self._reader.result(timeout)
+        except Exception as e:
+            logs.error('Transcribe stream result failed', error=e)
+        self.close()
+        return self._transcript()
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+def create_recognizer(language_code, media_encoding):
+    kind = os.environ.get('SPEECH_RECOGNIZER', 'transcribe')
+    if kind == 'fake':
+        return FakeRecognizer(language_code)
+    if media_encoding not in STREAMING_ENCODINGS:
+        raise UnsupportedEncoding(f"Unsupported encoding for streaming recognition: {media_encoding}")
+    return TranscribeStreamingRecognizer(language_code, media_encoding)
+
+# Sessions live in the warm container; a chunk that lands on another container raises
+# SessionLost and the client falls back to the batch voice upload
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def _expire_sessions(now):
+    for session_id, session in list(_sessions.items()):
+        if now - session['touched'] > SESSION_IDLE_TIMEOUT:
+            session['recognizer'].close()
+            del _sessions[session_id]
+
+def feed_session(session_id, seq, chunk, language_code, media_encoding, final=False):
+    now = time.time()
+    with _sessions_lock:
+        _expire_sessions(now)
+        session = _sessions.get(session_id)
+        if session is None:
+            if seq != 0:
+                raise SessionLost(session_id)
+            session = {'recognizer': create_recognizer(language_code, media_encoding), 'next_seq': 0}
+            _sessions[session_id] = session
+        if seq != session['next_seq']:
+            raise SessionLost(session_id)
+        session['next_seq'] += 1
+        session['touched'] = now
+
+    transcript = session['recognizer'].feed(chunk)
+    if not final:
+        return transcript, False
+
+    with _sessions_lock:
+        _sessions.pop(session_id, None)
+    return session['recognizer'].finish(), True
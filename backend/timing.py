@@ -0,0 +1,66 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-request stage timers. The timing middleware (routing.py) starts a RequestTimer for every
+# HTTP request; code anywhere below the handler wraps its slow parts in `with stage('s3'):` and
+# the time is added to that request's stages. The result goes out as a Server-Timing header
+# (visible in the browser's network panel) and as one structured log record per request.
+# The timer is thread-local: work on other threads (quiz worker pools, background refreshes) is
+# not attributed to the request, so wrap the call that waits for it instead.
+# Stages nest and repeat: a stage that is already open is not timed again (invoke_llama inside
+# a quiz 'generation' counts once), and a stage entered twice adds up.
+
+_local = threading.local()
+
+class RequestTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._open = set()
+
+    @contextmanager
+    def stage(self, name):
+        if name in self._open:
+            yield
+            return
+        self._open.add(name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._open.discard(name)
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self):
+        # Server-Timing: parse;dur=0.2, s3;dur=41.7, generation;dur=812.0, total;dur=860.3
+        metrics = [f"{name};dur={ms:.1f}" for name, ms in self.stages.items()]
+        metrics.append(f"total;dur={self.total_ms():.1f}")
+        return ', '.join(metrics)
+
+    def record(self):
+        return {'total_ms': round(self.total_ms(), 1),
+                'stages': {name: round(ms, 1) for name, ms in self.stages.items()}}
+
+def current():
+    return getattr(_local, 'timer', None)
+
+def start():
+    _local.timer = RequestTimer()
+    return _local.timer
+
+def finish():
+    _local.timer = None
+
+@contextmanager
+def stage(name):
+    # No-op outside a timed request (async invocations, worker threads, benchmarks calling helpers)
+    timer = current()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
@@ -0,0 +1,238 @@
+import bisect
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+
+import logs
+
+# AWS call-level tracing through botocore's event system: one span per API call made by any
+# client built from the hooked session (every client in aws_clients.py, hence lambda_function.py).
+#   before-call       - start time and request bytes, stored in the call's request context
+#   needs-retry       - once per attempt: counts retries and throttled attempts
+#   after-call        - status, retries, response bytes; closes the span
+#   after-call-error  - connection errors and timeouts that never produced a response
+# A span is {service, operation, ms, status, retries, throttles, bytesOut, bytesIn, error, route}.
+# For streaming operations (invoke_model_with_response_stream, retrieve_and_generate_stream, S3
+# GetObject) ms is the time to the response headers, not to the end of the stream.
+#
+# Sampling is per invocation (TRACE_SAMPLE_RATE, default 0). At 0 no hook is registered at all,
+# so tracing costs nothing; otherwise unsampled calls cost one flag check per event.
+# Like the stage timers in timing.py, the sampling decision and the request's spans are
+# thread-local: calls from other threads (quiz worker pools, the KB cache refresh) are not sampled
+# and can never land in a concurrent request's spans.
+# Sampled spans feed per-operation latency histograms kept for the container's lifetime
+# (summary()), are logged once per request, and are appended as JSON lines to TRACE_FILE
+# when it is set (for example /tmp/tacmed-trace.jsonl). For offline analysis:
+#   python backend/tracing.py trace.jsonl [more.jsonl ...]
+
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0'))
+TRACE_FILE = os.environ.get('TRACE_FILE', '')
+MAX_SPANS = 1000
+
+# Histogram bucket upper bounds in ms; the last bucket is open-ended
+BOUNDS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 120000]
+THROTTLE_CODES = {'Throttling', 'ThrottlingException', 'ThrottledException', 'TooManyRequestsException',
+                  'ProvisionedThroughputExceededException', 'RequestLimitExceeded', 'SlowDown',
+                  'RequestThrottled', 'RequestThrottledException'}
+
+_CONTEXT_KEY = 'tacmed_trace'
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+    def add(self, span):
+        self.buckets[bisect.bisect_left(BOUNDS, span['ms'])] += 1
+        self.count += 1
+        self.total_ms += span['ms']
+        self.max_ms = max(self.max_ms, span['ms'])
+        self.errors += 1 if span.get('error') else 0
+        self.retries += span.get('retries', 0)
+        self.throttles += span.get('throttles', 0)
+        self.bytes_out += span.get('bytesOut', 0)
+        self.bytes_in += span.get('bytesIn', 0)
+
+    def percentile(self, q):
+        # Upper bound of the bucket holding the q-quantile, never above the largest value seen
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return round(min(BOUNDS[i] if i < len(BOUNDS) else self.max_ms, self.max_ms), 1)
+        return round(self.max_ms, 1)
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total_ms / self.count, 1) if self.count else 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': round(self.max_ms, 1),
+            'errors': self.errors,
+            'retries': self.retries,
+            'throttles': self.throttles,
+            'bytes_out': self.bytes_out,
+            'bytes_in': self.bytes_in
+        }
+
+class Tracer:
+    def __init__(self, sample_rate=TRACE_SAMPLE_RATE, trace_file=TRACE_FILE):
+        self.sample_rate = sample_rate
+        self.trace_file = trace_file
+        self.histograms = {}
+        self.spans = deque(maxlen=MAX_SPANS)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def sampled(self):
+        return getattr(self._local, 'sampled', False)
+
+    @sampled.setter
+    def sampled(self, value):
+        self._local.sampled = value
+
+    @property
+    def _request_spans(self):
+        spans = getattr(self._local, 'spans', None)
+        if spans is None:
+            spans = self._local.spans = []
+        return spans
+
+    def install(self, session):
+        # session: a boto3 Session; clients created from it afterwards carry the hooks
+        if self.sample_rate <= 0:
+            return False
+        events = session.events
+        events.register('before-call', self._before_call)
+        events.register('needs-retry', self._needs_retry)
+        events.register('after-call', self._after_call)
+        events.register('after-call-error', self._after_call_error)
+        return True
+
+    def start_request(self):
+        self.sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        self._local.spans = []
+
+    def end_request(self):
+        # Logs and exports the spans of the invocation that just finished
+        spans, self._local.spans = self._request_spans, []
+        if not spans:
+            return spans
+        logs.info('AWS calls', calls=[f"{s['service']}.{s['operation']} {s['ms']:.0f}ms" for s in spans],
+                  aws_ms=round(sum(s['ms'] for s in spans), 1))
+        if self.trace_file:
+            try:
+                with open(self.trace_file, 'a', encoding='utf-8') as f:
+                    for span in spans:
+                        f.write(json.dumps(span) + '\n')
+            except OSError as e:
+                logs.warning('Trace export failed', path=self.trace_file, error=e)
+        return spans
+
+    # botocore handlers: keyword arguments only, and always return None
+    # (a value from before-call would replace the request, one from needs-retry would force a retry)
+
+    def _before_call(self, model, params, context, **kwargs):
+        if not self.sampled:
+            return
+        body = params.get('body')
+        context[_CONTEXT_KEY] = {
+            'started': time.perf_counter(),
+            'bytesOut': len(body) if isinstance(body, (bytes, str)) else 0,
+            'throttles': 0
+        }
+
+    def _needs_retry(self, request_dict, response=None, caught_exception=None, **kwargs):
+        trace = (request_dict.get('context') or {}).get(_CONTEXT_KEY)
+        if trace is None or response is None:
+            return
+        code = response[1].get('Error', {}).get('Code')
+        if code in THROTTLE_CODES:
+            trace['throttles'] += 1
+
+    def _after_call(self, http_response, parsed, model, context, event_name, **kwargs):
+        trace = context.pop(_CONTEXT_KEY, None)
+        if trace is None:
+            return
+        metadata = parsed.get('ResponseMetadata', {})
+        error = parsed.get('Error', {}).get('Code') if http_response.status_code >= 300 else None
+        self._finish(event_name, trace, {
+            'status': http_response.status_code,
+            'retries': metadata.get('RetryAttempts', 0),
+            'bytesIn': int(http_response.headers.get('content-length') or 0),
+            'error': error
+        })
+
+    def _after_call_error(self, exception, context, event_name, **kwargs):
+        trace = context.pop(_CONTEXT_KEY, None)
+        if trace is None:
+            return
+        self._finish(event_name, trace, {'status': 0, 'retries': 0, 'bytesIn': 0,
+                                         'error': type(exception).__name__})
+
+    def _finish(self, event_name, trace, fields):
+        # event_name: after-call.<service-id>.<Operation>
+        _, service, operation = event_name.split('.', 2)
+        request = logs.current()
+        span = {
+            'service': service,
+            'operation': operation,
+            'ms': round((time.perf_counter() - trace['started']) * 1000, 2),
+            'bytesOut': trace['bytesOut'],
+            'throttles': trace['throttles'],
+            'route': request.route if request else None,
+            'ts': time.time()
+        }
+        span.update(fields)
+        if not span['error']:
+            del span['error']
+        with self._lock:
+            self.histograms.setdefault(f"{service}.{operation}", Histogram()).add(span)
+            self.spans.append(span)
+            self._request_spans.append(span)
+
+    def summary(self):
+        with self._lock:
+            return {op: h.summary() for op, h in sorted(self.histograms.items())}
+
+def summarize_file(paths):
+    # Per-operation histograms from exported span files
+    histograms = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    span = json.loads(line)
+                    histograms.setdefault(f"{span['service']}.{span['operation']}", Histogram()).add(span)
+    return {op: h.summary() for op, h in sorted(histograms.items())}
+
+def main(paths):
+    summary = summarize_file(paths)
+    print(f"{'operation':<44} {'calls':>6} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} "
+          f"{'err':>4} {'retry':>5} {'thr':>4} {'KB in':>8}")
+    for op, s in sorted(summary.items(), key=lambda kv: -kv[1]['mean_ms'] * kv[1]['count']):
+        print(f"{op:<44} {s['count']:>6} {s['mean_ms']:>8.1f} {s['p50_ms']:>8.0f} {s['p95_ms']:>8.0f} "
+              f"{s['p99_ms']:>8.0f} {s['max_ms']:>8.1f} {s['errors']:>4} {s['retries']:>5} {s['throttles']:>4} "
+              f"{s['bytes_in'] / 1024:>8.1f}")
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit('usage: python tracing.py trace.jsonl [more.jsonl ...]')
+    main(sys.argv[1:])
@@ -0,0 +1,142 @@
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+import unicodedata
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-central-1')
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+import build_doc_router
+import extract_kb
+import lambda_function
+from doc_router import DocRouter
+
+# Which PDFs /ask sends to EXTERNAL_SOURCES, before and after the document router, on the bucket as
+# listed in s3_list.txt (11 PDFs; the listing lost the Cyrillic names, the kb/ copies are matched
+# back by size) and labelled questions in Ukrainian and English.
+#   listing   - today: the first five keys in listing order
+#   routed    - lambda_function.route_documents: identical copies once, then the router's top
+#               ROUTER_TOP_DOCS documents
+# Reported: how often a document that answers the question is sent, how often the router's first
+# pick is one, how many documents and MB go out per question, and rank() latency.
+
+CLINICAL_EN_UA = 'clinical-guidelines-2024-en-ua.pdf'
+CLINICAL_UA = 'clinical-guidelines-2024-ua (1).pdf'
+CBRN = 'pidgotovka_cbrn_dovidnyk-2.pdf'
+TACEVAC = 'tacevac-guidelines-ua.pdf'
+PSYCH = 'Психологічна допомога в умовах бойових дій 2025-2.pdf'
+GUIDELINES = {CLINICAL_EN_UA, CLINICAL_UA, TACEVAC}
+
+# (question, documents that answer it)
+QUESTIONS = [
+    ('Як захиститися від хімічної зброї?', {CBRN}),
+    ('Які засоби захисту органів дихання та шкіри використовують при зараженні?', {CBRN}),
+    ('Як діяти особовому складу на зараженій радіацією місцевості?', {CBRN}),
+    ('Що таке ударна хвиля ядерного вибуху і як від неї укритися?', {CBRN}),
+    ('Як застосовувати димові гранати для маскування?', {CBRN}),
+    ('Для чого потрібен індивідуальний протихімічний пакет?', {CBRN}),
+    ('How do I protect my unit in a CBRN attack?', {CBRN}),
+    ('Що робити, якщо побратим впав у заціпеніння?', {PSYCH}),
+    ('Як допомогти бійцю з панічною атакою або тривогою?', {PSYCH}),
+    ('Які ознаки бойової психічної травми?', {PSYCH}),
+    ('Як надати психологічну допомогу при нервовому тремтінні?', {PSYCH}),
+    ('Що передати евакуаційній команді під час передачі пораненого?', {TACEVAC, CLINICAL_EN_UA, CLINICAL_UA}),
+    ('Як запобігти гіпотермії пораненого під час евакуації?', GUIDELINES),
+    ('Як правильно накласти турнікет на кінцівку?', GUIDELINES),
+    ('Ознаки напруженого пневмотораксу і як виконати голкову декомпресію?', GUIDELINES),
+    ('Як зупинити кровотечу гемостатичною пов’язкою?', GUIDELINES),
+    ('Коли вводити транексамову кислоту?', GUIDELINES),
+    ('Як знеболити пораненого з помірним болем?', GUIDELINES),
+    ('Яка допомога при проникній травмі ока?', GUIDELINES),
+    ('What is the only intervention during care under fire?', {CLINICAL_EN_UA}),
+    ('Which antibiotics should be given for open combat wounds?', {CLINICAL_EN_UA}),
+    ('What dose of ketamine is used for pain?', {CLINICAL_EN_UA}),
+    ('How do you treat a tension pneumothorax?', {CLINICAL_EN_UA}),
+    ('When should a junctional tourniquet be used?', {CLINICAL_EN_UA}),
+]
+
+def bucket_manifest(listing, kb_dir):
+    # [{'key', 'etag', 'size'}] in listing order; keys the listing garbled get the kb/ name of that size
+    by_size = {os.path.getsize(os.path.join(kb_dir, n)): unicodedata.normalize('NFC', n)
+               for n in os.listdir(kb_dir) if n.lower().endswith('.pdf')}
+    manifest = []
+    with open(listing, encoding='utf-8-sig') as f:
+        for line in f:
+            match = re.match(r'\S+ \S+\s+(\d+) (.+\.pdf)$', line.strip())
+            if not match:
+                continue
+            size, key = int(match.group(1)), match.group(2)
+            if '?' in key:
+                key = by_size.get(size, key)
+            # The listing has no ETags; identical sizes stand in for identical content
+            manifest.append({'key': key, 'etag': f"size-{size}", 'size': size})
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the document router against listing order')
+    parser.add_argument('--chunks', default=extract_kb.OUT, help='extract_kb.py columns file (extracted if missing)')
+    parser.add_argument('--kb-dir', default=os.path.join(ROOT, 'kb'))
+    parser.add_argument('--listing', default=os.path.join(ROOT, 's3_list.txt'))
+    parser.add_argument('--top', type=int, default=lambda_function.ROUTER_TOP_DOCS)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.chunks):
+        extract_kb.print_report(extract_kb.extract_corpus(args.kb_dir, args.chunks))
+    path = os.path.join(tempfile.mkdtemp(prefix='tacmed-router-'), 'router.json')
+    stats = build_doc_router.build(args.chunks, path)
+    started = time.perf_counter()
+    router = DocRouter(path)
+    load_ms = (time.perf_counter() - started) * 1000
+    print(f"Router: {stats['docs']} docs, {stats['sections']} sections, {stats['terms']} terms, "
+          f"{stats['bytes'] / 1024:.0f} KB, loaded in {load_ms:.1f} ms")
+
+    lambda_function.logs.print = lambda *a, **k: None
+    lambda_function.ROUTER_TOP_DOCS = args.top
+    lambda_function._doc_router.update(loaded=True, router=router)
+    manifest = bucket_manifest(args.listing, args.kb_dir)
+    sizes = {doc['key']: doc['size'] for doc in manifest}
+    print(f"Bucket: {len(manifest)} PDFs, {sum(sizes.values()) / 2 ** 20:.1f} MB\n")
+
+    totals = {name: {'answered': 0, 'docs': 0, 'mb': 0.0} for name in ('listing', 'routed')}
+    first_right = 0
+    misses = []
+    for question, expected in QUESTIONS:
+        chosen = {'listing': [doc['key'] for doc in manifest][:5],
+                  'routed': lambda_function.route_documents(question, manifest)}
+        for name, keys in chosen.items():
+            totals[name]['answered'] += bool(expected & set(keys))
+            totals[name]['docs'] += len(keys)
+            totals[name]['mb'] += sum(sizes[k] for k in keys) / 2 ** 20
+        ranked = router.rank(question)
+        first_right += bool(ranked) and unicodedata.normalize('NFC', ranked[0]['key']) in expected
+        if not expected & set(chosen['routed']):
+            misses.append(f"{question} -> {', '.join(chosen['routed'])}")
+
+    n = len(QUESTIONS)
+    print(f"{'':<8} {'answering doc sent':>18} {'docs/question':>14} {'MB/question':>12}")
+    for name, t in totals.items():
+        print(f"{name:<8} {t['answered']:>11}/{n:<6} {t['docs'] / n:>14.1f} {t['mb'] / n:>12.1f}")
+    print(f"Router's first pick answers the question: {first_right}/{n}")
+    for miss in misses:
+        print(f"  missed: {miss}")
+
+    rounds = 2000
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for question, _ in QUESTIONS:
+            router.rank(question)
+    rank_us = (time.perf_counter() - started) / (rounds * n) * 1e6
+    keys = [doc['key'] for doc in manifest]
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for question, _ in QUESTIONS:
+            router.route(question, keys, k=args.top)
+    route_us = (time.perf_counter() - started) / (rounds * n) * 1e6
+    print(f"\nrank(): {rank_us:.1f} us per question; route() over the bucket keys: {route_us:.1f} us")
+
+if __name__ == '__main__':
+    main()
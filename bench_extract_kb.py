@@ -0,0 +1,158 @@
+
+import argparse
+import heapq
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import extract_kb
+from kb_columns import ChunkColumns, write_columns
+
+# Throughput of extract_kb.py on the real kb/ PDFs (needs pypdf), for planning a larger library.
+#   1. CPU seconds per page, page by page: pages/s per core for PDF text and for normalizing and
+#      chunking, and how uneven pages are
+#   2. the extraction measured end to end with --workers processes
+#   3. projected wall time on more cores, by replaying the per-page costs through the pool's FIFO
+#      scheduling: whole-document tasks against page ranges (the longest document bounds the former)
+#   4. the columnar file: size against the raw text and a JSON dump of the same chunks, open time,
+#      random and sequential chunk reads, a column scan, and a write/read round trip
+# --copies N extracts N copies of every PDF, standing in for a larger doctrine library.
+
+def per_page_costs(kb_dir, names, source):
+    costs = {}
+    pages = {}
+    for name in names:
+        path = os.path.join(kb_dir, name)
+        costs[name] = []
+        pages[name] = []
+        for page_no in range(source.count(path)):
+            texts, seconds = extract_kb.read_range(source, path, page_no, page_no + 1)
+            costs[name].append(seconds)
+            pages[name].extend(texts)
+    return costs, pages
+
+def project(costs, normalize, cores, pages_per_task):
+    # Makespan of the pool: read tasks in submission order to the first free process, then each
+    # document's normalize task once its last range is done
+    tasks = [(name, sum(costs[name][start:start + pages_per_task]))
+             for name in costs for start in range(0, len(costs[name]), pages_per_task)]
+    free = [0.0] * cores
+    done = {}
+    for name, seconds in tasks:
+        end = heapq.heappop(free) + seconds
+        heapq.heappush(free, end)
+        done[name] = max(done.get(name, 0.0), end)
+    for name in sorted(done, key=done.get):
+        start = max(heapq.heappop(free), done[name])
+        heapq.heappush(free, start + normalize[name])
+    return max(free)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parallel PDF extraction and the chunk columns file')
+    parser.add_argument('--kb-dir', default=os.path.join(extract_kb.ROOT, 'kb'))
+    parser.add_argument('--copies', type=int, default=1, help='Copies of every PDF to extract')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--pages-per-task', type=int, default=extract_kb.PAGES_PER_TASK)
+    args = parser.parse_args()
+    try:
+        import pypdf  # noqa: F401
+    except ImportError:
+        raise SystemExit('bench_extract_kb.py extracts the real PDFs: pip install pypdf')
+
+    work = tempfile.mkdtemp(prefix='tacmed-extract-')
+    kb_dir = os.path.join(work, 'kb')
+    os.makedirs(kb_dir)
+    for name in sorted(os.listdir(args.kb_dir)):
+        if name.lower().endswith('.pdf'):
+            for n in range(args.copies):
+                shutil.copy(os.path.join(args.kb_dir, name), os.path.join(kb_dir, f"{n:03d}-{name}"))
+    names = sorted(os.listdir(kb_dir))
+    source = extract_kb.PdfSource()
+
+    # 1. Per page, in this process
+    costs, texts = per_page_costs(kb_dir, names, source)
+    normalize = {}
+    for doc_idx, name in enumerate(names):
+        normalize[name] = extract_kb.process_document(doc_idx, texts[name])[2]
+    all_costs = sorted(c for name in names for c in costs[name])
+    pages = len(all_costs)
+    read_cpu = sum(all_costs)
+    print(f"{len(names)} documents, {pages} pages")
+    print(f"PDF text:            {read_cpu:.2f}s CPU, {pages / read_cpu:.1f} pages/s per core "
+          f"(per page: median {all_costs[pages // 2] * 1000:.0f} ms, p95 {all_costs[int(pages * 0.95)] * 1000:.0f} ms, "
+          f"max {all_costs[-1] * 1000:.0f} ms)")
+    print(f"Normalize and chunk: {sum(normalize.values()):.2f}s CPU, {pages / sum(normalize.values()):.0f} pages/s per core")
+    for name in names:
+        print(f"  {name[:60]:<60} {len(costs[name]):>4} pages {sum(costs[name]):>6.2f}s")
+
+    # 2. End to end
+    out = os.path.join(work, 'chunks.col')
+    report = extract_kb.extract_corpus(kb_dir, out, args.workers, args.pages_per_task, source)
+    print()
+    extract_kb.print_report(report)
+
+    # 3. Projection
+    whole = max(len(c) for c in costs.values())
+    print(f"\nProjected wall time (s) from the per-page costs; pages/s in brackets")
+    sizes = (whole, 8, args.pages_per_task, 2) if args.pages_per_task not in (2, 8) else (whole, 8, 2)
+    print(f"{'cores':>5} {'whole documents':>18} " + ' '.join(f"{f'{size}-page ranges':>18}" for size in sizes[1:]))
+    for cores in (1, 2, 4, 8, 16, 32):
+        cells = []
+        for size in sizes:
+            seconds = project(costs, normalize, cores, size)
+            cells.append(f"{seconds:>7.2f} ({pages / seconds:>6.1f})")
+        print(f"{cores:>5} " + ' '.join(f"{c:>18}" for c in cells))
+
+    # 4. The columns file
+    chunks = ChunkColumns(out)
+    rows = list(chunks)
+    text_bytes = sum(len(r['text'].encode('utf-8')) for r in rows)
+    json_path = os.path.join(work, 'chunks.json')
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(rows, f, ensure_ascii=False)
+    print(f"\n{len(rows)} chunks: columns file {os.path.getsize(out) / 1024:.0f} KB, "
+          f"JSON {os.path.getsize(json_path) / 1024:.0f} KB, text alone {text_bytes / 1024:.0f} KB")
+
+    started = time.perf_counter()
+    for _ in range(200):
+        ChunkColumns(out).close()
+    open_us = (time.perf_counter() - started) / 200 * 1e6
+    started = time.perf_counter()
+    for _ in range(20):
+        with open(json_path, encoding='utf-8') as f:
+            json.load(f)
+    json_ms = (time.perf_counter() - started) / 20 * 1000
+    print(f"Open: {open_us:.0f} us (JSON load: {json_ms:.1f} ms)")
+
+    rng = random.Random(1)
+    picks = [rng.randrange(len(chunks)) for _ in range(2000)]
+    started = time.perf_counter()
+    for row in picks:
+        chunks.text(row)
+    random_us = (time.perf_counter() - started) / len(picks) * 1e6
+    started = time.perf_counter()
+    for _ in chunks:
+        pass
+    scan = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(100):
+        sum(chunks.columns['words'])
+    column_us = (time.perf_counter() - started) / 100 * 1e6
+    print(f"Random chunk text: {random_us:.0f} us; sequential rows: {len(chunks) / scan:,.0f}/s; "
+          f"summing one column: {column_us:.0f} us")
+
+    copy_path = os.path.join(work, 'copy.col')
+    docs = [{'key': d['key'], 'title': d['title'], 'pages': d['pages']} for d in chunks.docs]
+    index = {d['key']: i for i, d in enumerate(docs)}
+    write_columns(copy_path, docs, [dict(r, doc=index[r['doc']]) for r in rows])
+    with ChunkColumns(copy_path) as copy:
+        assert list(copy) == rows, 'columns round trip changed the chunks'
+    chunks.close()
+    print('Round trip: identical')
+    shutil.rmtree(work)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+
+import argparse
+import json
+import sys
+import time
+
+# Measures what history recording adds to request latency, per route.
+# The same mix of /score and /ask (canned answer) requests runs three times: with the history
+# writer disabled; flushing before lambda_handler returns (no post-invoke extension); and flushing
+# after the response, the way the post-invoke extension does it in Lambda (post_invoke.py), where
+# the write adds billed duration but no latency. DynamoDB is the latency-simulating fake from
+# bench_score_batch.py, and the history table's BatchWriteItem sleeps like any other call. The
+# writer starts its batch in the background as soon as a record comes in, so a route that records
+# before its last call (/score) hides the write, and one that records after it (/ask) pays a full
+# round trip when the flush is inline. Afterwards the recorded items are read back with a
+# time-range query.
+
+from bench_score_batch import FakeDB, FakeDynamo, FakeTable, lambda_function
+import history as history_module
+
+class FakeHistoryTable(FakeTable):
+    def batch_writer(self):
+        table = self
+
+        class Batch:
+            def __init__(self):
+                self.items = []
+
+            def __enter__(self):
+                return self
+
+            def put_item(self, Item):
+                self.items.append(Item)
+
+            def __exit__(self, *exc):
+                for start in range(0, len(self.items), 25):
+                    table.db.round_trip()
+                    with table.db.lock:
+                        for item in self.items[start:start + 25]:
+                            table.items[table.key_of(item)] = item
+
+        return Batch()
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues, ScanIndexForward=True, Limit=None, **kwargs):
+        self.db.round_trip()
+        values = ExpressionAttributeValues
+        rows = sorted((item for (user, ts), item in self.items.items() if user == values[':u']
+                       and values.get(':start', '') <= ts <= values.get(':end', '\uffff')),
+                      key=lambda item: item['Timestamp'], reverse=not ScanIndexForward)
+        return {'Items': rows[:Limit]}
+
+def percentiles(durations):
+    durations = sorted(durations)
+    pick = lambda q: durations[min(len(durations) - 1, int(q * len(durations)))]
+    return pick(0.5), pick(0.95), pick(0.99)
+
+def run(requests, after=None):
+    # {route: (p50, p95, p99)}; after() runs once the response is back, outside the timing
+    durations = {}
+    for event in requests:
+        started = time.perf_counter()
+        resp = lambda_function.lambda_handler(event, None)
+        durations.setdefault(event['rawPath'], []).append((time.perf_counter() - started) * 1000)
+        assert resp['statusCode'] == 200, resp
+        if after:
+            after()
+    return {route: percentiles(values) for route, values in sorted(durations.items())}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark request latency with and without history recording')
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--latency', type=float, default=5.0, help='Simulated DynamoDB round trip in ms')
+    args = parser.parse_args()
+
+    db = FakeDB(args.latency / 1000)
+    fake = FakeDynamo(db)
+    history_table = FakeHistoryTable(db, lambda_function.HISTORY_TABLE, ['UserId', 'Timestamp'])
+    lambda_function.dynamodb = fake
+    lambda_function.leaderboard = lambda_function.Leaderboard(
+        fake.board, fake.users, size=100, shards=lambda_function.LEADERBOARD_SHARDS)
+    lambda_function.logs.print = lambda *a, **k: None
+    # Keep /ask off the network: the answer path is not what is being measured here
+    lambda_function.cached_answer = lambda question, on_token=None: {'answer': 'Apply direct pressure.'}
+
+    def requests(user):
+        events = []
+        for i in range(args.requests):
+            path, body = ('/score', {'userId': user}) if i % 2 else ('/ask', {'question': 'bleeding', 'userId': user})
+            events.append({'rawPath': path, 'requestContext': {'http': {'method': 'POST'}}, 'body': json.dumps(body)})
+        return events
+
+    print(f"{'history':<16} {'route':<8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+
+    def report(name, results):
+        for route, (p50, p95, p99) in results.items():
+            print(f"{name:<16} {route:<8} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f}")
+
+    lambda_function.history = history_module.HistoryWriter(None)
+    report('off', run(requests('medic-off')))
+
+    # No extension (AWS_LAMBDA_RUNTIME_API is unset here): lambda_handler flushes before returning
+    lambda_function.history = history_module.HistoryWriter(history_table)
+    report('before return', run(requests('medic-inline')))
+    assert not lambda_function.history.summary()['queued'], lambda_function.history.summary()
+
+    writer = history_module.HistoryWriter(history_table)
+    lambda_function.history = writer
+    lambda_function.post_invoke.after_response = lambda: True
+    started_at = history_module.history_timestamp('')[:26]
+    report('after response', run(requests('medic-on'), after=writer.flush))
+
+    # Every invocation ended with a flush: nothing may still be queued here
+    assert not writer.summary()['queued'], writer.summary()
+    found = writer.query('medic-on', start=started_at, limit=args.requests * 2)
+    print(f"\nwriter: {writer.summary()}")
+    print(f"time-range query returned {len(found)} of {args.requests} records")
+
+if __name__ == '__main__':
+    main()
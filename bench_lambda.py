@@ -0,0 +1,509 @@
+
+import argparse
+import io
+import json
+import operator
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+# Offline benchmark of lambda_handler, route by route, against a stored baseline.
+# Every scenario is a realistic API Gateway v2 event (rawPath, requestContext.http.method,
+# queryStringParameters, JSON body) sent straight to lambda_handler. DynamoDB, S3, Bedrock,
+# Transcribe and Lambda are in-process fakes that sleep a configurable time per call and count
+# calls, so the report shows what the handler costs and how many round trips it makes:
+#   rps / p50 / p95 / p99 - sequential requests (one request at a time, like one Lambda container),
+#                           best of --rounds rounds
+#   cpu ms                - process CPU time per request (the handler and its threads), best of rounds
+#   aws/req               - fake AWS calls per request, history writes and reads included
+#   peak KB / kept KB     - tracemalloc peak above the pre-request level, and what is still held
+#                           afterwards (measured in a separate pass; tracing slows everything down)
+# bench_baseline.json holds the last accepted run. The gate only uses figures that do not depend on
+# when a sleeping thread gets woken up: a route that makes more AWS calls, or whose CPU time or
+# peak memory grows beyond --tolerance (plus a small absolute slack for tiny numbers), fails the run
+# with exit code 1. Wall-clock percentiles are reported, not gated: on a busy machine a 3 ms fake
+# round trip wakes up late often enough to move the p95 of a few dozen requests by more than any
+# regression worth catching. CPU time is only compared when the baseline used the same fake
+# latencies.
+#   python bench_lambda.py                      # compare with the baseline
+#   python bench_lambda.py --update-baseline    # accept the current numbers
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-central-1')
+os.environ.setdefault('KB_BUCKET', 'tacmed-kb-bench')
+os.environ['KB_INDEX_DIR'] = os.path.join(ROOT, 'no-kb-index')
+os.environ['SPEECH_RECOGNIZER'] = 'fake'
+# Quiz refills go through the (fake) async Lambda invoke instead of a local background thread
+os.environ['AWS_LAMBDA_FUNCTION_NAME'] = 'TacMed_Backend_bench'
+
+from bench_score_batch import FakeClient, FakeDB, FakeTable, lambda_function
+import logs
+from answer_cache import AnswerCache
+from history import HistoryWriter
+from leaderboard import rank_key, score_shard
+from quiz_pool import QuizPool
+
+BASELINE = os.path.join(ROOT, 'bench_baseline.json')
+OPS = {'=': operator.eq, '>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+
+class Services:
+    # Latency and call counts per fake service
+    def __init__(self, latencies):
+        self.latencies = latencies
+        self.calls = {name: 0 for name in latencies}
+        self.lock = threading.Lock()
+
+    def call(self, service):
+        with self.lock:
+            self.calls[service] += 1
+        if self.latencies[service]:
+            time.sleep(self.latencies[service] / 1000)
+
+    def total(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+class ServiceDB(FakeDB):
+    # FakeDB whose round trips are counted and delayed as 'dynamodb' calls
+    def __init__(self, services):
+        super().__init__(0)
+        self.services = services
+
+    def round_trip(self):
+        self.services.call('dynamodb')
+
+class MemoryTable(FakeTable):
+    # FakeTable plus the Query/Scan/DeleteItem/BatchWriteItem subset the backend uses
+    def __init__(self, db, name, keys, indexes=None):
+        super().__init__(db, name, keys)
+        self.indexes = indexes or {}
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues, ExpressionAttributeNames=None,
+              IndexName=None, Limit=None, ScanIndexForward=True, Select=None, ExclusiveStartKey=None, **kwargs):
+        self.db.round_trip()
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues
+        hash_key, range_key = self.indexes[IndexName] if IndexName else (self.keys + [None])[:2]
+        condition = re.sub(r'#\w+', lambda m: names[m.group(0)], KeyConditionExpression)
+        hash_part, _, range_part = condition.partition(' AND ')
+        hash_value = values[hash_part.split(' = ')[1]]
+        between = re.match(r'(\w+) BETWEEN (:\w+) AND (:\w+)', range_part)
+        if between:
+            low, high = values[between.group(2)], values[between.group(3)]
+            in_range = lambda v: low <= v <= high
+        elif range_part:
+            _, op, placeholder = range_part.split(' ')
+            in_range = lambda v: OPS[op](v, values[placeholder])
+        else:
+            in_range = lambda v: True
+        with self.db.lock:
+            rows = [dict(item) for item in self.items.values()
+                    if item.get(hash_key) == hash_value and (range_key is None or
+                                                             (range_key in item and in_range(item[range_key])))]
+        if range_key:
+            rows.sort(key=lambda item: item[range_key], reverse=not ScanIndexForward)
+            if ExclusiveStartKey:
+                after = ExclusiveStartKey[range_key]
+                rows = [r for r in rows if (r[range_key] > after if ScanIndexForward else r[range_key] < after)]
+        if Select == 'COUNT':
+            return {'Count': len(rows)}
+        page = rows[:Limit] if Limit else rows
+        resp = {'Items': page, 'Count': len(page)}
+        if Limit and len(rows) > Limit:
+            resp['LastEvaluatedKey'] = {k: page[-1][k] for k in {hash_key, range_key, *self.keys} if k in page[-1]}
+        return resp
+
+    def scan(self, FilterExpression=None, **kwargs):
+        self.db.round_trip()
+        missing = re.match(r'attribute_not_exists\((\w+)\)', FilterExpression or '')
+        with self.db.lock:
+            rows = [dict(item) for item in self.items.values() if not missing or missing.group(1) not in item]
+        return {'Items': rows, 'Count': len(rows)}
+
+    def delete_item(self, Key, ReturnValues=None, **kwargs):
+        self.db.round_trip()
+        with self.db.lock:
+            old = self.items.pop(self.key_of(Key), None)
+        return {'Attributes': old} if old and ReturnValues == 'ALL_OLD' else {}
+
+    def batch_writer(self):
+        table = self
+
+        class Batch:
+            def __init__(self):
+                self.items = []
+
+            def __enter__(self):
+                return self
+
+            def put_item(self, Item):
+                self.items.append(Item)
+
+            def __exit__(self, *exc):
+                for start in range(0, len(self.items), 25):
+                    table.db.round_trip()
+                    with table.db.lock:
+                        for item in self.items[start:start + 25]:
+                            table.items[table.key_of(item)] = dict(item)
+
+        return Batch()
+
+class MemoryDynamo:
+    # Stand-in for the boto3 DynamoDB resource: one MemoryTable per table name
+    def __init__(self, db):
+        self.db = db
+        self.meta = type('Meta', (), {'client': FakeClient(db)})()
+        lf = lambda_function
+        self.tables = {
+            lf.USERS_TABLE: MemoryTable(db, lf.USERS_TABLE, ['UserId'], {'ScoreShardIndex': ('ScoreShard', 'RankKey')}),
+            lf.LEADERBOARD_TABLE: MemoryTable(db, lf.LEADERBOARD_TABLE, ['Board', 'Key']),
+            lf.HISTORY_TABLE: MemoryTable(db, lf.HISTORY_TABLE, ['UserId', 'Timestamp']),
+            lf.ANSWER_CACHE_TABLE: MemoryTable(db, lf.ANSWER_CACHE_TABLE, ['QuestionKey']),
+            lf.VOICE_JOBS_TABLE: MemoryTable(db, lf.VOICE_JOBS_TABLE, ['JobId']),
+            lf.QUIZ_POOL_TABLE: MemoryTable(db, lf.QUIZ_POOL_TABLE, ['Pool', 'QuestionId'])
+        }
+
+    def Table(self, name):
+        return self.tables[name]
+
+class FakeS3:
+    def __init__(self, services):
+        self.services = services
+
+    def list_buckets(self):
+        self.services.call('s3')
+        return {'Buckets': [{'Name': 'tacmed-kb-bench'}]}
+
+    def get_paginator(self, name):
+        s3 = self
+
+        class Paginator:
+            def paginate(self, Bucket):
+                s3.services.call('s3')
+                yield {'Contents': [{'Key': f"guide-{i}.pdf", 'ETag': f'"etag{i}"', 'Size': 1 << 20} for i in range(4)]}
+
+        return Paginator()
+
+    def put_object(self, **kwargs):
+        self.services.call('s3')
+        return {'ETag': '"audio"'}
+
+    def delete_object(self, **kwargs):
+        self.services.call('s3')
+        return {}
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        # Local signing, no round trip
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?X-Amz-Signature=bench"
+
+    def create_multipart_upload(self, **kwargs):
+        self.services.call('s3')
+        return {'UploadId': uuid.uuid4().hex}
+
+    def complete_multipart_upload(self, **kwargs):
+        self.services.call('s3')
+        return {}
+
+def fake_quiz(n):
+    return {
+        'question': f"Casualty {n} has bright red spurting bleeding from the thigh. What is the first action?",
+        'options': ['Apply a tourniquet high and tight', 'Start an IV', 'Check the airway', 'Splint the leg'],
+        'correct_index': 0,
+        'explanation': 'Massive hemorrhage comes first in MARCH.'
+    }
+
+class FakeBedrockRuntime:
+    ANSWER = ("Apply a tourniquet 2-3 inches above the wound, tighten until the bleeding stops "
+              "and note the time of application.")
+
+    def __init__(self, services, chunk_chars=24):
+        self.services = services
+        self.chunk_chars = chunk_chars
+        self.counter = 0
+
+    def _generation(self, prompt):
+        # Quiz prompts get valid quiz JSON (distinct questions), everything else a short answer
+        batch = re.search(r'Generate (\d+) different', prompt)
+        with self.services.lock:
+            self.counter += int(batch.group(1)) if batch else 1
+            first = self.counter
+        if batch:
+            return json.dumps([fake_quiz(first - i) for i in range(int(batch.group(1)))])
+        if 'multiple-choice' in prompt:
+            return json.dumps(fake_quiz(first))
+        return self.ANSWER
+
+    def invoke_model(self, modelId, body):
+        self.services.call('bedrock')
+        text = self._generation(json.loads(body).get('prompt', ''))
+        return {'body': io.BytesIO(json.dumps({'generation': text}).encode())}
+
+    def invoke_model_with_response_stream(self, modelId, body):
+        self.services.call('bedrock')
+        text = self._generation(json.loads(body).get('prompt', ''))
+        chunks = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)]
+        return {'body': [{'chunk': {'bytes': json.dumps({'generation': c}).encode()}} for c in chunks]}
+
+class FakeAgentRuntime:
+    def __init__(self, services):
+        self.services = services
+
+    def retrieve_and_generate(self, input, retrieveAndGenerateConfiguration):
+        self.services.call('bedrock')
+        return {'output': {'text': FakeBedrockRuntime.ANSWER}}
+
+    def retrieve_and_generate_stream(self, input, retrieveAndGenerateConfiguration):
+        self.services.call('bedrock')
+        words = FakeBedrockRuntime.ANSWER.split(' ')
+        return {'stream': [{'output': {'text': w + ' '}} for w in words]}
+
+class FakeTranscribe:
+    def __init__(self, services):
+        self.services = services
+
+    def start_transcription_job(self, **kwargs):
+        self.services.call('transcribe')
+        return {}
+
+    def get_transcription_job(self, TranscriptionJobName):
+        self.services.call('transcribe')
+        return {'TranscriptionJob': {'TranscriptionJobName': TranscriptionJobName, 'TranscriptionJobStatus': 'IN_PROGRESS'}}
+
+    def delete_transcription_job(self, **kwargs):
+        self.services.call('transcribe')
+        return {}
+
+class FakeLambda:
+    def __init__(self, services):
+        self.services = services
+
+    def invoke(self, **kwargs):
+        self.services.call('lambda')
+        return {'StatusCode': 202}
+
+def http_event(method, path, body=None, query=None):
+    return {
+        'version': '2.0',
+        'routeKey': '$default',
+        'rawPath': path,
+        'rawQueryString': '&'.join(f"{k}={v}" for k, v in (query or {}).items()),
+        'headers': {'content-type': 'application/json', 'accept': 'application/json',
+                    'user-agent': 'Mozilla/5.0 (bench)', 'x-forwarded-for': '203.0.113.7'},
+        'queryStringParameters': query,
+        'requestContext': {
+            'http': {'method': method, 'path': path, 'protocol': 'HTTP/1.1', 'sourceIp': '203.0.113.7'},
+            'requestId': uuid.uuid4().hex,
+            'stage': '$default',
+            'timeEpoch': int(time.time() * 1000)
+        },
+        'body': json.dumps(body) if body is not None else None,
+        'isBase64Encoded': False
+    }
+
+def scenarios(users):
+    # name -> function(i) returning the i-th event; names are the keys of the baseline
+    audio_key = lambda i: f"audio-temp/{uuid.uuid4().hex}.webm"
+    return {
+        'POST /ask (cache miss)': lambda i: http_event('POST', '/ask', {'question': f"How do I treat wound {uuid.uuid4().hex}?", 'userId': 'bench-medic'}),
+        'POST /ask (cache hit)': lambda i: http_event('POST', '/ask', {'question': 'How to apply a tourniquet?', 'userId': 'bench-medic'}),
+        'POST /ask (sse)': lambda i: http_event('POST', '/ask', {'question': f"Needle decompression site {i}?", 'stream': True}),
+        'POST /ask (voice key)': lambda i: http_event('POST', '/ask', {'audioKey': audio_key(i), 'userId': 'bench-medic'}),
+        'POST /ask/upload': lambda i: http_event('POST', '/ask/upload', {'format': 'webm', 'size': 400000}),
+        'POST /ask/upload/complete': lambda i: http_event('POST', '/ask/upload/complete', {
+            'audioKey': audio_key(i), 'uploadId': 'bench', 'parts': [{'PartNumber': 1, 'ETag': '"a"'}]}),
+        'GET /ask/status': lambda i: http_event('GET', '/ask/status', query={'jobId': 'bench-job'}),
+        'POST /ask/stream': lambda i: http_event('POST', '/ask/stream', {
+            'sessionId': uuid.uuid4().hex, 'seq': 0, 'final': True, 'audio': 'A' * 16000, 'userId': 'bench-medic'}),
+        'POST /quiz': lambda i: http_event('POST', '/quiz', {}),
+        'POST /quiz (drill of 5)': lambda i: http_event('POST', '/quiz', {'count': 5}),
+        'GET /leaderboard': lambda i: http_event('GET', '/leaderboard'),
+        'GET /leaderboard (page 2)': lambda i: http_event('GET', '/leaderboard', query={'limit': '50', 'cursor': users['cursor']}),
+        'GET /leaderboard (week)': lambda i: http_event('GET', '/leaderboard', query={'window': 'week'}),
+        'GET /rank': lambda i: http_event('GET', '/rank', query={'userId': users['ids'][i % len(users['ids'])]}),
+        'POST /score': lambda i: http_event('POST', '/score', {'userId': users['ids'][i % len(users['ids'])]}),
+        'POST /score (event id)': lambda i: http_event('POST', '/score', {'userId': users['ids'][i % len(users['ids'])], 'eventId': uuid.uuid4().hex}),
+        'POST /score/batch (10)': lambda i: http_event('POST', '/score/batch', {
+            'userId': users['ids'][i % len(users['ids'])], 'events': [{'eventId': uuid.uuid4().hex} for _ in range(10)]}),
+        'GET /history': lambda i: http_event('GET', '/history', query={'userId': 'bench-medic', 'limit': '50'})
+    }
+
+def install_fakes(services, user_count, pool_size):
+    lf = lambda_function
+    db = ServiceDB(services)
+    dynamo = MemoryDynamo(db)
+    lf.dynamodb = dynamo
+    lf.s3 = FakeS3(services)
+    lf.bedrock_runtime = FakeBedrockRuntime(services)
+    lf.bedrock_agent_runtime = FakeAgentRuntime(services)
+    lf.transcribe = FakeTranscribe(services)
+    lf.lambda_client = FakeLambda(services)
+    lf.leaderboard = lf.Leaderboard(dynamo.Table(lf.LEADERBOARD_TABLE), dynamo.Table(lf.USERS_TABLE),
+                                    size=100, shards=lf.LEADERBOARD_SHARDS, bucket_width=lf.SCORE_INCREMENT,
+                                    score_step=lf.SCORE_INCREMENT)
+    lf.history = HistoryWriter(dynamo.Table(lf.HISTORY_TABLE))
+    lf.answer_cache = AnswerCache(table=dynamo.Table(lf.ANSWER_CACHE_TABLE), max_entries=256)
+    lf.quiz_pool = QuizPool(dynamo.Table(lf.QUIZ_POOL_TABLE))
+
+    # Seed without latency: users on the sharded index, a quiz pool, one pending voice job
+    latencies, services.latencies = services.latencies, dict.fromkeys(services.latencies, 0)
+    rng = random.Random(7)
+    ids = [f"bench-user-{n}" for n in range(user_count)]
+    users = dynamo.Table(lf.USERS_TABLE)
+    for user_id in ids:
+        score = rng.randint(1, 60) * lf.SCORE_INCREMENT
+        users.items[(user_id,)] = {'UserId': user_id, 'TotalScore': score, 'RankKey': rank_key(score, user_id),
+                                   'ScoreShard': score_shard(user_id, lf.LEADERBOARD_SHARDS)}
+    lf.leaderboard.rebuild_histogram()
+    lf.leaderboard.rebuild()
+    _, cursor = lf.leaderboard.page(limit=50)
+    lf.quiz_pool.add([fake_quiz(-n) for n in range(1, pool_size + 1)], source='bench')
+    dynamo.Table(lf.VOICE_JOBS_TABLE).items[('bench-job',)] = {
+        'JobId': 'bench-job', 'Status': 'TRANSCRIBING', 'Bucket': 'tacmed-kb-bench', 'AudioKey': 'audio-temp/x.webm'}
+    for n in range(60):
+        lf.history.record('bench-medic', 'quiz', Correct=True, Points=lf.SCORE_INCREMENT, Question=f"seed {n}")
+    lf.history.flush()
+    services.latencies = latencies
+    return {'ids': ids, 'cursor': cursor}
+
+def run_round(make_event, first, requests, services):
+    durations = []
+    calls_before = services.total()
+    statuses = set()
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    for i in range(requests):
+        event = make_event(first + i)
+        t = time.perf_counter()
+        resp = lambda_function.lambda_handler(event, None)
+        durations.append((time.perf_counter() - t) * 1000)
+        statuses.add(resp['statusCode'])
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    durations.sort()
+    pick = lambda q: durations[min(len(durations) - 1, int(q * len(durations)))]
+    return {
+        'rps': round(requests / elapsed, 1),
+        'p50_ms': round(pick(0.5), 2),
+        'p95_ms': round(pick(0.95), 2),
+        'p99_ms': round(pick(0.99), 2),
+        'cpu_ms': round(cpu * 1000 / requests, 3),
+        'aws_calls': round((services.total() - calls_before) / requests, 2),
+        'status': sorted(statuses)
+    }
+
+def run_scenario(make_event, requests, warmup, rounds, services):
+    # Best of several rounds per figure: a fake round trip is a sleep, and one late wakeup
+    # moves the p95 of a few dozen requests by more than any regression worth catching
+    for i in range(warmup):
+        lambda_function.lambda_handler(make_event(i), None)
+    results = [run_round(make_event, warmup + r * requests, requests, services) for r in range(rounds)]
+    best = {key: min(r[key] for r in results) for key in ('p50_ms', 'p95_ms', 'p99_ms', 'cpu_ms', 'aws_calls')}
+    best['rps'] = max(r['rps'] for r in results)
+    best['status'] = sorted({status for r in results for status in r['status']})
+    return best
+
+def measure_memory(make_event, requests):
+    peaks = []
+    kept = []
+    tracemalloc.start()
+    try:
+        for i in range(requests):
+            event = make_event(10_000 + i)
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            lambda_function.lambda_handler(event, None)
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            kept.append(current - before)
+    finally:
+        tracemalloc.stop()
+    return {'peak_kb': round(statistics.median(peaks) / 1024, 1), 'kept_kb': round(statistics.median(kept) / 1024, 1)}
+
+def compare(results, baseline, config, tolerance, slack_cpu_ms, slack_kb):
+    failures = []
+    same_config = baseline.get('config') == config
+    if not same_config:
+        print(f"\nbaseline was recorded with {baseline.get('config')}; comparing AWS calls and memory only")
+    for name, result in results.items():
+        base = baseline['routes'].get(name)
+        if base is None:
+            continue
+        # Half a call per request: background refills and merge retries move the average a little
+        if result['aws_calls'] > base['aws_calls'] + 0.5:
+            failures.append(f"{name}: {result['aws_calls']} AWS calls per request, baseline {base['aws_calls']}")
+        if same_config and 'cpu_ms' in base and result['cpu_ms'] > base['cpu_ms'] * (1 + tolerance) + slack_cpu_ms:
+            failures.append(f"{name}: {result['cpu_ms']} ms CPU per request, baseline {base['cpu_ms']} ms")
+        if result['peak_kb'] > base['peak_kb'] * (1 + tolerance) + slack_kb:
+            failures.append(f"{name}: peak {result['peak_kb']} KB, baseline {base['peak_kb']} KB")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark lambda_handler per route against a stored baseline')
+    parser.add_argument('--requests', type=int, default=40, help='Timed requests per route and round')
+    parser.add_argument('--rounds', type=int, default=3, help='Rounds per route; the best figure of each is kept')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--memory-requests', type=int, default=10, help='Requests per route in the tracemalloc pass')
+    parser.add_argument('--dynamo-ms', type=float, default=3.0)
+    parser.add_argument('--s3-ms', type=float, default=15.0)
+    parser.add_argument('--bedrock-ms', type=float, default=40.0)
+    parser.add_argument('--transcribe-ms', type=float, default=20.0)
+    parser.add_argument('--lambda-ms', type=float, default=10.0)
+    parser.add_argument('--users', type=int, default=500, help='Seeded leaderboard users')
+    parser.add_argument('--routes', help='Only scenarios whose name contains this text')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative growth of CPU time and peak memory')
+    parser.add_argument('--slack-cpu-ms', type=float, default=0.3, help='Absolute CPU-time slack on top of the tolerance')
+    parser.add_argument('--slack-kb', type=float, default=32.0, help='Absolute peak-memory slack on top of the tolerance')
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    config = {'dynamodb': args.dynamo_ms, 's3': args.s3_ms, 'bedrock': args.bedrock_ms,
+              'transcribe': args.transcribe_ms, 'lambda': args.lambda_ms}
+    services = Services(dict(config))
+    logs.print = lambda *a, **k: None
+    users = install_fakes(services, args.users, pool_size=(args.requests * args.rounds + args.warmup + args.memory_requests) * 7)
+
+    results = {}
+    print(f"{'route':<28} {'rps':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'cpu ms':>8} {'aws/req':>8} {'peak KB':>8} {'kept KB':>8}  status")
+    for name, make_event in scenarios(users).items():
+        if args.routes and args.routes not in name:
+            continue
+        result = run_scenario(make_event, args.requests, args.warmup, args.rounds, services)
+        result.update(measure_memory(make_event, args.memory_requests))
+        results[name] = result
+        print(f"{name:<28} {result['rps']:>7.1f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+              f"{result['cpu_ms']:>8.3f} {result['aws_calls']:>8.2f} {result['peak_kb']:>8.1f} {result['kept_kb']:>8.1f}  {result['status']}")
+
+    if args.update_baseline:
+        baseline = {'config': config, 'routes': results}
+        if os.path.exists(args.baseline) and args.routes:
+            # A partial run only replaces the routes it measured
+            with open(args.baseline, encoding='utf-8') as f:
+                previous = json.load(f)
+            if previous.get('config') == config:
+                baseline['routes'] = dict(previous['routes'], **results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+            f.write('\n')
+        print(f"\nbaseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nno baseline at {args.baseline}; run with --update-baseline to record one")
+        return
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    failures = compare(results, baseline, config, args.tolerance, args.slack_cpu_ms, args.slack_kb)
+    if failures:
+        print('\nRegressions against the baseline:\n  ' + '\n  '.join(failures))
+        sys.exit(1)
+    print('\nNo regressions against the baseline.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+
+import argparse
+import bisect
+import os
+import random
+import sys
+import time
+
+# Compares two ways of serving GET /leaderboard at growing user counts:
+#   scan   - read every user from the TotalScore GSI and sort in the Lambda (what a correct scan needs)
+#   top    - one get_item of the materialized top record kept by backend/leaderboard.py
+# and, for GET /rank, counting users above a score against one read of the score histogram.
+# Pages past the top record are checked against the full sort and reported as index items read.
+# DynamoDB is replaced with in-memory tables that count the items each request reads.
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+from leaderboard import Leaderboard, rank_key, score_shard
+
+class ConditionalCheckFailed(Exception):
+    pass
+
+class _Client:
+    class exceptions:
+        ConditionalCheckFailedException = ConditionalCheckFailed
+
+class _Meta:
+    client = _Client()
+
+class MemoryTable:
+    meta = _Meta()
+
+    def __init__(self):
+        self.items = {}
+        self.read_items = 0
+
+    def get_item(self, Key, **kwargs):
+        item = self.items.get(tuple(Key.values()))
+        self.read_items += 1
+        return {'Item': item} if item else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeValues=None, **kwargs):
+        key = (Item['Board'], Item['Key'])
+        current = self.items.get(key)
+        if ConditionExpression and current and current.get('Version') != ExpressionAttributeValues[':v']:
+            raise ConditionalCheckFailed()
+        self.items[key] = Item
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+                    ConditionExpression=None):
+        key = tuple(Key.values())
+        if ConditionExpression and key not in self.items:
+            raise ConditionalCheckFailed()
+        item = self.items.setdefault(key, dict(Key))
+        # Only the "ADD name :value, ..." form used by the histogram
+        for clause in UpdateExpression[len('ADD '):].split(', '):
+            name, value = clause.split(' ')
+            name = ExpressionAttributeNames.get(name, name)
+            item[name] = item.get(name, 0) + ExpressionAttributeValues[value]
+        return {}
+
+class MemoryUsers:
+    def __init__(self, shards):
+        self.scores = {}
+        self.shards = shards
+        self.read_items = 0
+        self._by_shard = {}
+
+    def scan_sorted(self, limit):
+        self.read_items += len(self.scores)
+        ranked = sorted(self.scores.items(), key=lambda kv: (-kv[1], kv[0]))
+        return [{'UserId': u, 'TotalScore': s} for u, s in ranked[:limit]]
+
+    def query(self, ExpressionAttributeValues, Limit=None, **kwargs):
+        shard = ExpressionAttributeValues[':s']
+        if shard not in self._by_shard:
+            self._by_shard[shard] = sorted((rank_key(s, u), u, s) for u, s in self.scores.items()
+                                           if score_shard(u, self.shards) == shard)
+        rows = self._by_shard[shard]
+        if ':after' in ExpressionAttributeValues:
+            rows = rows[bisect.bisect_right(rows, (ExpressionAttributeValues[':after'], '\uffff')):]
+        rows = rows[:Limit] if Limit else rows
+        self.read_items += len(rows)
+        return {'Items': [{'UserId': u, 'TotalScore': s} for _, u, s in rows]}
+
+    def count_above(self, score):
+        self.read_items += len(self.scores)
+        return sum(1 for s in self.scores.values() if s > score)
+
+def timed(fn, rounds):
+    durations = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - started) * 1000)
+    durations.sort()
+    return durations[len(durations) // 2]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark scan+sort vs materialized top-N leaderboard reads')
+    parser.add_argument('--users', default='10000,100000,1000000')
+    parser.add_argument('--updates', type=int, default=2000, help='Score updates replayed per size')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--size', type=int, default=100)
+    parser.add_argument('--shards', type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'users':>9} {'scan ms':>9} {'scan items':>11} {'top ms':>8} {'top items':>10} "
+          f"{'update ms':>10} {'skipped':>8} {'merges':>7} {'agree':>6}")
+    rank_rows = []
+    for count in [int(c) for c in args.users.split(',')]:
+        users = MemoryUsers(args.shards)
+        users.scores = {f"user-{i}": rng.randrange(1, 100) * 100 for i in range(count)}
+        table = MemoryTable()
+        board = Leaderboard(table, users, size=args.size, shards=args.shards)
+        board.rebuild()
+        board.rebuild_histogram()
+
+        users.read_items = 0
+        scan_ms = timed(lambda: users.scan_sorted(10), args.rounds)
+        scan_items = users.read_items // args.rounds
+
+        table.read_items = 0
+        top_ms = timed(lambda: board.top(limit=10), args.rounds)
+        top_items = table.read_items // args.rounds
+
+        # Replay /score writes: mostly ordinary users, a few climbing into the top
+        ids = list(users.scores)
+        started = time.perf_counter()
+        for _ in range(args.updates):
+            user_id = rng.choice(ids)
+            old = users.scores[user_id]
+            users.scores[user_id] += 100 if rng.random() < 0.95 else 5000
+            board.move_score(old, users.scores[user_id])
+            board.record(user_id, users.scores[user_id])
+        update_ms = (time.perf_counter() - started) * 1000 / args.updates
+        users._by_shard = {}
+
+        agree = board.top(limit=10) == users.scan_sorted(10)
+        print(f"{count:>9} {scan_ms:>9.2f} {scan_items:>11} {top_ms:>8.3f} {top_items:>10} "
+              f"{update_ms:>10.4f} {board.stats['skipped']:>8} {board.stats['merges']:>7} {str(agree):>6}")
+
+        # Rank lookups: histogram read vs counting every user above the score
+        probe = users.scores[rng.choice(ids)]
+        count_ms = timed(lambda: users.count_above(probe), args.rounds)
+        hist_ms = timed(lambda: board.rank(probe), args.rounds)
+        rank_ok = board.rank(probe)['rank'] == users.count_above(probe) + 1
+
+        # Walk five pages past the top record, checking them against the full sort
+        cursor = None
+        walked = []
+        for i in range(args.size // 10 + 5):
+            if i == args.size // 10:
+                users.read_items = 0
+            page, cursor = board.page(cursor=cursor, limit=10)
+            walked += page
+        deep_items = users.read_items // 5
+        pages_ok = walked == users.scan_sorted(len(walked))
+        rank_rows.append((count, count_ms, hist_ms, rank_ok, deep_items, pages_ok))
+
+    print(f"\n{'users':>9} {'count ms':>9} {'hist ms':>8} {'rank ok':>8} {'deep page items':>16} {'pages ok':>9}")
+    for count, count_ms, hist_ms, rank_ok, deep_items, pages_ok in rank_rows:
+        print(f"{count:>9} {count_ms:>9.2f} {hist_ms:>8.3f} {str(rank_ok):>8} {deep_items:>16} {str(pages_ok):>9}")
+
+if __name__ == '__main__':
+    main()
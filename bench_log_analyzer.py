@@ -0,0 +1,175 @@
+
+import argparse
+import json
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+
+import analyze_logs
+import get_logs
+
+# Throughput, memory and correctness of analyze_logs.py / get_logs.py on synthetic Lambda logs.
+# The generator writes what the backend writes today (platform START/END/REPORT lines around logs.py
+# JSON lines and the per-request EMF record), interleaved across several log streams, with known
+# numbers of requests per route, cold starts, 5xx responses, fallbacks and transcription timeouts.
+#   1. analyze about a million generated lines: lines/s (generation time subtracted), and the
+#      tracemalloc peak at 5% vs 50% of the input (histogram buckets fill up, nothing else grows)
+#   2. check the analyzer's counts against what was generated
+#   3. fetch the same lines through get_logs.fetch_events from a paginating fake CloudWatch client
+#      with per-call latency: every event exactly once, and speed-up with more workers
+
+ROUTES = {'POST /ask': 3, 'POST /quiz': 3, 'POST /score': 3, 'GET /leaderboard': 2, 'GET /ask/status': 1}
+
+def generate(requests, streams=8, seed=3, truth=None):
+    # Yields (message, stream, timestamp); fills truth with the expected counts
+    rng = random.Random(seed)
+    names, weights = zip(*ROUTES.items())
+    truth = truth if truth is not None else {}
+    truth.update(routes={}, cold_starts=0, errors_5xx=0, rag_fallback=0, transcription_timeout=0)
+    open_requests = {}
+    ts = 1768058519000
+    for n in range(requests):
+        stream = f"2026/01/10/[$LATEST]{n % streams:032x}"
+        request_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        route = rng.choices(names, weights)[0]
+        cold = rng.random() < 0.01
+        status = 500 if rng.random() < 0.005 else 200
+        fallback = route == 'POST /ask' and rng.random() < 0.02
+        timeout = route == 'GET /ask/status' and rng.random() < 0.01
+        truth['routes'][route] = truth['routes'].get(route, 0) + 1
+        truth['cold_starts'] += cold
+        truth['errors_5xx'] += status >= 500
+        truth['rag_fallback'] += fallback
+        truth['transcription_timeout'] += timeout
+        duration = rng.lognormvariate(4.5, 0.8)
+        ts += 5
+        lines = []
+        if cold:
+            lines.append('INIT_START Runtime Version: python:3.12.v101\tRuntime Version ARN: arn:aws:lambda:eu-central-1::runtime:0')
+        lines.append(f"START RequestId: {request_id} Version: $LATEST")
+        if fallback:
+            lines.append(json.dumps({'level': 'WARNING', 'msg': 'External-sources RAG failed, answering without retrieval',
+                                     'requestId': request_id, 'route': route,
+                                     'error': 'ClientError: An error occurred (ThrottlingException) when calling RetrieveAndGenerate'}))
+        if timeout:
+            lines.append(json.dumps({'level': 'ERROR', 'msg': 'Voice job failed', 'requestId': request_id, 'route': route,
+                                     'error': 'ReadTimeoutError: Read timeout on endpoint URL'}))
+        if status >= 500:
+            lines.append(json.dumps({'level': 'ERROR', 'msg': 'Unhandled error', 'requestId': request_id, 'route': route,
+                                     'error': 'KeyError: userId'}))
+        values = {'Latency': round(duration * 0.95, 1), 'LogBytes': 180}
+        if fallback:
+            values['RagFallback'] = 1
+        lines.append(json.dumps(dict({'_aws': {'Timestamp': ts, 'CloudWatchMetrics': [{'Namespace': 'TacMed', 'Dimensions': [['Route']],
+                                  'Metrics': [{'Name': k, 'Unit': 'Count'} for k in values]}]}},
+                                  status=status, requestId=request_id, Route=route, **values), separators=(',', ':')))
+        lines.append(f"END RequestId: {request_id}")
+        report = (f"REPORT RequestId: {request_id}\tDuration: {duration:.2f} ms\tBilled Duration: {int(duration) + 1} ms\t"
+                  f"Memory Size: 512 MB\tMax Memory Used: {rng.randint(90, 140)} MB\t")
+        lines.append(report + (f"Init Duration: {rng.uniform(300, 700):.2f} ms\t" if cold else ''))
+        open_requests[stream] = lines
+        # Interleave streams: emit the request's lines in two halves, the second one after another stream's
+        for line in lines[:2]:
+            yield line, stream, ts
+        for other, pending in list(open_requests.items()):
+            if other != stream:
+                for line in pending[2:]:
+                    yield line, other, ts
+                del open_requests[other]
+    for stream, pending in open_requests.items():
+        for line in pending[2:]:
+            yield line, stream, ts
+
+def check(summary, truth):
+    failures = []
+    for route, n in truth['routes'].items():
+        got = summary['routes'].get(route, {}).get('requests')
+        if got != n:
+            failures.append(f"{route}: {got} requests, generated {n}")
+    if 'unknown' in summary['routes']:
+        failures.append(f"{summary['routes']['unknown']['requests']} requests without a route")
+    cold = sum(r['cold_starts'] for r in summary['routes'].values())
+    errors = sum(r['errors_5xx'] for r in summary['routes'].values())
+    for name, got, want in (('cold starts', cold, truth['cold_starts']), ('5xx', errors, truth['errors_5xx']),
+                            ('rag_fallback', summary['markers'].get('rag_fallback', 0), truth['rag_fallback']),
+                            ('transcription_timeout', summary['markers'].get('transcription_timeout', 0), truth['transcription_timeout'])):
+        if got != want:
+            failures.append(f"{name}: {got}, generated {want}")
+    return failures
+
+class FakeLogsClient:
+    # filter_log_events over generated events, paged like CloudWatch (by count), with per-call latency
+    def __init__(self, events, latency, page=1000):
+        self.events = events
+        self.latency = latency
+        self.page = page
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def filter_log_events(self, logGroupName, startTime, endTime, nextToken=None, filterPattern=None):
+        with self.lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.latency)
+        offset = int(nextToken or 0)
+        matching = [e for e in self.events if startTime <= e['timestamp'] <= endTime]
+        with self.lock:
+            self.active -= 1
+        resp = {'events': matching[offset:offset + self.page]}
+        if offset + self.page < len(matching):
+            resp['nextToken'] = str(offset + self.page)
+        return resp
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark and check the log fetcher and analyzer')
+    parser.add_argument('--requests', type=int, default=200000, help='Generated invocations (about 4 lines each)')
+    parser.add_argument('--fetch-requests', type=int, default=20000)
+    parser.add_argument('--latency', type=float, default=0.05, help='Fake FilterLogEvents latency in seconds')
+    args = parser.parse_args()
+
+    # Memory: peak while analyzing 5% of the input vs 50% (tracemalloc makes a full run slow)
+    peaks = {}
+    shares = (0.05, 0.5)
+    for share in shares:
+        tracemalloc.start()
+        analyze_logs.analyze(generate(int(args.requests * share)))
+        peaks[share] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+
+    started = time.perf_counter()
+    for _ in generate(args.requests):
+        pass
+    generation = time.perf_counter() - started
+    truth = {}
+    started = time.perf_counter()
+    summary = analyze_logs.analyze(generate(args.requests, truth=truth)).summary()
+    analyze_logs.print_report(summary, time.perf_counter() - started - generation)
+    print(f"\ntracemalloc peak: " + ', '.join(f"{peaks[s]:,.0f} KB for {int(args.requests * s):,} requests" for s in shares))
+    failures = check(summary, truth)
+
+    events = [{'timestamp': ts, 'logStreamName': stream, 'message': message}
+              for message, stream, ts in generate(args.fetch_requests)]
+    start_ms, end_ms = events[0]['timestamp'], events[-1]['timestamp'] + 1
+    print(f"\n{'workers':>7} {'events':>8} {'calls':>6} {'in flight':>9} {'seconds':>8}")
+    for workers in (1, 4, 8):
+        client = FakeLogsClient(events, args.latency)
+        started = time.perf_counter()
+        fetched = list(get_logs.fetch_events('/aws/lambda/TacMed_Backend', start_ms, end_ms, workers=workers, client=client))
+        seconds = time.perf_counter() - started
+        print(f"{workers:>7} {len(fetched):>8} {client.calls:>6} {client.max_active:>9} {seconds:>8.2f}")
+        if sorted(map(json.dumps, fetched)) != sorted(map(json.dumps, events)):
+            failures.append(f"{workers} workers: fetched events differ from the source")
+        if client.max_active > workers:
+            failures.append(f"{workers} workers: {client.max_active} calls in flight")
+
+    if failures:
+        raise SystemExit('FAILED:\n  ' + '\n  '.join(failures))
+    print('\nAll counts match the generated logs.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Compares score ingestion through the Lambda handler:
+#   single  - one POST /score per correct answer (the quiz UI's current behaviour)
+#   batch   - one POST /score/batch per drill, events coalesced per user into one transaction
+# DynamoDB is an in-process fake that sleeps --latency ms per call, so the numbers reflect round trips.
+# A replay of every batch checks that retries are absorbed as duplicates.
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-central-1')
+os.environ.setdefault('KB_BUCKET', 'tacmed-kb-bench')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+import lambda_function
+
+class ConditionalCheckFailed(Exception):
+    pass
+
+class TransactionCanceled(Exception):
+    def __init__(self, reasons):
+        super().__init__('transaction canceled')
+        self.response = {'CancellationReasons': reasons}
+
+class FakeDB:
+    def __init__(self, latency):
+        self.latency = latency
+        self.tables = {}
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def round_trip(self):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency)
+
+class FakeClient:
+    class exceptions:
+        ConditionalCheckFailedException = ConditionalCheckFailed
+        TransactionCanceledException = TransactionCanceled
+
+    def __init__(self, db):
+        self.db = db
+
+    def transact_write_items(self, TransactItems):
+        self.db.round_trip()
+        plain = lambda attrs: {k: (int(v['N']) if 'N' in v else v['S']) for k, v in attrs.items()}
+        with self.db.lock:
+            reasons = []
+            for op in TransactItems:
+                if 'Put' in op:
+                    table = self.db.tables[op['Put']['TableName']]
+                    exists = table.key_of(plain(op['Put']['Item'])) in table.items
+                    reasons.append({'Code': 'ConditionalCheckFailed' if exists else 'None'})
+                else:
+                    reasons.append({'Code': 'None'})
+            if any(r['Code'] != 'None' for r in reasons):
+                raise TransactionCanceled(reasons)
+            for op in TransactItems:
+                if 'Put' in op:
+                    table = self.db.tables[op['Put']['TableName']]
+                    table.items[table.key_of(plain(op['Put']['Item']))] = plain(op['Put']['Item'])
+                else:
+                    update = op['Update']
+                    self.db.tables[update['TableName']].apply(
+                        plain(update['Key']), update['UpdateExpression'], {},
+                        plain(update['ExpressionAttributeValues']))
+
+class FakeTable:
+    def __init__(self, db, name, keys):
+        self.db = db
+        self.name = name
+        self.keys = keys
+        self.items = {}
+        self.meta = type('Meta', (), {'client': FakeClient(db)})()
+        db.tables[name] = self
+
+    def key_of(self, item):
+        return tuple(item[k] for k in self.keys)
+
+    def _check(self, item, condition, names, values):
+        if not condition:
+            return True
+        condition = re.sub(r'#\w+', lambda m: names[m.group(0)], condition)
+        if condition.startswith('attribute_exists('):
+            return item is not None and condition[17:-1] in item
+        if condition.startswith('attribute_not_exists(') and ' OR ' in condition:
+            attr = condition[21:condition.index(')')]
+            return item is None or attr not in item or item[attr] == values[':v']
+        if condition.startswith('attribute_not_exists('):
+            return item is None
+        attr, value = condition.split(' = ')
+        return item is not None and item.get(attr) == values[value]
+
+    def apply(self, key, expression, names, values):
+        item = self.items.setdefault(self.key_of(key), dict(key))
+        for action, body in re.findall(r'(ADD|SET) (.*?)(?= ADD | SET |$)', expression):
+            for clause in body.split(', ') if action == 'ADD' else re.split(r', (?![^(]*\))', body):
+                if action == 'ADD':
+                    name, value = clause.split(' ')
+                    name = names.get(name, name)
+                    item[name] = item.get(name, 0) + values[value]
+                else:
+                    name, value = clause.split(' = ')
+                    name = names.get(name, name)
+                    if value.startswith('if_not_exists('):
+                        item.setdefault(name, values[value.split(', ')[1][:-1]])
+                    else:
+                        item[name] = values[value]
+        return item
+
+    def get_item(self, Key, **kwargs):
+        self.db.round_trip()
+        with self.db.lock:
+            item = self.items.get(self.key_of(Key))
+            return {'Item': dict(item)} if item else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None):
+        self.db.round_trip()
+        with self.db.lock:
+            current = self.items.get(self.key_of(Item))
+            if not self._check(current, ConditionExpression, ExpressionAttributeNames or {}, ExpressionAttributeValues or {}):
+                raise ConditionalCheckFailed()
+            self.items[self.key_of(Item)] = dict(Item)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ExpressionAttributeNames=None,
+                    ConditionExpression=None, ReturnValues=None):
+        self.db.round_trip()
+        names = ExpressionAttributeNames or {}
+        with self.db.lock:
+            current = self.items.get(self.key_of(Key))
+            if not self._check(current, ConditionExpression, names, ExpressionAttributeValues):
+                raise ConditionalCheckFailed()
+            item = self.apply(Key, UpdateExpression, names, ExpressionAttributeValues)
+            return {'Attributes': dict(item)}
+
+class FakeDynamo:
+    def __init__(self, db):
+        self.users = FakeTable(db, lambda_function.USERS_TABLE, ['UserId'])
+        self.board = FakeTable(db, lambda_function.LEADERBOARD_TABLE, ['Board', 'Key'])
+
+    def Table(self, name):
+        return self.users
+
+def make_event(path, body):
+    return {
+        'rawPath': path,
+        'requestContext': {'http': {'method': 'POST'}},
+        'body': json.dumps(body)
+    }
+
+def run(name, users, answers, workers, db, make_requests):
+    requests = [req for user in users for req in make_requests(user, answers)]
+    calls_before = db.calls
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        responses = list(pool.map(lambda e: lambda_function.lambda_handler(e, None), requests))
+    elapsed = time.perf_counter() - started
+    assert all(r['statusCode'] == 200 for r in responses), [r for r in responses if r['statusCode'] != 200][:1]
+    events = len(users) * answers
+    print(f"{name:>8} {len(requests):>9} {db.calls - calls_before:>9} {(db.calls - calls_before) / events:>11.2f} "
+          f"{events / elapsed:>10.1f}")
+    return requests
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark POST /score vs POST /score/batch')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--answers', type=int, default=10, help='Correct answers per user (one drill)')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent requests')
+    parser.add_argument('--latency', type=float, default=5.0, help='Simulated DynamoDB round trip in ms')
+    args = parser.parse_args()
+
+    db = FakeDB(args.latency / 1000)
+    fake = FakeDynamo(db)
+    lambda_function.dynamodb = fake
+    lambda_function.leaderboard = lambda_function.Leaderboard(
+        fake.board, fake.users, size=100, shards=lambda_function.LEADERBOARD_SHARDS)
+    lambda_function.history = lambda_function.HistoryWriter(None)
+    lambda_function.logs.print = lambda *a, **k: None
+
+    single = lambda user, n: [make_event('/score', {'userId': user}) for _ in range(n)]
+    batch = lambda user, n: [make_event('/score/batch', {
+        'userId': user, 'events': [{'eventId': str(uuid.uuid4())} for _ in range(n)]})]
+
+    print(f"{'path':>8} {'requests':>9} {'db calls':>9} {'calls/event':>11} {'events/s':>10}")
+    run('single', [f"single-{i}" for i in range(args.users)], args.answers, args.workers, db, single)
+    batches = run('batch', [f"batch-{i}" for i in range(args.users)], args.answers, args.workers, db, batch)
+
+    # Replay every batch as a client retry would: nothing may be counted twice
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        replies = list(pool.map(lambda e: json.loads(lambda_function.lambda_handler(e, None)['body']), batches))
+    applied = sum(r['applied'] for reply in replies for r in reply['results'].values())
+    expected = args.answers * lambda_function.SCORE_INCREMENT
+    totals_ok = all(fake.users.items[(f"batch-{i}",)]['TotalScore'] == expected for i in range(args.users))
+    print(f"\nretry replay: {applied} events re-applied, totals correct: {totals_ok}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Overhead and output of the botocore tracing hooks (backend/tracing.py).
+# Real boto3 clients built with aws_clients' configs; a before-send hook answers every HTTP request
+# in-process (optionally after --latency ms, with --throttle of DynamoDB calls throttled), so the
+# numbers isolate what the hooks add to botocore's own per-call work:
+#   off       - TRACE_SAMPLE_RATE=0, no hooks registered
+#   unsampled - hooks registered, this invocation not sampled
+#   sampled   - every call traced into a span and the per-operation histograms
+# Then a traced mix of DynamoDB, S3 and Bedrock calls is exported and read back with summarize_file.
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-central-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+os.environ.setdefault('AWS_EC2_METADATA_DISABLED', 'true')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+import boto3
+from botocore.awsrequest import AWSResponse
+
+import aws_clients
+import logs
+import tracing
+
+S3_LIST = (b'<?xml version="1.0" encoding="UTF-8"?><ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+           b'<Contents><Key>guide.pdf</Key><Size>1024</Size></Contents></ListBucketResult>')
+THROTTLED = json.dumps({'__type': 'com.amazonaws.dynamodb.v20120810#ThrottlingException',
+                        'message': 'Rate of requests exceeds the allowed throughput.'}).encode()
+
+class Raw:
+    def __init__(self, data):
+        self.data = data
+
+    def stream(self, **kwargs):
+        yield self.data
+
+def make_session(latency, throttle):
+    session = boto3.session.Session()
+
+    def respond(request, **kwargs):
+        if latency:
+            time.sleep(latency)
+        if 'dynamodb' in request.url and random.random() < throttle:
+            body, status = THROTTLED, 400
+        elif '.s3.' in request.url or '//s3.' in request.url:
+            body, status = S3_LIST, 200
+        elif 'bedrock' in request.url:
+            body, status = json.dumps({'generation': 'Apply direct pressure.'}).encode(), 200
+        else:
+            body, status = b'{"Item": {"UserId": {"S": "medic"}, "TotalScore": {"N": "300"}}}', 200
+        return AWSResponse(request.url, status, {'content-length': str(len(body))}, Raw(body))
+
+    session.events.register('before-send', respond)
+    return session
+
+def traced_client(mode):
+    session = make_session(0, 0)
+    tracer = tracing.Tracer(sample_rate=0 if mode == 'off' else 1.0)
+    tracer.install(session)
+    tracer.start_request()
+    tracer.sampled = mode == 'sampled'
+    return tracer, session.client('dynamodb', config=aws_clients.API_CONFIG)
+
+def per_call_us(tracer, dynamodb, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        dynamodb.get_item(TableName='TacMed_Users', Key={'UserId': {'S': 'medic'}})
+        tracer._request_spans.clear()
+    return (time.perf_counter() - started) / calls * 1e6
+
+def hook_us(sampled, calls=100000):
+    # The tracer's own work per call, without botocore around it
+    tracer = tracing.Tracer(sample_rate=1.0)
+    tracer.start_request()
+    tracer.sampled = sampled
+    response = AWSResponse('https://dynamodb', 200, {'content-length': '64'}, Raw(b''))
+    parsed = {'ResponseMetadata': {'RetryAttempts': 0}}
+    started = time.perf_counter()
+    for _ in range(calls):
+        context = {}
+        tracer._before_call(model=None, params={'body': b'{}'}, context=context)
+        tracer._after_call(http_response=response, parsed=parsed, model=None, context=context,
+                           event_name='after-call.dynamodb.GetItem')
+        tracer._request_spans.clear()
+    return (time.perf_counter() - started) / calls * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark and exercise the botocore tracing hooks')
+    parser.add_argument('--calls', type=int, default=500, help='Calls per overhead measurement round')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=40, help='Traced invocations in the mixed run')
+    parser.add_argument('--latency', type=float, default=2.0, help='Simulated round trip in ms (mixed run)')
+    parser.add_argument('--throttle', type=float, default=0.02, help='Fraction of DynamoDB calls throttled (mixed run)')
+    args = parser.parse_args()
+    logs.print = lambda *a, **k: None
+
+    print(f"{'mode':>10} {'us/call':>9} {'overhead':>9}")
+    modes = ('off', 'unsampled', 'sampled')
+    clients = {mode: traced_client(mode) for mode in modes}
+    best = {}
+    # Interleaved rounds, best of each: botocore's own per-call cost drifts more than the hooks cost
+    for _ in range(args.rounds):
+        for mode in modes:
+            us = per_call_us(*clients[mode], args.calls)
+            best[mode] = min(best.get(mode, us), us)
+    for mode in modes:
+        print(f"{mode:>10} {best[mode]:>9.1f} {(best[mode] - best['off']) / best['off'] * 100:>8.1f}%")
+    print(f"hooks alone: {hook_us(False):.2f} us/call unsampled, {hook_us(True):.2f} us/call sampled")
+
+    # Mixed run: what one /ask-like invocation looks like in the spans and histograms
+    session = make_session(args.latency / 1000, args.throttle)
+    trace_file = os.path.join(tempfile.mkdtemp(), 'trace.jsonl')
+    tracer = tracing.Tracer(sample_rate=1.0, trace_file=trace_file)
+    tracer.install(session)
+    dynamodb = session.client('dynamodb', config=aws_clients.API_CONFIG)
+    s3 = session.client('s3', config=aws_clients.API_CONFIG)
+    bedrock = session.client('bedrock-runtime', config=aws_clients.MODEL_CONFIG)
+    for i in range(args.requests):
+        tracer.start_request()
+        s3.list_objects_v2(Bucket='tacmed-kb-bench')
+        dynamodb.get_item(TableName='TacMed_AnswerCache', Key={'QuestionKey': {'S': f"q{i}"}})
+        bedrock.invoke_model(modelId='eu.meta.llama3-2-3b-instruct-v1:0', body=json.dumps({'prompt': 'bleeding'}))
+        dynamodb.put_item(TableName='TacMed_AnswerCache', Item={'QuestionKey': {'S': f"q{i}"}})
+        tracer.end_request()
+
+    print(f"\nexported {sum(1 for _ in open(trace_file))} spans to {trace_file}")
+    tracing.main([trace_file])
+    assert tracing.summarize_file([trace_file]) == tracer.summary()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+# Compares the memory and latency of one voice query, summed over the Lambda calls it takes:
+#   inline  - base64 audio inside the JSON body of /ask (legacy clients)
+#   key     - /ask/upload for presigned URLs (plus /ask/upload/complete for multipart sizes), then
+#             /ask with the object key
+# The key path leaves out the client's PUT of the recording: it goes straight to S3 and never
+# touches the Lambda, so its time depends on the client's uplink, not on this code.
+# S3, Transcribe and DynamoDB are replaced with in-process fakes and the EMF log lines are
+# silenced, so only the Lambda's own work is measured and stdout is just the table.
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-central-1')
+os.environ.setdefault('KB_BUCKET', 'tacmed-kb-bench')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+import lambda_function
+
+class FakeS3:
+    def put_object(self, **kwargs):
+        # Touch the payload like a real upload would
+        return {'ETag': str(len(kwargs['Body']))}
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        # Local signing, no round trip
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?X-Amz-Signature=bench"
+
+    def create_multipart_upload(self, **kwargs):
+        return {'UploadId': 'bench'}
+
+    def complete_multipart_upload(self, **kwargs):
+        return {}
+
+class FakeTranscribe:
+    def start_transcription_job(self, **kwargs):
+        return {}
+
+class FakeTable:
+    def put_item(self, Item):
+        return {}
+
+class FakeDynamo:
+    def Table(self, name):
+        return FakeTable()
+
+def make_event(path, body):
+    return {
+        'rawPath': path,
+        'requestContext': {'http': {'method': 'POST'}},
+        'body': json.dumps(body)
+    }
+
+def call(event, status):
+    resp = lambda_function.lambda_handler(event, None)
+    assert resp['statusCode'] == status, resp
+    return json.loads(resp['body'])
+
+def inline_query(event):
+    call(event, 202)
+
+def key_query(size):
+    upload = call(make_event('/ask/upload', {'format': 'webm', 'size': size}), 200)
+    # The client PUTs the recording (or its parts) to the presigned URLs here; not timed
+    if 'uploadId' in upload:
+        parts = [{'PartNumber': n, 'ETag': f'"part{n}"'} for n in range(1, len(upload['partUrls']) + 1)]
+        call(make_event('/ask/upload/complete', {'audioKey': upload['audioKey'], 'uploadId': upload['uploadId'],
+                                                 'parts': parts}), 200)
+    call(make_event('/ask', {'audioKey': upload['audioKey'], 'question': 'Audio Query'}), 202)
+
+def measure(query, rounds):
+    durations = []
+    peaks = []
+    for _ in range(rounds):
+        tracemalloc.start()
+        started = time.perf_counter()
+        query()
+        durations.append((time.perf_counter() - started) * 1000)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    durations.sort()
+    return durations[len(durations) // 2], max(peaks)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark inline base64 audio vs presigned S3 upload per voice query')
+    parser.add_argument('--sizes', default='0.25,1,4', help='Recording sizes in MB')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    lambda_function.s3 = FakeS3()
+    lambda_function.transcribe = FakeTranscribe()
+    lambda_function.dynamodb = FakeDynamo()
+    lambda_function.logs.print = lambda *a, **k: None
+
+    print(f"{'size MB':>8} {'path':>7} {'p50 ms':>8} {'peak MB':>8}")
+    for size_mb in [float(s) for s in args.sizes.split(',')]:
+        size = int(size_mb * 1024 * 1024)
+        audio = os.urandom(size)
+        inline_event = make_event('/ask', {'audio': base64.b64encode(audio).decode(), 'question': 'Audio Query'})
+        del audio
+
+        for name, query in [('inline', lambda: inline_query(inline_event)), ('key', lambda: key_query(size))]:
+            p50, peak = measure(query, args.rounds)
+            print(f"{size_mb:>8.2f} {name:>7} {p50:>8.2f} {peak / 1024 / 1024:>8.2f}")
+
+if __name__ == '__main__':
+    main()
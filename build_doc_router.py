@@ -0,0 +1,57 @@
+import argparse
+import os
+import re
+import time
+
+import extract_kb
+from doc_router import write_router
+from kb_columns import ChunkColumns
+
+# Builds the document router (backend/doc_router.py) that /ask uses to pick which PDFs go to
+# EXTERNAL_SOURCES. Input is the extract_kb.py columns file; it is extracted first if missing.
+#   python build_doc_router.py                  # .kb_ingest/chunks.col -> backend/kb_index/router.json
+#   python build_doc_router.py --chunks other.col --out /tmp/router.json
+# One routing section per heading path in each document, plus a pseudo-section per document made
+# of its file name and top-level headings, so "CBRN" or "TACEVAC" find the handbook by name.
+
+def router_sections(columns):
+    sections = {}
+    for row in range(len(columns)):
+        doc = columns.columns['doc'][row]
+        path = columns.sections[columns.columns['section'][row]]
+        key = (doc, path)
+        if key not in sections:
+            sections[key] = {'doc': doc, 'heading': path.rsplit(' > ', 1)[-1], 'text': []}
+        sections[key]['text'].append(columns.text(row))
+    result = [dict(s, text=' '.join(s['text'])) for s in sections.values()]
+
+    for doc_idx, doc in enumerate(columns.docs):
+        top = {path.split(' > ', 1)[0] for (doc, path) in sections if doc == doc_idx and path}
+        result.append({'doc': doc_idx, 'heading': re.sub(r'[_\-()\d]+', ' ', doc['title']).strip(),
+                       'text': ' '.join(sorted(top))})
+    return result
+
+def build(chunks_path, out):
+    with ChunkColumns(chunks_path) as columns:
+        docs = [{'key': d['key'], 'title': d['title'], 'pages': d['pages']} for d in columns.docs]
+        sections = router_sections(columns)
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    return write_router(out, docs, sections)
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the per-document routing index from kb/')
+    parser.add_argument('--chunks', default=extract_kb.OUT, help='extract_kb.py columns file')
+    parser.add_argument('--kb-dir', default=os.path.join(extract_kb.ROOT, 'kb'), help='PDFs, if the chunks need extracting')
+    parser.add_argument('--out', default=os.path.join(extract_kb.ROOT, 'backend', 'kb_index', 'router.json'))
+    args = parser.parse_args()
+
+    started = time.time()
+    if not os.path.exists(args.chunks):
+        print(f"{args.chunks} not found, extracting {args.kb_dir}")
+        extract_kb.print_report(extract_kb.extract_corpus(args.kb_dir, args.chunks))
+    stats = build(args.chunks, args.out)
+    print(f"Router written to {args.out}: {stats['docs']} docs, {stats['sections']} sections, {stats['terms']} terms, "
+          f"{stats['postings']} postings, {stats['bytes'] / 1024:.0f} KB in {time.time() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+
+import argparse
+import json
+import os
+import time
+
+import extract_kb
+from kb_columns import ChunkColumns
+from kb_retrieval import write_index
+
+# Build-time ingestion: the local retrieval index that is zipped together with the Lambda
+# (backend/kb_index/), from the normalized section-aware chunks of extract_kb.py.
+# Run: python extract_kb.py && python build_kb_index.py --chunks .kb_ingest/chunks.col [--embed]
+# Without --chunks, kb/ is extracted first (pip install pypdf).
+
+EMBED_MODEL_ID = 'amazon.titan-embed-text-v2:0'
+
+def embed_chunks(chunks, region):
+    import boto3
+    client = boto3.client('bedrock-runtime', region_name=region)
+    vectors = []
+    for i, chunk in enumerate(chunks):
+        resp = client.invoke_model(
+            modelId=EMBED_MODEL_ID,
+            body=json.dumps({'inputText': chunk['text'][:8000], 'normalize': True})
+        )
+        vectors.append(json.loads(resp['body'].read())['embedding'])
+        if (i + 1) % 100 == 0:
+            print(f"Embedded {i + 1}/{len(chunks)} chunks")
+    return vectors
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the local KB retrieval index from kb/ PDFs')
+    parser.add_argument('--kb-dir', default='kb', help='PDFs, if there is no --chunks file')
+    parser.add_argument('--out', default=os.path.join('backend', 'kb_index'))
+    parser.add_argument('--embed', action='store_true', help='Precompute Titan embeddings (needs numpy and Bedrock access)')
+    parser.add_argument('--region', default='eu-central-1')
+    parser.add_argument('--chunks', help='extract_kb.py columns file (default: extract kb/ first)')
+    args = parser.parse_args()
+
+    started = time.time()
+    if not args.chunks:
+        args.chunks = extract_kb.OUT
+        extract_kb.print_report(extract_kb.extract_corpus(args.kb_dir, args.chunks))
+    with ChunkColumns(args.chunks) as columns:
+        docs = columns.docs
+        chunks = [{'doc': columns.columns['doc'][i], 'page': columns.columns['page'][i], 'text': columns.text(i)}
+                  for i in range(len(columns))]
+    print(f"{args.chunks}: {len(docs)} docs, {len(chunks)} chunks")
+
+    embeddings = embed_chunks(chunks, args.region) if args.embed else None
+    meta = write_index(args.out, docs, chunks, embeddings)
+    print(f"Index written to {args.out}: {len(docs)} docs, {meta['n_chunks']} chunks, "
+          f"{len(meta['vocab'])} terms in {time.time() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
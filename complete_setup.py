@@ -6,6 +6,8 @@ import requests
 from botocore.auth import SigV4Auth
 from botocore.awsrequest import AWSRequest
 
+import ingest_kb
+
 region = 'eu-central-1'
 collection_name = 'tacmed-rag-v3' # New name just in case
 index_name = 'bedrock-knowledge-base-default-index'
@@ -164,28 +166,11 @@ def setup_kb(col_arn):
         kb_id = [k['knowledgeBaseId'] for k in kbs if k['name'] == kb_name][0]
         print(f"Using existing KB: {kb_id}")
 
-    # 2. Data Source
-    print("Creating Data Source...")
-    try:
-        resp = bedrock.create_data_source(
-            knowledgeBaseId=kb_id,
-            name="TacMed_S3_Source",
-            dataSourceConfiguration={
-                "type": "S3",
-                "s3Configuration": {"bucketArn": f"arn:aws:s3:::{s3_bucket}"}
-            }
-        )
-        ds_id = resp['dataSource']['dataSourceId']
-        print(f"Data Source created: {ds_id}")
-    except bedrock.exceptions.ConflictException:
-        dss = bedrock.list_data_sources(knowledgeBaseId=kb_id)['dataSourceSummaries']
-        ds_id = [d['dataSourceId'] for d in dss if d['name'] == "TacMed_S3_Source"][0]
-        print(f"Using existing Data Source: {ds_id}")
-
-    # 3. Start Sync
-    print("Starting Ingestion Job...")
-    resp = bedrock.start_ingestion_job(knowledgeBaseId=kb_id, dataSourceId=ds_id)
-    print(f"Ingestion Job started: {resp['ingestionJob']['ingestionJobId']}")
+    # 2. Data source + sync: one S3 object per chunk, uploaded and ingested only when it changed
+    print("Syncing knowledge base chunks (ingest_kb.py)...")
+    sync = ingest_kb.KBSync(boto3.client('s3', region_name=region), bedrock, s3_bucket, kb_id)
+    print(f"Data Source: {sync.ensure_data_source()}")
+    ingest_kb.print_report(ingest_kb.ingest('kb', index_out=None, sync=sync))
     return kb_id
 
 if __name__ == "__main__":
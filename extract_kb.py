@@ -0,0 +1,394 @@
+
+import argparse
+import logging
+import os
+import re
+import sys
+import time
+import unicodedata
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+from kb_columns import write_columns
+
+# Extraction stage for kb/: PDFs -> normalized, section-aware chunks in one columnar file
+# (backend/kb_columns.py) that later stages memory-map instead of parsing the PDFs again.
+#   python extract_kb.py                        # kb/ -> .kb_ingest/chunks.col
+#   python extract_kb.py --workers 8 --pages-per-task 2
+# Documents are split into page ranges of --pages-per-task pages and the ranges go to a process
+# pool, so one long handbook does not keep a single core busy while the others sit idle. When the
+# last range of a document is in, the document is normalized and chunked as another pool task
+# (header and footer detection needs all of its pages).
+# Normalization, per document:
+#   - NFKC (ﬁ ligatures, full-width digits), private-use bullet glyphs -> "•", soft hyphens dropped
+#   - words mixing Latin and Cyrillic look-alikes (TССС, пoранений) written in one script
+#   - running headers and footers: lines at the top or bottom of a page that repeat, digits aside,
+#     on at least 30% of the pages ("17tccc.org.ua"), and bare page numbers
+#   - long lines repeated within a document (clinical-guidelines-2024-en-ua.pdf has most of its
+#     text layer on every page)
+#   - hyphenation across line ends is joined ("evac-\nuation"), unless the hyphenated form occurs
+#     elsewhere in the document and the joined one does not (медико-\nсанітарний stays hyphenated);
+#     "запалювально -димові" loses the stray space
+#   - tables come out of pypdf as runs of short cell lines; such runs are kept as rows of cells
+#     joined by " | " instead of being read as headings
+# Headings (numbered 1. / 1.1.5., ALL-CAPS lines, Розділ/Додаток/Chapter/Annex, and short title
+# lines between sentences) start a new section; chunks never cross a section boundary and carry the
+# heading path, the start and end page and the document.
+# Within a section, chunk boundaries are content-defined: a chunk ends after a word whose CRC32 hits
+# 1 in (CHUNK_WORDS - CHUNK_MIN_WORDS) once it has CHUNK_MIN_WORDS words (at CHUNK_MAX_WORDS at the
+# latest), and the next one starts with its last CHUNK_OVERLAP words. Boundaries depend only on the
+# words around them, so editing a page changes the chunks on that page and not every later one,
+# which is what lets ingest_kb.py re-embed only what changed. This is the one chunker: the local
+# index (build_kb_index.py), the router (build_doc_router.py) and ingest_kb.py all use its chunks.
+
+OUT = os.path.join(ROOT, '.kb_ingest', 'chunks.col')
+PAGES_PER_TASK = 4
+CHUNK_WORDS = 220
+CHUNK_MIN_WORDS = 120
+CHUNK_MAX_WORDS = 400
+CHUNK_OVERLAP = 40
+MIN_SECTION_WORDS = 40
+MAX_HEADING_WORDS = 12
+EDGE_LINES = 2
+EDGE_SHARE = 0.3
+TABLE_RUN = 4
+DUPLICATE_WORDS = 6
+
+BULLET_RE = re.compile(r'^[\uf000-\uf0ff\u25aa\u25cf\u25e6\u25a0\u00b7]\s*')
+PRIVATE_USE_RE = re.compile(r'[\ue000-\uf8ff]')
+LOOKALIKES = ('aceiopxyABCEHIKMOPTX', 'асеіорхуАВСЕНІКМОРТХ')
+TO_CYRILLIC = str.maketrans(*LOOKALIKES)
+TO_LATIN = str.maketrans(LOOKALIKES[1], LOOKALIKES[0])
+CYRILLIC_RE = re.compile(r'[\u0400-\u04ff]')
+LATIN_RE = re.compile(r'[A-Za-z]')
+MIXED_RE = re.compile(r'\w*(?:[A-Za-z][\u0400-\u04ff]|[\u0400-\u04ff][A-Za-z])\w*')
+WORD_RE = re.compile(r"[\w’'-]+")
+PAGE_NO_RE = re.compile(r'^(?:[-–—\s]*\d+[-–—\s]*|(?:стор(?:інка)?\.?|с\.|page|p\.)\s*\d+(?:\s*(?:з|of|/)\s*\d+)?)$', re.I)
+SPACED_HYPHEN_RE = re.compile(r'(\w) -(\w)')
+NUMBERED_RE = re.compile(r'^(\d{1,2}(?:\.\d{1,2})+\.?|\d{1,2}\.)\s+(\S.*)$')
+KEYWORD_RE = re.compile(r'^(?:розділ|глава|частина|додаток|тема|chapter|section|part|annex|appendix)\b', re.I)
+SENTENCE_END = '.!?:;'
+
+_reader = (None, None)
+
+class PdfSource:
+    # Page counts and page-range text from pypdf. Pickled into every task, so it holds no state: the
+    # open reader is kept per process, and consecutive ranges of a document reuse it
+    def _open(self, path):
+        global _reader
+        # pypdf warns about every font it cannot fully decode; the text is still usable
+        logging.getLogger('pypdf').setLevel(logging.ERROR)
+        if _reader[0] != path:
+            from pypdf import PdfReader
+            _reader = (path, PdfReader(path))
+        return _reader[1]
+
+    def count(self, path):
+        return len(self._open(path).pages)
+
+    def pages(self, path, start, end):
+        reader = self._open(path)
+        texts = []
+        for page_no in range(start, end):
+            try:
+                texts.append(reader.pages[page_no].extract_text() or '')
+            except Exception as e:
+                print(f"Extract error in {path} p.{page_no + 1}: {e}")
+                texts.append('')
+        return texts
+
+def extract_pages(path):
+    # Every page of one PDF in this process (ingest_kb.py hands out whole documents)
+    source = PdfSource()
+    return source.pages(path, 0, source.count(path))
+
+def read_range(source, path, start, end):
+    # Runs in a worker process; CPU time rather than wall time, so the per-core rate is honest
+    started = time.process_time()
+    return source.pages(path, start, end), time.process_time() - started
+
+def _fix_script(match):
+    word = match.group(0)
+    cyrillic = len(CYRILLIC_RE.findall(word))
+    return word.translate(TO_CYRILLIC if cyrillic >= len(LATIN_RE.findall(word)) else TO_LATIN)
+
+def clean_line(line):
+    line = ' '.join(unicodedata.normalize('NFKC', line).replace('\u00ad', '').split())
+    line = PRIVATE_USE_RE.sub('', BULLET_RE.sub('\u2022 ', line)).strip()
+    line = SPACED_HYPHEN_RE.sub(r'\1-\2', line)
+    return MIXED_RE.sub(_fix_script, line)
+
+def _edge_key(line):
+    return re.sub(r'\d+', '#', line.lower())
+
+def strip_edges(pages, stats):
+    # pages: [[line, ...]]; drops running headers/footers and page numbers from the page edges
+    counts = {}
+    for lines in pages:
+        for key in {_edge_key(line) for line in lines[:EDGE_LINES] + lines[-EDGE_LINES:]}:
+            counts[key] = counts.get(key, 0) + 1
+    threshold = max(3, EDGE_SHARE * len(pages))
+    repeated = {key for key, n in counts.items() if n >= threshold}
+    result = []
+    for lines in pages:
+        edges = set(range(min(EDGE_LINES, len(lines)))) | set(range(max(len(lines) - EDGE_LINES, 0), len(lines)))
+        kept = [line for i, line in enumerate(lines)
+                if i not in edges or (_edge_key(line) not in repeated and not PAGE_NO_RE.match(line))]
+        stats['edge_lines'] += len(lines) - len(kept)
+        result.append(kept)
+    return result
+
+def drop_repeats(pages, stats):
+    # Some PDFs carry (nearly) the whole document's text layer on every page; long lines already
+    # seen earlier in the document are dropped, so each passage is chunked once, on its first page
+    # (on a page that is mostly such a repeat, the short wrapped-line tails seen before go as well)
+    seen = set()
+    result = []
+    for lines in pages:
+        long_lines = [line for line in lines if line.count(' ') >= DUPLICATE_WORDS - 1]
+        repeat_page = long_lines and sum(line in seen for line in long_lines) >= 0.5 * len(long_lines)
+        kept = [line for line in lines
+                if line not in seen or not (repeat_page or line.count(' ') >= DUPLICATE_WORDS - 1)]
+        seen.update(lines)
+        stats['repeated_lines'] += len(lines) - len(kept)
+        result.append(kept)
+    return result
+
+def dehyphenate(lines, vocab, stats):
+    # Joins "слово-" + "продовження" across line ends
+    result = []
+    for line in lines:
+        if result and result[-1][-2:-1].isalpha() and result[-1].endswith('-') and line[:1].islower():
+            head = result[-1].rsplit(' ', 1)[-1][:-1]
+            tail = line.split(' ', 1)[0]
+            joined = head + tail
+            keep = f"{head}-{tail}".lower() in vocab and joined.lower() not in vocab
+            result[-1] = result[-1][:-1] + ('-' if keep else '') + line
+            stats['hyphens_kept' if keep else 'hyphens_joined'] += 1
+        else:
+            result.append(line)
+    return result
+
+def _is_cell(line):
+    words = line.split()
+    return 0 < len(words) <= 5 and line[-1] not in '.!?;' and not line.startswith(('•', '-', '–'))
+
+def _heading(line, prev, nxt):
+    # Heading level (0 = top) or None
+    words = line.split()
+    if not words or len(words) > MAX_HEADING_WORDS or line.startswith(('•', '-', '–', '*')):
+        return None
+    continues = bool(nxt) and nxt[:1].islower() and not re.match(r'^\w\)', nxt)
+    numbered = NUMBERED_RE.match(line)
+    if numbered:
+        depth = numbered.group(1).rstrip('.').count('.') + 1
+        title = numbered.group(2)
+        if not title[:1].isupper() or (depth == 1 and (len(words) > 8 or continues)):
+            return None
+        return depth
+    if KEYWORD_RE.match(line):
+        return 0
+    letters = [ch for ch in line if ch.isalpha()]
+    if (len(letters) >= 6 and sum(ch.isupper() for ch in letters) >= 0.9 * len(letters)
+            and line[0].isalnum() and line[-1] not in ',;.)'):
+        return 0
+    if (len(words) <= 6 and len(line) <= 60 and line[0].isupper() and ',' not in line and line[-1] not in SENTENCE_END + '-–'
+            and (not prev or prev[-1] in '.!?:') and (not nxt or nxt[:1].isupper())):
+        return 9
+    return None
+
+def blocks(lines, stats):
+    # [(kind, level, text)] with kind 'heading', 'table' or 'text'
+    cells = [_is_cell(line) for line in lines]
+    table = [False] * len(lines)
+    start = 0
+    while start < len(lines):
+        end = start
+        while end < len(lines) and cells[end]:
+            end += 1
+        if end - start >= TABLE_RUN and sum(any(ch.isdigit() for ch in lines[i]) for i in range(start, end)) >= 2:
+            table[start:end] = [True] * (end - start)
+        start = end + 1
+
+    result = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if table[i]:
+            row = []
+            while i < len(lines) and table[i]:
+                row.append(lines[i])
+                i += 1
+            result.append(('table', None, ' | '.join(row)))
+            stats['table_lines'] += len(row)
+            continue
+        level = _heading(line, lines[i - 1] if i else '', lines[i + 1] if i + 1 < len(lines) else '')
+        if level is not None:
+            # Headings wrapped over two lines: "1.1.5. Вражаюча дія ... потенційно" + "небезпечних об’єктів."
+            # and consecutive ALL-CAPS lines
+            while i + 1 < len(lines) and not table[i + 1] and len(lines[i + 1].split()) <= 8 and (
+                    (level and line[-1] not in SENTENCE_END and lines[i + 1][:1].islower())
+                    or (level == 0 and _heading(lines[i + 1], line, '') == 0 and not NUMBERED_RE.match(lines[i + 1]))):
+                i += 1
+                line = f"{line} {lines[i]}"
+            result.append(('heading', level, line))
+            stats['headings'] += 1
+        else:
+            result.append(('text', None, line))
+        i += 1
+    return result
+
+def normalize_document(pages, stats=None):
+    # Raw page texts -> [[(kind, level, text)] per page]
+    stats = stats if stats is not None else new_stats()
+    pages = [[clean_line(line) for line in text.split('\n')] for text in pages]
+    pages = drop_repeats(strip_edges([[line for line in lines if line] for lines in pages], stats), stats)
+    vocab = {w.lower() for lines in pages for line in lines for w in WORD_RE.findall(line)}
+    return [blocks(dehyphenate(lines, vocab, stats), stats) for lines in pages]
+
+def new_stats():
+    return {'edge_lines': 0, 'repeated_lines': 0, 'hyphens_joined': 0, 'hyphens_kept': 0, 'table_lines': 0, 'headings': 0}
+
+def chunking_params():
+    return {'words': CHUNK_WORDS, 'min': CHUNK_MIN_WORDS, 'max': CHUNK_MAX_WORDS, 'overlap': CHUNK_OVERLAP,
+            'section_min': MIN_SECTION_WORDS}
+
+def chunk_sections(doc_idx, pages, target=CHUNK_WORDS, min_words=CHUNK_MIN_WORDS, max_words=CHUNK_MAX_WORDS,
+                   overlap=CHUNK_OVERLAP):
+    # Content-defined word windows that restart at every heading;
+    # [{'doc', 'page', 'page_end', 'section', 'text'}]
+    divisor = max(target - min_words, 1)
+    chunks = []
+    path = []
+    words = []
+    fresh = 0
+
+    def emit(window):
+        chunks.append({'doc': doc_idx, 'page': window[0][1], 'page_end': window[-1][1],
+                       'section': ' > '.join(title for _, title in path),
+                       'text': ' '.join(w for w, _ in window)})
+
+    def flush(final=False):
+        # A section too short to stand alone (a heading and a line or two) is carried into the next
+        nonlocal words, fresh
+        if fresh and (final or fresh >= MIN_SECTION_WORDS):
+            emit(words)
+            words, fresh = [], 0
+        else:
+            words = words[len(words) - fresh:]
+
+    for page_no, page in enumerate(pages, start=1):
+        for kind, level, text in page:
+            if kind == 'heading':
+                flush()
+                while path and path[-1][0] >= level:
+                    path.pop()
+                path.append((level, text[:200]))
+            for word in text.split():
+                words.append((word, page_no))
+                fresh += 1
+                size = len(words)
+                if size >= max_words or (size >= min_words and zlib.crc32(word.encode('utf-8')) % divisor == 0):
+                    emit(words)
+                    words = words[-overlap:] if overlap else []
+                    fresh = 0
+    flush(final=True)
+    return chunks
+
+def chunk_document(doc_idx, pages, stats=None):
+    # Raw page texts -> chunks: the normalization and chunking every build shares
+    return chunk_sections(doc_idx, normalize_document(pages, stats))
+
+def process_document(doc_idx, pages):
+    # Runs in a worker process
+    started = time.process_time()
+    stats = new_stats()
+    chunks = chunk_document(doc_idx, pages, stats)
+    return chunks, stats, time.process_time() - started
+
+def extract_corpus(kb_dir, out=OUT, workers=None, pages_per_task=PAGES_PER_TASK, source=None):
+    started = time.perf_counter()
+    source = source or PdfSource()
+    names = sorted(n for n in os.listdir(kb_dir) if n.lower().endswith('.pdf'))
+    counts = {name: source.count(os.path.join(kb_dir, name)) for name in names}
+    tasks = [(name, start, min(start + pages_per_task, counts[name]))
+             for name in names for start in range(0, counts[name], pages_per_task)]
+    workers = workers or os.cpu_count() or 1
+
+    parts = {name: {} for name in names}
+    remaining = {name: sum(1 for t in tasks if t[0] == name) for name in names}
+    results = {}
+    read_cpu = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunking = {}
+
+        def chunk_when_complete(name):
+            if remaining[name] == 0:
+                pages = [text for start in sorted(parts[name]) for text in parts[name][start]]
+                del parts[name]
+                chunking[pool.submit(process_document, names.index(name), pages)] = name
+
+        for name in names:
+            chunk_when_complete(name)
+        reading = {pool.submit(read_range, source, os.path.join(kb_dir, name), start, end): (name, start)
+                   for name, start, end in tasks}
+        for future in as_completed(reading):
+            name, start = reading[future]
+            parts[name][start], seconds = future.result()
+            read_cpu.append(seconds)
+            remaining[name] -= 1
+            chunk_when_complete(name)
+        for future in as_completed(chunking):
+            results[chunking[future]] = future.result()
+    wall = time.perf_counter() - started
+
+    chunks = [chunk for name in names for chunk in results[name][0]]
+    docs = [{'key': name, 'title': os.path.splitext(name)[0], 'pages': counts[name]} for name in names]
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    written = write_columns(out, docs, chunks)
+    stats = new_stats()
+    for _, doc_stats, _ in results.values():
+        for key, value in doc_stats.items():
+            stats[key] += value
+    pages = sum(counts.values())
+    cpu = sum(read_cpu) + sum(r[2] for r in results.values())
+    return {
+        'docs': len(names), 'pages': pages, 'tasks': len(tasks), 'workers': workers,
+        'chunks': len(chunks), 'sections': written['sections'],
+        'read_cpu_s': round(sum(read_cpu), 2), 'longest_task_s': round(max(read_cpu, default=0), 2),
+        'normalize_cpu_s': round(sum(r[2] for r in results.values()), 2),
+        'wall_s': round(wall, 2),
+        'pages_per_s': round(pages / wall, 1) if wall else 0.0,
+        'pages_per_core_s': round(pages / cpu, 1) if cpu else 0.0,
+        'task_cpu_s': read_cpu,
+        'normalize': stats,
+        'file': {'path': out, 'bytes': written['file_bytes'], 'text_bytes': written['text_bytes']},
+        'seconds': round(time.perf_counter() - started, 2)
+    }
+
+def print_report(report):
+    n, f = report['normalize'], report['file']
+    print(f"Extracted {report['pages']} pages from {report['docs']} documents in {report['tasks']} page-range tasks "
+          f"on {report['workers']} process(es): {report['wall_s']}s, {report['pages_per_s']} pages/s, "
+          f"{report['pages_per_core_s']} pages/s per core")
+    print(f"  CPU: {report['read_cpu_s']}s PDF text (longest task {report['longest_task_s']}s), "
+          f"{report['normalize_cpu_s']}s normalizing and chunking")
+    print(f"  Normalized: {n['edge_lines']} header/footer and {n['repeated_lines']} repeated lines dropped, "
+          f"{n['hyphens_joined']} hyphenations joined "
+          f"({n['hyphens_kept']} kept), {n['table_lines']} table cell lines, {n['headings']} headings")
+    print(f"  {report['chunks']} chunks in {report['sections']} sections -> {f['path']}: "
+          f"{f['bytes'] / 1024:.0f} KB ({f['text_bytes'] / 1024:.0f} KB of text)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract kb/ PDFs into a columnar file of section-aware chunks')
+    parser.add_argument('--kb-dir', default=os.path.join(ROOT, 'kb'))
+    parser.add_argument('--out', default=OUT)
+    parser.add_argument('--workers', type=int, help='Processes (default: CPU count)')
+    parser.add_argument('--pages-per-task', type=int, default=PAGES_PER_TASK)
+    args = parser.parse_args()
+    print_report(extract_corpus(args.kb_dir, args.out, args.workers, args.pages_per_task))
+
+if __name__ == '__main__':
+    main()
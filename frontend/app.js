@@ -55,6 +55,8 @@ function setupEventListeners() {
     }
 
     document.getElementById('start-quiz').onclick = startQuiz;
+    document.getElementById('leaderboard-more').onclick = () => loadLeaderboard(true);
+    document.getElementById('leaderboard-window').onchange = () => loadLeaderboard();
 
     // Chat
     document.getElementById('send-btn').onclick = sendTextQuery;
@@ -69,6 +71,11 @@ function setupEventListeners() {
     };
 }
 
+// Signed-in medic for history records; undefined (dropped from the JSON body) for guests
+function currentUserId() {
+    return currentUser ? currentUser.getUsername() : undefined;
+}
+
 // Auth Handlers
 function handleRegister(e) {
     e.preventDefault();
@@ -149,6 +156,17 @@ function showDashboard() {
 // Audio Logic
 let mediaRecorder;
 let audioChunks = [];
+let voiceStream = null;
+
+// Streaming recognition needs an encoding Transcribe streaming accepts (ogg-opus);
+// browsers that only record webm use the batch voice job instead
+const STREAM_MIME_TYPE = 'audio/ogg;codecs=opus';
+const STREAM_TIMESLICE_MS = 250;
+
+function voiceLanguage() {
+    const select = document.getElementById('voice-language');
+    return select ? select.value : 'en-US';
+}
 
 async function startRecording() {
     document.getElementById('recording-status').innerText = "Listening...";
@@ -156,51 +174,151 @@ async function startRecording() {
 
     try {
         const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
-        mediaRecorder = new MediaRecorder(stream);
+        const canStream = window.MediaRecorder && MediaRecorder.isTypeSupported(STREAM_MIME_TYPE);
+        mediaRecorder = canStream ? new MediaRecorder(stream, { mimeType: STREAM_MIME_TYPE }) : new MediaRecorder(stream);
         audioChunks = [];
+        voiceStream = canStream ? {
+            sessionId: crypto.randomUUID(),
+            seq: 0,
+            failed: false,
+            chain: Promise.resolve()
+        } : null;
 
         mediaRecorder.ondataavailable = event => {
             audioChunks.push(event.data);
+            if (voiceStream && event.data.size > 0) {
+                const session = voiceStream;
+                session.chain = session.chain.then(() => sendStreamChunk(session, event.data, false));
+            }
         };
 
-        mediaRecorder.start();
+        mediaRecorder.start(voiceStream ? STREAM_TIMESLICE_MS : undefined);
     } catch (err) {
         console.error("Mic error:", err);
         alert("Microphone access denied");
     }
 }
 
+function blobToBase64(blob) {
+    return new Promise(resolve => {
+        const reader = new FileReader();
+        reader.readAsDataURL(blob);
+        reader.onloadend = () => resolve(reader.result.split(',')[1] || '');
+    });
+}
+
+async function sendStreamChunk(session, blob, final) {
+    if (session.failed) return null;
+    try {
+        const res = await fetch(`${CONFIG.ApiEndpoint}/ask/stream`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                sessionId: session.sessionId,
+                seq: session.seq++,
+                audio: blob ? await blobToBase64(blob) : '',
+                encoding: 'ogg-opus',
+                language: voiceLanguage(),
+                final: final,
+                userId: currentUserId()
+            })
+        });
+        if (!res.ok) throw new Error(`Stream chunk rejected: ${res.status}`);
+        const data = await res.json();
+        if (data.partial) {
+            document.getElementById('recording-status').innerText = data.partial;
+        }
+        return data;
+    } catch (err) {
+        console.warn("Streaming recognition unavailable, falling back to upload:", err);
+        session.failed = true;
+        return null;
+    }
+}
+
 function stopRecording() {
     document.getElementById('recording-status').innerText = "Processing...";
     document.getElementById('record-btn').style.transform = "scale(1)";
 
     if (mediaRecorder && mediaRecorder.state !== 'inactive') {
-        mediaRecorder.stop();
         mediaRecorder.onstop = async () => {
-            const audioBlob = new Blob(audioChunks, { type: 'audio/webm' }); // Transcribe supports webm
-            // Convert to base64
-            const reader = new FileReader();
-            reader.readAsDataURL(audioBlob);
-            reader.onloadend = async () => {
-                const base64Audio = reader.result.split(',')[1];
-                await sendAudioQuery(base64Audio);
-            };
+            const session = voiceStream;
+            if (session) {
+                await session.chain;
+                const result = await sendStreamChunk(session, null, true);
+                if (result) {
+                    addMessage(result.question || "Audio Query", "user");
+                    addMessage(result.answer || "No response", "system");
+                    document.getElementById('recording-status').innerText = "Hold to Speak";
+                    return;
+                }
+            }
+
+            const mimeType = mediaRecorder.mimeType || 'audio/webm';
+            const audioBlob = new Blob(audioChunks, { type: mimeType }); // Transcribe supports webm and ogg
+            await sendAudioQuery(audioBlob, mimeType.startsWith('audio/ogg') ? 'ogg' : 'webm');
         };
+        mediaRecorder.stop();
+    }
+}
+
+// Uploads the recording straight to S3 (single PUT, or multipart for long recordings)
+// and returns the object key for /ask
+async function uploadAudio(audioBlob, format) {
+    const res = await fetch(`${CONFIG.ApiEndpoint}/ask/upload`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ format: format, size: audioBlob.size })
+    });
+    const upload = await res.json();
+    if (!res.ok) throw new Error(upload.error || 'Upload request failed');
+
+    if (upload.uploadUrl) {
+        const put = await fetch(upload.uploadUrl, {
+            method: 'PUT',
+            headers: { 'Content-Type': upload.contentType },
+            body: audioBlob
+        });
+        if (!put.ok) throw new Error(`Upload failed: ${put.status}`);
+        return upload.audioKey;
+    }
+
+    const parts = [];
+    for (let i = 0; i < upload.partUrls.length; i++) {
+        const part = audioBlob.slice(i * upload.partSize, (i + 1) * upload.partSize);
+        const put = await fetch(upload.partUrls[i], { method: 'PUT', body: part });
+        if (!put.ok) throw new Error(`Upload of part ${i + 1} failed: ${put.status}`);
+        parts.push({ PartNumber: i + 1, ETag: put.headers.get('ETag') });
     }
+    const done = await fetch(`${CONFIG.ApiEndpoint}/ask/upload/complete`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ audioKey: upload.audioKey, uploadId: upload.uploadId, parts: parts })
+    });
+    if (!done.ok) throw new Error('Completing upload failed');
+    return upload.audioKey;
 }
 
-async function sendAudioQuery(audioData) {
+async function sendAudioQuery(audioBlob, format = 'webm') {
     addMessage("Sending audio...", "user");
 
     try {
+        const audioKey = await uploadAudio(audioBlob, format);
         const response = await fetch(`${CONFIG.ApiEndpoint}/ask`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ audio: audioData, question: "Audio Query" }) // Send audio
+            body: JSON.stringify({ audioKey: audioKey, question: "Audio Query", language: voiceLanguage(), userId: currentUserId() })
         });
 
         const data = await response.json();
-        addMessage(data.answer || "No response", "system");
+        if (data.jobId) {
+            // Voice queries are processed asynchronously; poll until the answer is stored
+            const statusDiv = addMessage(data.answer || "Transcribing...", "system");
+            const result = await pollVoiceJob(data.jobId);
+            statusDiv.innerText = result.answer || "No response";
+        } else {
+            addMessage(data.answer || "No response", "system");
+        }
         document.getElementById('recording-status').innerText = "Hold to Speak";
     } catch (err) {
         addMessage("Error connecting to HQ.", "system");
@@ -208,21 +326,83 @@ async function sendAudioQuery(audioData) {
     }
 }
 
+async function pollVoiceJob(jobId, timeoutMs = 60000) {
+    const deadline = Date.now() + timeoutMs;
+    let delay = 500;
+    while (Date.now() < deadline) {
+        await new Promise(resolve => setTimeout(resolve, delay));
+        const res = await fetch(`${CONFIG.ApiEndpoint}/ask/status?jobId=${encodeURIComponent(jobId)}`);
+        const data = await res.json();
+        if (data.status === 'DONE') return data;
+        delay = Math.min(delay * 1.5, 2000);
+    }
+    return { answer: "Voice Systems Offline: transcription timed out." };
+}
+
 function addMessage(text, type) {
     const div = document.createElement('div');
     div.className = `message ${type}`;
     div.innerText = text;
     document.getElementById('chat-history').appendChild(div);
     document.getElementById('chat-history').scrollTop = document.getElementById('chat-history').scrollHeight;
+    return div;
+}
+
+// Reads a text/event-stream /ask response, appending tokens to the message as they arrive
+async function readAnswerStream(response, messageDiv) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    const history = document.getElementById('chat-history');
+    let buffer = '';
+    let answer = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let eventName = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) eventName = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            if (!data) continue;
+
+            const payload = JSON.parse(data);
+            if (eventName === 'done') {
+                answer = payload.answer || answer;
+            } else if (payload.token) {
+                answer += payload.token;
+            }
+            messageDiv.innerText = answer || "No response";
+            history.scrollTop = history.scrollHeight;
+        }
+    }
+    return answer;
 }
 
 // Leaderboard
-async function loadLeaderboard() {
+let leaderboardCursor = null;
+
+function leaderboardWindow() {
+    const select = document.getElementById('leaderboard-window');
+    return select ? select.value : 'alltime';
+}
+
+async function loadLeaderboard(more = false) {
     try {
-        const res = await fetch(`${CONFIG.ApiEndpoint}/leaderboard`);
+        const params = new URLSearchParams({ limit: 10, window: leaderboardWindow() });
+        if (more && leaderboardCursor) params.set('cursor', leaderboardCursor);
+        const res = await fetch(`${CONFIG.ApiEndpoint}/leaderboard?${params}`);
         const data = await res.json();
         const list = document.getElementById('leaderboard-list');
-        list.innerHTML = "";
+        if (!more) list.innerHTML = "";
 
         if (data.leaderboard && data.leaderboard.length > 0) {
             data.leaderboard.forEach(user => {
@@ -230,9 +410,35 @@ async function loadLeaderboard() {
                 li.innerText = `${user.UserId}: ${user.TotalScore}`;
                 list.appendChild(li);
             });
-        } else {
+        } else if (!more) {
             list.innerHTML = "<li>No data yet</li>";
         }
+
+        leaderboardCursor = data.nextCursor || null;
+        document.getElementById('leaderboard-more').classList.toggle('hidden', !leaderboardCursor);
+        if (!more) loadMyRank();
+    } catch (e) {
+        console.error(e);
+    }
+}
+
+async function loadMyRank() {
+    const rankLine = document.getElementById('my-rank');
+    if (!currentUser) {
+        rankLine.classList.add('hidden');
+        return;
+    }
+    try {
+        const params = new URLSearchParams({ userId: currentUser.getUsername(), window: leaderboardWindow() });
+        const res = await fetch(`${CONFIG.ApiEndpoint}/rank?${params}`);
+        if (!res.ok) {
+            rankLine.classList.add('hidden');
+            return;
+        }
+        const data = await res.json();
+        const rank = data.exact ? `#${data.rank}` : `#${data.rankRange[0]}-${data.rankRange[1]}`;
+        rankLine.innerText = `Your rank: ${rank} of ${data.totalUsers} (${data.score} pts)`;
+        rankLine.classList.remove('hidden');
     } catch (e) {
         console.error(e);
     }
@@ -258,6 +464,8 @@ async function startQuiz() {
     }
 }
 
+let currentQuizQuestion = null;
+
 function renderQuizQuestion(data) {
     const quizArea = document.getElementById('quiz-area');
 
@@ -267,6 +475,7 @@ function renderQuizQuestion(data) {
         return;
     }
 
+    currentQuizQuestion = data.question;
     let html = `
         <div class="quiz-question">
             <p>${data.question}</p>
@@ -283,21 +492,38 @@ function renderQuizQuestion(data) {
 
 async function updateScore() {
     if (!currentUser) return 'GUEST';
-    try {
-        const username = currentUser.getUsername();
-        const res = await fetch(`${CONFIG.ApiEndpoint}/score`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ userId: username })
-        });
-        const data = await res.json();
-        console.log("Score updated:", data);
-        loadLeaderboard();
-        return data.newScore;
-    } catch (e) {
-        console.error("Score update failed:", e);
-        return null;
+    const username = currentUser.getUsername();
+    // The event id makes the write idempotent, so a retry after a dropped response cannot double-count
+    const eventId = crypto.randomUUID();
+    for (let attempt = 0; attempt < 2; attempt++) {
+        try {
+            const res = await fetch(`${CONFIG.ApiEndpoint}/score`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ userId: username, eventId, question: currentQuizQuestion })
+            });
+            const data = await res.json();
+            console.log("Score updated:", data);
+            loadLeaderboard();
+            return data.newScore;
+        } catch (e) {
+            console.error("Score update failed:", e);
+        }
     }
+    return null;
+}
+
+// Wrong answers score nothing; they are only sent so the attempt lands in the medic's history
+function recordMiss() {
+    if (!currentUser) return;
+    fetch(`${CONFIG.ApiEndpoint}/score/batch`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            userId: currentUser.getUsername(),
+            events: [{ eventId: crypto.randomUUID(), correct: false, question: currentQuizQuestion }]
+        })
+    }).catch(e => console.error("Attempt record failed:", e));
 }
 
 window.checkAnswer = async function (selected, correct, explanation) {
@@ -322,6 +548,7 @@ window.checkAnswer = async function (selected, correct, explanation) {
         }
     } else {
         feedback.innerHTML = `<div class="feedback failure">Incorrect. ${explanation}</div>`;
+        recordMiss();
     }
 
     // Reset button
@@ -343,12 +570,22 @@ async function sendTextQuery() {
     addMessage(text, "user");
 
     try {
+        // SSE only when the API sits behind a streaming front end (StreamAnswers in APP_CONFIG): behind
+        // API Gateway the event stream arrives as one buffered body, no sooner than the plain JSON answer
+        const stream = Boolean(CONFIG.StreamAnswers);
         const response = await fetch(`${CONFIG.ApiEndpoint}/ask`, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ question: text })
+            headers: stream ? { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' }
+                            : { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ question: text, stream: stream, userId: currentUserId() })
         });
 
+        const contentType = response.headers.get('Content-Type') || '';
+        if (contentType.startsWith('text/event-stream') && response.body) {
+            await readAnswerStream(response, addMessage("...", "system"));
+            return;
+        }
+
         const data = await response.json();
         addMessage(data.answer || "No response", "system");
     } catch (err) {
@@ -1,28 +1,140 @@
+import argparse
+import json
+import queue
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 import boto3
-import time
+from botocore.config import Config
+
+# Pulls a log group over a time range with filter_log_events, which searches all streams at once.
+# The range is cut into time slices that a bounded thread pool pages through concurrently; events go
+# through a bounded queue, so memory stays flat however many there are and a slow consumer (the
+# analyzer, a file) simply slows the fetch down. Events come out as {timestamp, logStreamName,
+# message}, in time order within a slice, but the slices being fetched at the same time interleave
+# through the shared queue, so the output as a whole is not sorted: sort by timestamp afterwards if
+# order matters. (analyze_logs.py only relies on order within a log stream, which a request
+# straddling two slices can break; use --workers 1 for old logs without request ids.)
+#   python get_logs.py --since 2h > events.jsonl
+#   python get_logs.py --start 2026-01-10T15:00 --end 2026-01-10T16:00 --filter REPORT --out report.jsonl
+# CloudWatch Logs allows a few FilterLogEvents calls per second per account; adaptive retries
+# back off when it throttles, so more workers than that only queue.
+
+REGION = 'eu-central-1'
+LOG_GROUP = '/aws/lambda/TacMed_Backend'
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_DONE = object()
+
+def parse_time(text, now=None):
+    # "90m", "2h", "7d" ago, an ISO timestamp (UTC unless it says otherwise), or epoch milliseconds
+    now = now if now is not None else time.time()
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([smhd])', text)
+    if match:
+        return int((now - float(match.group(1)) * UNITS[match.group(2)]) * 1000)
+    if text.isdigit():
+        return int(text)
+    parsed = datetime.fromisoformat(text)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+def make_client(workers, region=REGION):
+    return boto3.client('logs', region_name=region, config=Config(
+        retries={'max_attempts': 10, 'mode': 'adaptive'},
+        max_pool_connections=max(workers, 10)
+    ))
+
+def time_slices(start_ms, end_ms, count):
+    step = max((end_ms - start_ms) // count, 1)
+    edges = list(range(start_ms, end_ms, step)) + [end_ms]
+    return list(zip(edges[:-1], edges[1:]))
+
+def fetch_events(log_group, start_ms, end_ms, workers=4, slices=None, filter_pattern='', client=None,
+                 buffer=10000):
+    # Generator over the group's events in [start_ms, end_ms); stops the workers if closed early
+    client = client or make_client(workers)
+    out = queue.Queue(maxsize=buffer)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fetch_slice(window):
+        # filter_log_events' endTime is inclusive: end one millisecond early so slices do not overlap
+        params = {'logGroupName': log_group, 'startTime': window[0], 'endTime': window[1] - 1}
+        if filter_pattern:
+            params['filterPattern'] = filter_pattern
+        while not stop.is_set():
+            resp = client.filter_log_events(**params)
+            for event in resp.get('events', []):
+                if not put({'timestamp': event['timestamp'], 'logStreamName': event['logStreamName'],
+                            'message': event['message']}):
+                    return
+            if 'nextToken' not in resp:
+                return
+            params['nextToken'] = resp['nextToken']
+
+    def run_all():
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(fetch_slice, window) for window in time_slices(start_ms, end_ms, slices or workers * 4)]
+            for future in futures:
+                error = future.exception()
+                if error is not None:
+                    # Stop the other slices, then hand the error to the consumer after what it already has
+                    stop.set()
+                    out.put(error)
+                    return
+        put(_DONE)
+
+    threading.Thread(target=run_all, daemon=True).start()
+    try:
+        while True:
+            item = out.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+def main():
+    parser = argparse.ArgumentParser(description='Fetch CloudWatch log events over a time range as JSON lines')
+    parser.add_argument('--group', default=LOG_GROUP)
+    parser.add_argument('--region', default=REGION)
+    parser.add_argument('--since', default='1h', help='Start: "90m", "2h", "7d" ago, ISO time or epoch ms')
+    parser.add_argument('--start', help='Start time (overrides --since)')
+    parser.add_argument('--end', help='End time (default: now)')
+    parser.add_argument('--filter', default='', help='CloudWatch filter pattern, e.g. REPORT')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--slices', type=int, help='Time slices (default: 4 per worker)')
+    parser.add_argument('--out', help='Output file (default: stdout)')
+    args = parser.parse_args()
+
+    start_ms = parse_time(args.start or args.since)
+    end_ms = parse_time(args.end) if args.end else int(time.time() * 1000)
+    out = open(args.out, 'w', encoding='utf-8') if args.out else sys.stdout
+    count = 0
+    started = time.time()
+    try:
+        for event in fetch_events(args.group, start_ms, end_ms, args.workers, args.slices, args.filter,
+                                  make_client(args.workers, args.region)):
+            out.write(json.dumps(event, ensure_ascii=False) + '\n')
+            count += 1
+    finally:
+        if args.out:
+            out.close()
+    print(f"{count} events from {args.group} in {time.time() - started:.1f}s", file=sys.stderr)
 
-client = boto3.client('logs', region_name='eu-central-1')
-log_group = '/aws/lambda/TacMed_Backend'
-
-try:
-    streams = client.describe_log_streams(
-        logGroupName=log_group,
-        orderBy='LastEventTime',
-        descending=True,
-        limit=1
-    )
-    stream_name = streams['logStreams'][0]['logStreamName']
-    print(f"Reading stream: {stream_name}")
-    
-    resp = client.get_log_events(
-        logGroupName=log_group,
-        logStreamName=stream_name,
-        limit=10,
-        startFromHead=False
-    )
-    
-    for event in resp['events']:
-        print(f"{event['timestamp']} : {event['message'].strip()}")
-except Exception as e:
-    print(f"Error: {e}")
+if __name__ == '__main__':
+    main()
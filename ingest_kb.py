@@ -0,0 +1,364 @@
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+import extract_kb
+from kb_retrieval import write_index
+
+# Incremental ingestion of kb/: only documents whose bytes changed are extracted again, only chunks
+# whose text changed are embedded and uploaded again, and chunks that disappeared are removed.
+#   python ingest_kb.py                        # local index (backend/kb_index), BM25 only
+#   python ingest_kb.py --embed                # + Titan embeddings, cached per chunk
+#   python ingest_kb.py --embed --sync-kb      # + the Bedrock Knowledge Base, chunk by chunk
+# State lives in --cache-dir (default .kb_ingest/, not shipped):
+#   manifest.json      - per document: sha256 of the file, pages, its chunk hashes and extraction time;
+#                        the chunking parameters; the chunk hashes uploaded to the KB bucket
+#   docs/<sha256>.json - the document's extracted chunks, so an unchanged PDF is never parsed again
+#   embeddings.json    - model, dimension and chunk hash per row of embeddings.f32 (float32 rows)
+# Chunks are extract_kb.py's (normalized, section-aware, with content-defined boundaries), so the
+# Knowledge Base gets the same chunks as the local index; boundaries depend only on the words around
+# them, so editing one page changes the hashes of the chunks on that page, where fixed sliding
+# windows would shift every later chunk.
+# Extraction and chunking run in a process pool (one document per task); embedding calls and S3
+# writes in thread pools.
+#
+# Knowledge Base sync: each chunk is an S3 object <prefix><hash>.txt with a .metadata.json sidecar
+# (source PDF and page) in a data source that has chunking set to NONE, so Bedrock embeds exactly
+# these chunks and an ingestion job only touches objects that were added or deleted. No job is
+# started when nothing changed. The data source is created on first use; a data source that
+# still indexes the whole bucket would index the PDFs a second time and should be deleted after
+# the first chunk sync.
+
+CACHE_DIR = os.path.join(ROOT, '.kb_ingest')
+OUTPUTS = os.path.join(ROOT, 'infrastructure_outputs.json')
+REGION = 'eu-central-1'
+EMBED_MODEL_ID = 'amazon.titan-embed-text-v2:0'
+CHUNK_PREFIX = 'kb-chunks/'
+DATA_SOURCE_NAME = 'TacMed_Chunks_Source'
+MANIFEST_VERSION = 2
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+def chunk_document(pages):
+    # [{'page', 'page_end', 'section', 'text', 'hash'}]; page is where the chunk starts
+    chunks = []
+    for chunk in extract_kb.chunk_document(None, pages):
+        del chunk['doc']
+        chunk['hash'] = chunk_hash(chunk['text'])
+        chunks.append(chunk)
+    return chunks
+
+def process_document(path, extract=extract_kb.extract_pages):
+    # Runs in a worker process
+    started = time.perf_counter()
+    pages = extract(path)
+    return {'pages': len(pages), 'chunks': chunk_document(pages), 'seconds': time.perf_counter() - started}
+
+def _write_json(path, data):
+    # Atomic: an interrupted run leaves the previous file intact
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, path)
+
+def _read_json(path, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+class EmbeddingCache:
+    # chunk hash -> float32 vector, for one embedding model
+    def __init__(self, cache_dir, model):
+        self.meta_path = os.path.join(cache_dir, 'embeddings.json')
+        self.data_path = os.path.join(cache_dir, 'embeddings.f32')
+        self.model = model
+        self.vectors = {}
+        meta = _read_json(self.meta_path, {})
+        if meta.get('model') == model and os.path.exists(self.data_path):
+            data = array('f')
+            with open(self.data_path, 'rb') as f:
+                data.frombytes(f.read())
+            dim = meta['dim']
+            for row, h in enumerate(meta['hashes']):
+                self.vectors[h] = data[row * dim:(row + 1) * dim]
+
+    def save(self, keep):
+        # Only the chunks still in the corpus are kept
+        hashes = [h for h in keep if h in self.vectors]
+        data = array('f')
+        for h in hashes:
+            data.extend(self.vectors[h])
+        tmp = f"{self.data_path}.tmp"
+        with open(tmp, 'wb') as f:
+            data.tofile(f)
+        os.replace(tmp, self.data_path)
+        dim = len(self.vectors[hashes[0]]) if hashes else 0
+        _write_json(self.meta_path, {'model': self.model, 'dim': dim, 'hashes': hashes})
+
+def titan_embedder(region, model=EMBED_MODEL_ID):
+    import boto3
+    client = boto3.client('bedrock-runtime', region_name=region)
+
+    def embed(text):
+        resp = client.invoke_model(modelId=model, body=json.dumps({'inputText': text[:8000], 'normalize': True}))
+        return json.loads(resp['body'].read())['embedding']
+
+    return embed
+
+class KBSync:
+    # Chunk objects in S3 plus ingestion jobs on the chunk data source
+    def __init__(self, s3, bedrock_agent, bucket, kb_id, prefix=CHUNK_PREFIX, data_source_id=None):
+        self.s3 = s3
+        self.agent = bedrock_agent
+        self.bucket = bucket
+        self.kb_id = kb_id
+        self.prefix = prefix
+        self.data_source_id = data_source_id
+
+    def ensure_data_source(self):
+        if self.data_source_id:
+            return self.data_source_id
+        sources = self.agent.list_data_sources(knowledgeBaseId=self.kb_id)['dataSourceSummaries']
+        for source in sources:
+            if source['name'] == DATA_SOURCE_NAME:
+                self.data_source_id = source['dataSourceId']
+                return self.data_source_id
+        others = [s['name'] for s in sources]
+        resp = self.agent.create_data_source(
+            knowledgeBaseId=self.kb_id,
+            name=DATA_SOURCE_NAME,
+            dataSourceConfiguration={'type': 'S3', 's3Configuration': {
+                'bucketArn': f"arn:aws:s3:::{self.bucket}", 'inclusionPrefixes': [self.prefix]}},
+            vectorIngestionConfiguration={'chunkingConfiguration': {'chunkingStrategy': 'NONE'}}
+        )
+        self.data_source_id = resp['dataSource']['dataSourceId']
+        if others:
+            print(f"Created data source {DATA_SOURCE_NAME}; {', '.join(others)} may index the whole bucket "
+                  f"(PDFs included): delete it once this one has synced")
+        return self.data_source_id
+
+    def upload(self, chunk, source):
+        key = f"{self.prefix}{chunk['hash']}.txt"
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=chunk['text'].encode('utf-8'),
+                           ContentType='text/plain; charset=utf-8')
+        self.s3.put_object(Bucket=self.bucket, Key=f"{key}.metadata.json", ContentType='application/json',
+                           Body=json.dumps({'metadataAttributes': {'source': source, 'page': chunk['page']}}).encode())
+
+    def delete(self, hashes):
+        keys = [k for h in hashes for k in (f"{self.prefix}{h}.txt", f"{self.prefix}{h}.txt.metadata.json")]
+        for start in range(0, len(keys), 1000):
+            self.s3.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': k} for k in keys[start:start + 1000]], 'Quiet': True})
+
+    def start_ingestion(self):
+        resp = self.agent.start_ingestion_job(knowledgeBaseId=self.kb_id, dataSourceId=self.ensure_data_source())
+        return resp['ingestionJob']['ingestionJobId']
+
+    def wait(self, job_id, poll=10):
+        while True:
+            job = self.agent.get_ingestion_job(knowledgeBaseId=self.kb_id, dataSourceId=self.data_source_id,
+                                               ingestionJobId=job_id)['ingestionJob']
+            if job['status'] in ('COMPLETE', 'FAILED', 'STOPPED'):
+                return job
+            time.sleep(poll)
+
+def ingest(kb_dir, cache_dir=CACHE_DIR, index_out=None, workers=None, embed=None, embed_workers=4,
+           sync=None, sync_workers=8, extract=extract_kb.extract_pages, model=EMBED_MODEL_ID):
+    # embed: text -> vector, or None for a BM25-only index; sync: a KBSync, or None
+    started = time.perf_counter()
+    os.makedirs(os.path.join(cache_dir, 'docs'), exist_ok=True)
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    manifest = _read_json(manifest_path, {})
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('chunking') != extract_kb.chunking_params():
+        # New cache or different chunking: every document is processed again (embeddings stay valid)
+        manifest = {'version': MANIFEST_VERSION, 'chunking': extract_kb.chunking_params(), 'docs': {},
+                    'uploaded': manifest.get('uploaded', []), 'embed_ms': manifest.get('embed_ms')}
+    old_docs = manifest['docs']
+
+    # 1. What changed, by content hash
+    names = sorted(n for n in os.listdir(kb_dir) if n.lower().endswith('.pdf'))
+    hashes = {name: file_sha256(os.path.join(kb_dir, name)) for name in names}
+    state = {}
+    for name in names:
+        old = old_docs.get(name)
+        cached = os.path.join(cache_dir, 'docs', f"{hashes[name]}.json")
+        if old and old['sha256'] == hashes[name] and os.path.exists(cached):
+            state[name] = 'unchanged'
+        else:
+            state[name] = 'changed' if old else 'new'
+    removed = sorted(set(old_docs) - set(names))
+
+    # 2. Extract and chunk changed documents in parallel
+    todo = [name for name in names if state[name] != 'unchanged']
+    extract_started = time.perf_counter()
+    docs = {}
+    if todo:
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(todo))) as pool:
+            futures = {name: pool.submit(process_document, os.path.join(kb_dir, name), extract) for name in todo}
+            for name, future in futures.items():
+                result = future.result()
+                _write_json(os.path.join(cache_dir, 'docs', f"{hashes[name]}.json"), result['chunks'])
+                docs[name] = {'sha256': hashes[name], 'pages': result['pages'],
+                              'chunks': [c['hash'] for c in result['chunks']], 'extract_s': round(result['seconds'], 3)}
+                docs[name]['_chunks'] = result['chunks']
+    extract_wall = time.perf_counter() - extract_started
+    for name in names:
+        if name not in docs:
+            docs[name] = dict(old_docs[name])
+            docs[name]['_chunks'] = _read_json(os.path.join(cache_dir, 'docs', f"{hashes[name]}.json"), [])
+
+    # 3. Chunk-level diff
+    current = {}
+    for name in names:
+        for chunk in docs[name]['_chunks']:
+            current.setdefault(chunk['hash'], (name, chunk))
+    previous = {h for doc in old_docs.values() for h in doc['chunks']}
+    added = [h for h in current if h not in previous]
+    stale = sorted(previous - set(current))
+
+    # 4. Embeddings for chunks the cache has not seen
+    embed_calls = 0
+    embed_wall = 0.0
+    cache = None
+    if embed is not None:
+        cache = EmbeddingCache(cache_dir, model)
+        missing = [h for h in current if h not in cache.vectors]
+        embed_started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=embed_workers) as pool:
+            for h, vector in zip(missing, pool.map(lambda h: embed(current[h][1]['text']), missing)):
+                cache.vectors[h] = array('f', vector)
+        embed_calls = len(missing)
+        embed_wall = time.perf_counter() - embed_started
+        if embed_calls:
+            manifest['embed_ms'] = round(embed_wall * 1000 * embed_workers / embed_calls, 1)
+        cache.save(list(current))
+
+    # 5. Local retrieval index (rebuilt from cached chunks: seconds, no extraction or embedding)
+    if index_out:
+        index_docs = []
+        index_chunks = []
+        vectors = [] if cache is not None else None
+        for doc_idx, name in enumerate(names):
+            index_docs.append({'key': name, 'title': os.path.splitext(name)[0], 'pages': docs[name]['pages']})
+            for chunk in docs[name]['_chunks']:
+                index_chunks.append({'doc': doc_idx, 'page': chunk['page'], 'text': chunk['text']})
+                if vectors is not None:
+                    vectors.append(cache.vectors[chunk['hash']].tolist())
+        write_index(index_out, index_docs, index_chunks, vectors)
+
+    # 6. Knowledge Base: upload new chunks, delete stale ones, sync only if something changed
+    uploaded = set(manifest['uploaded'])
+    to_upload = [h for h in current if h not in uploaded] if sync is not None else []
+    to_delete = sorted(uploaded - set(current)) if sync is not None else []
+    job_id = None
+    if sync is not None:
+        with ThreadPoolExecutor(max_workers=sync_workers) as pool:
+            list(pool.map(lambda h: sync.upload(current[h][1], current[h][0]), to_upload))
+        if to_delete:
+            sync.delete(to_delete)
+        manifest['uploaded'] = sorted(set(current) & (uploaded | set(to_upload)))
+        if to_upload or to_delete:
+            job_id = sync.start_ingestion()
+
+    for doc in docs.values():
+        doc.pop('_chunks', None)
+    manifest['docs'] = docs
+    _write_json(manifest_path, manifest)
+    for name in removed:
+        sha = old_docs[name]['sha256']
+        if sha not in hashes.values():
+            try:
+                os.remove(os.path.join(cache_dir, 'docs', f"{sha}.json"))
+            except OSError:
+                pass
+
+    # What a full resync would have cost: every document extracted, every chunk embedded and uploaded
+    full_extract_s = sum(doc['extract_s'] for doc in docs.values())
+    embed_ms = manifest.get('embed_ms') or 0
+    return {
+        'docs': {'total': len(names), 'new': sum(s == 'new' for s in state.values()),
+                 'changed': sum(s == 'changed' for s in state.values()),
+                 'unchanged': sum(s == 'unchanged' for s in state.values()), 'removed': len(removed)},
+        'chunks': {'total': len(current), 'added': len(added), 'stale': len(stale), 'reused': len(current) - len(added)},
+        'extract': {'docs': len(todo), 'pages': sum(docs[n]['pages'] for n in todo), 'wall_s': round(extract_wall, 2),
+                    'full_docs': len(names), 'full_pages': sum(d['pages'] for d in docs.values()),
+                    'full_s': round(full_extract_s, 2)},
+        'embed': {'calls': embed_calls, 'full_calls': len(current) if embed is not None else 0,
+                  'wall_s': round(embed_wall, 2), 'ms_per_call': embed_ms,
+                  'saved_s': round((len(current) - embed_calls) * embed_ms / 1000 / embed_workers, 1) if embed is not None else 0},
+        'kb': {'uploaded': len(to_upload), 'deleted': len(to_delete), 'full_uploads': len(current) if sync else 0,
+               'ingestion_job': job_id},
+        'seconds': round(time.perf_counter() - started, 2)
+    }
+
+def print_report(report):
+    d, c, x, e, k = report['docs'], report['chunks'], report['extract'], report['embed'], report['kb']
+    print(f"Documents: {d['total']} ({d['new']} new, {d['changed']} changed, {d['unchanged']} unchanged, {d['removed']} removed)")
+    print(f"Chunks:    {c['total']} ({c['added']} added, {c['stale']} stale, {c['reused']} reused)")
+    print(f"Extracted: {x['docs']}/{x['full_docs']} documents, {x['pages']}/{x['full_pages']} pages in {x['wall_s']}s "
+          f"(single-process full extraction: {x['full_s']}s)")
+    if e['full_calls']:
+        print(f"Embedded:  {e['calls']}/{e['full_calls']} chunks in {e['wall_s']}s; "
+              f"{e['full_calls'] - e['calls']} calls saved (~{e['saved_s']}s at {e['ms_per_call']} ms/call)")
+    if k['full_uploads']:
+        job = f"ingestion job {k['ingestion_job']}" if k['ingestion_job'] else 'no ingestion job needed'
+        print(f"KB sync:   {k['uploaded']} chunks uploaded, {k['deleted']} deleted "
+              f"(full resync: {k['full_uploads']} uploads, every chunk embedded again); {job}")
+    print(f"Total:     {report['seconds']}s")
+
+def main():
+    parser = argparse.ArgumentParser(description='Incrementally ingest kb/ PDFs into the local index and the Knowledge Base')
+    parser.add_argument('--kb-dir', default=os.path.join(ROOT, 'kb'))
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--out', default=os.path.join(ROOT, 'backend', 'kb_index'), help='Local index directory')
+    parser.add_argument('--no-index', action='store_true', help='Do not write the local index')
+    parser.add_argument('--workers', type=int, help='Extraction processes (default: CPU count)')
+    parser.add_argument('--embed', action='store_true', help='Titan embeddings for the local index (needs numpy)')
+    parser.add_argument('--embed-workers', type=int, default=4)
+    parser.add_argument('--sync-kb', action='store_true', help='Sync chunks to the Bedrock Knowledge Base')
+    parser.add_argument('--bucket', help='KB bucket (default: KbBucket from infrastructure_outputs.json)')
+    parser.add_argument('--kb-id', help='Knowledge Base id (default: KnowledgeBaseId from infrastructure_outputs.json)')
+    parser.add_argument('--data-source-id', help=f"Chunk data source (default: {DATA_SOURCE_NAME}, created if missing)")
+    parser.add_argument('--wait', action='store_true', help='Wait for the ingestion job and print its statistics')
+    parser.add_argument('--region', default=REGION)
+    args = parser.parse_args()
+
+    sync = None
+    if args.sync_kb:
+        import boto3
+        outputs = _read_json(OUTPUTS, {})
+        bucket = args.bucket or outputs.get('KbBucket')
+        kb_id = args.kb_id or outputs.get('KnowledgeBaseId')
+        if not bucket or not kb_id:
+            sys.exit('--sync-kb needs --bucket and --kb-id (or KbBucket and KnowledgeBaseId in infrastructure_outputs.json)')
+        sync = KBSync(boto3.client('s3', region_name=args.region), boto3.client('bedrock-agent', region_name=args.region),
+                      bucket, kb_id, data_source_id=args.data_source_id)
+        sync.ensure_data_source()
+
+    report = ingest(args.kb_dir, args.cache_dir, None if args.no_index else args.out, args.workers,
+                    titan_embedder(args.region) if args.embed else None, args.embed_workers, sync)
+    print_report(report)
+    if args.wait and report['kb']['ingestion_job']:
+        job = sync.wait(report['kb']['ingestion_job'])
+        print(f"Ingestion job {job['status']}: {json.dumps(job.get('statistics', {}))}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,494 @@
+
+import argparse
+import asyncio
+import base64
+import bisect
+import itertools
+import json
+import math
+import os
+import random
+import re
+import ssl
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# Concurrent load against the HTTP API: a configurable mix of /ask, /quiz, /score and /leaderboard.
+#   python load_test.py --rate 20 --duration 60                  # ApiEndpoint from infrastructure_outputs.json
+#   python load_test.py --concurrency 50 --rate 0                # closed loop: 50 users back to back
+#   python load_test.py --local --fake-aws --rate 50             # local stand-in, in-process AWS fakes
+#   python load_test.py --serve 8000                             # only run the stand-in (real AWS clients)
+# Open loop (--rate > 0): requests are scheduled at the target rate whatever the API does, at most
+# --concurrency in flight (one keep-alive connection each); latency is measured from the scheduled
+# send time, so queueing behind a slow API shows up instead of being hidden (no coordinated omission).
+# Closed loop (--rate 0): --concurrency workers each send the next request when the last one returns.
+# Per operation the report gives HDR-style latency percentiles (log-linear buckets, 3 significant
+# digits), the server's own time from the Server-Timing header, and outcome rates:
+#   fallback  - 200 with degraded content ("Fallback:" quiz, "HQ Offline"/"Voice Systems Offline" answer)
+#   throttled - 429/503, or a throttling error in the body (API Gateway, Lambda or DynamoDB limits)
+#   error     - other 5xx, timeouts and connection failures
+#   rejected  - other 4xx
+# Only the standard library: HTTP/1.1 over asyncio streams.
+# /score writes to the real Users table: load users are "<--user-prefix><n>" (reset_db.py clears them).
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+OUTPUTS = os.path.join(ROOT, 'infrastructure_outputs.json')
+OPERATIONS = ('ask', 'quiz', 'score', 'leaderboard')
+THROTTLE_RE = re.compile(r'Throttl|TooManyRequests|ProvisionedThroughputExceeded|Rate exceeded|SlowDown|RequestLimitExceeded')
+FALLBACK_ANSWERS = ('HQ Offline', 'Voice Systems Offline')
+QUESTIONS = [
+    'How to apply a tourniquet?',
+    'What are the signs of tension pneumothorax?',
+    'When should I perform a needle decompression?',
+    'How do I pack a junctional wound?',
+    'What does MARCH stand for?',
+    'How to manage an airway in an unconscious casualty?',
+    'How to prevent hypothermia in a casualty?',
+    'When do I convert a tourniquet?',
+    'What is the dose of TXA?',
+    'How do I treat a sucking chest wound?'
+]
+
+class Histogram:
+    # HDR-style: exact below 2 * SUB values, above that log-linear buckets with SUB sub-buckets per
+    # power of two (relative error < 1 / SUB). Values are integer microseconds; counts are sparse.
+    SUB = 1024
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @classmethod
+    def index(cls, value):
+        shift = max(value.bit_length() - cls.SUB.bit_length(), 0)
+        return shift * cls.SUB + (value >> shift)
+
+    @classmethod
+    def highest_equivalent(cls, index):
+        shift = max(index // cls.SUB - 1, 0)
+        return ((index - shift * cls.SUB + 1) << shift) - 1
+
+    def record(self, value_us):
+        value = max(int(value_us), 0)
+        i = self.index(value)
+        self.counts[i] = self.counts.get(i, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for i, n in other.counts.items():
+            self.counts[i] = self.counts.get(i, 0) + n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def _cumulative(self):
+        keys = sorted(self.counts)
+        return keys, list(itertools.accumulate(self.counts[i] for i in keys))
+
+    def percentile(self, p, cumulative=None):
+        # Highest value equivalent to the one at percentile p (0-100), never above the max seen
+        if not self.count:
+            return 0
+        keys, totals = cumulative or self._cumulative()
+        pos = bisect.bisect_left(totals, max(1, math.ceil(p / 100 * self.count)))
+        return min(self.highest_equivalent(keys[pos]), self.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def distribution(self, ticks=5):
+        # Percentile distribution in HdrHistogram's .hgrm text format (values in ms), plottable with
+        # the HdrHistogram plotter: `ticks` steps per halving of the distance to 100%
+        lines = [f"{'Value':>12} {'Percentile':>14} {'TotalCount':>10} {'1/(1-Percentile)':>14}", '']
+        keys, totals = cumulative = self._cumulative()
+        p = 0.0
+        while self.count:
+            pos = bisect.bisect_left(totals, max(1, math.ceil(p / 100 * self.count)))
+            if totals[pos] >= self.count:
+                p = 100.0
+            inverse = f"{1 / (1 - p / 100):>14.2f}" if p < 100 else f"{'inf':>14}"
+            lines.append(f"{self.percentile(p, cumulative) / 1000:>12.3f} {p / 100:>14.12f} {totals[pos]:>10} {inverse}")
+            if p >= 100:
+                break
+            half_distance = 2 ** (int(math.log2(100 / (100 - p))) + 1)
+            p += 100 / (half_distance * ticks)
+        lines.append(f"#[Mean    = {self.mean() / 1000:>12.3f}, Max     = {self.max / 1000:>12.3f}]")
+        lines.append(f"#[Total count    = {self.count:>12}]")
+        return '\n'.join(lines) + '\n'
+
+class Stats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.server = Histogram()
+        self.outcomes = {}
+
+    def add(self, outcome, latency_us, server_us=None):
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        self.latency.record(latency_us)
+        if server_us is not None:
+            self.server.record(server_us)
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.server.merge(other.server)
+        for k, n in other.outcomes.items():
+            self.outcomes[k] = self.outcomes.get(k, 0) + n
+
+class Connection:
+    # One keep-alive HTTP/1.1 connection; reopened after errors or "Connection: close"
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.secure = parts.scheme == 'https'
+        self.port = parts.port or (443 if self.secure else 80)
+        self.base = parts.path.rstrip('/')
+        self.reader = self.writer = None
+
+    async def open(self):
+        context = ssl.create_default_context() if self.secure else None
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=context)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        reused = self.writer is not None
+        try:
+            return await self._exchange(method, path, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            if not reused:
+                raise
+            # The server closed an idle keep-alive connection: one retry on a fresh one
+            return await self._exchange(method, path, body)
+
+    async def _exchange(self, method, path, body):
+        if self.writer is None:
+            await self.open()
+        data = json.dumps(body).encode() if body is not None else b''
+        head = [f"{method} {self.base}{path} HTTP/1.1", f"Host: {self.host}", 'Accept: application/json',
+                'User-Agent: tacmed-load-test', f"Content-Length: {len(data)}"]
+        if body is not None:
+            head.append('Content-Type: application/json')
+        self.writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + data)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError('connection closed by server')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+            payload = b''.join(chunks)
+        elif 'content-length' in headers:
+            payload = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            payload = await self.reader.read()
+            headers['connection'] = 'close'
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, headers, payload.decode('utf-8', 'replace')
+
+def build_request(op, rng, users, prefix):
+    user_id = f"{prefix}{rng.randrange(users)}"
+    if op == 'ask':
+        return 'POST', '/ask', {'question': rng.choice(QUESTIONS), 'userId': user_id}
+    if op == 'quiz':
+        return 'POST', '/quiz', {}
+    if op == 'score':
+        return 'POST', '/score', {'userId': user_id, 'eventId': uuid.uuid4().hex}
+    return 'GET', '/leaderboard', None
+
+def classify(op, status, body):
+    if status in (429, 503) or (status >= 400 and THROTTLE_RE.search(body)):
+        return 'throttled'
+    if status >= 500:
+        return 'error'
+    if status >= 400:
+        return 'rejected'
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return 'error'
+    if op == 'quiz' and str(data.get('question', '')).startswith('Fallback:'):
+        return 'fallback'
+    if op == 'ask' and str(data.get('answer', '')).startswith(FALLBACK_ANSWERS):
+        return 'fallback'
+    return 'ok'
+
+def server_total_us(headers):
+    match = re.search(r'total;dur=([\d.]+)', headers.get('server-timing', ''))
+    return float(match.group(1)) * 1000 if match else None
+
+class LoadTest:
+    def __init__(self, url, mix, rate, concurrency, duration, ramp, timeout, users, prefix, seed):
+        self.url = url
+        self.ops, self.weights = zip(*mix.items())
+        self.rate = rate
+        self.concurrency = concurrency
+        self.duration = duration
+        self.ramp = ramp
+        self.timeout = timeout
+        self.users = users
+        self.prefix = prefix
+        self.rng = random.Random(seed)
+        self.stats = {op: Stats() for op in self.ops}
+        self.late = 0
+
+    async def send(self, conn, op, scheduled):
+        method, path, body = build_request(op, self.rng, self.users, self.prefix)
+        server_us = None
+        try:
+            status, headers, text = await asyncio.wait_for(conn.request(method, path, body), self.timeout)
+            outcome = classify(op, status, text)
+            server_us = server_total_us(headers)
+        except asyncio.TimeoutError:
+            conn.close()
+            outcome = 'error'
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            conn.close()
+            outcome = 'error'
+        self.stats[op].add(outcome, (time.perf_counter() - scheduled) * 1e6, server_us)
+
+    async def open_loop(self):
+        pool = asyncio.Queue()
+        for _ in range(self.concurrency):
+            pool.put_nowait(Connection(self.url))
+
+        async def one(op, scheduled):
+            if pool.empty():
+                self.late += 1
+            conn = await pool.get()
+            try:
+                await self.send(conn, op, scheduled)
+            finally:
+                pool.put_nowait(conn)
+
+        tasks = set()
+        started = time.perf_counter()
+        scheduled = started
+        while scheduled - started < self.duration:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(one(self.rng.choices(self.ops, self.weights)[0], scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            elapsed = scheduled - started
+            rate = self.rate * min(1.0, (elapsed + 1 / self.rate) / self.ramp) if self.ramp else self.rate
+            scheduled += 1 / rate
+        if tasks:
+            await asyncio.wait(tasks)
+        return time.perf_counter() - started
+
+    async def closed_loop(self):
+        started = time.perf_counter()
+
+        async def worker():
+            conn = Connection(self.url)
+            while time.perf_counter() - started < self.duration:
+                await self.send(conn, self.rng.choices(self.ops, self.weights)[0], time.perf_counter())
+            conn.close()
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return time.perf_counter() - started
+
+    def run(self):
+        return asyncio.run(self.open_loop() if self.rate > 0 else self.closed_loop())
+
+def report(test, elapsed, hgrm_dir=None):
+    total = Stats()
+    rows = []
+    for op, stats in test.stats.items():
+        total.merge(stats)
+        rows.append((op, stats))
+    rows.append(('all', total))
+    print(f"\n{'op':<12} {'count':>7} {'rps':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'p99.9':>8} {'max':>8} "
+          f"{'server p50':>10} {'server p99':>10} {'fallback':>9} {'throttled':>9} {'error':>7} {'4xx':>6}")
+    summary = {}
+    for op, stats in rows:
+        h = stats.latency
+        if not h.count:
+            continue
+        rate = lambda outcome: stats.outcomes.get(outcome, 0) / h.count * 100
+        ms = lambda value: value / 1000
+        print(f"{op:<12} {h.count:>7} {h.count / elapsed:>7.1f} {ms(h.percentile(50)):>8.1f} {ms(h.percentile(90)):>8.1f} "
+              f"{ms(h.percentile(99)):>8.1f} {ms(h.percentile(99.9)):>8.1f} {ms(h.max):>8.1f} "
+              f"{ms(stats.server.percentile(50)):>10.1f} {ms(stats.server.percentile(99)):>10.1f} "
+              f"{rate('fallback'):>8.1f}% {rate('throttled'):>8.1f}% {rate('error'):>6.1f}% {rate('rejected'):>5.1f}%")
+        summary[op] = {
+            'count': h.count,
+            'rps': round(h.count / elapsed, 2),
+            'latency_ms': {f"p{p:g}": round(ms(h.percentile(p)), 2) for p in (50, 90, 99, 99.9)},
+            'max_ms': round(ms(h.max), 2),
+            'server_ms': {f"p{p:g}": round(ms(stats.server.percentile(p)), 2) for p in (50, 99)},
+            'outcomes': stats.outcomes
+        }
+        if hgrm_dir:
+            with open(os.path.join(hgrm_dir, f"{op}.hgrm"), 'w', encoding='utf-8') as f:
+                f.write(h.distribution())
+    if test.late:
+        print(f"\n{test.late} requests waited for one of the {test.concurrency} connections; "
+              f"raise --concurrency if the target rate matters more than the cap")
+    return summary
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # API Gateway v2 stand-in: HTTP request -> payload v2 event -> lambda_handler -> HTTP response
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without TCP_NODELAY every response waits for a delayed ACK
+    disable_nagle_algorithm = True
+    handler = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _invoke(self):
+        parts = urlsplit(self.path)
+        raw = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        try:
+            body, encoded = raw.decode('utf-8'), False
+        except UnicodeDecodeError:
+            body, encoded = base64.b64encode(raw).decode(), True
+        event = {
+            'version': '2.0',
+            'routeKey': '$default',
+            'rawPath': parts.path,
+            'rawQueryString': parts.query,
+            'queryStringParameters': dict(parse_qsl(parts.query)) or None,
+            'headers': {k.lower(): v for k, v in self.headers.items()},
+            'requestContext': {
+                'http': {'method': self.command, 'path': parts.path, 'protocol': self.request_version,
+                         'sourceIp': self.client_address[0]},
+                'requestId': uuid.uuid4().hex,
+                'stage': '$default',
+                'timeEpoch': int(time.time() * 1000)
+            },
+            'body': body if raw else None,
+            'isBase64Encoded': encoded
+        }
+        try:
+            resp = type(self).handler(event, None)
+        except Exception as e:
+            resp = {'statusCode': 502, 'body': json.dumps({'message': f"Internal Server Error: {e}"})}
+        payload = resp.get('body') or ''
+        payload = base64.b64decode(payload) if resp.get('isBase64Encoded') else payload.encode('utf-8')
+        self.send_response(resp.get('statusCode', 200))
+        for name, value in (resp.get('headers') or {}).items():
+            if name.lower() != 'content-length':
+                self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_OPTIONS = _invoke
+
+def start_stand_in(port, fake_aws):
+    # Serves lambda_handler on 127.0.0.1:port (0 = any free port) from a background thread.
+    # Requests run concurrently in one process, so module-level caches are shared across them
+    # the way they are within one warm container, not across separate Lambda containers.
+    if fake_aws:
+        import bench_lambda
+        services = bench_lambda.Services({'dynamodb': 3.0, 's3': 15.0, 'bedrock': 40.0, 'transcribe': 20.0, 'lambda': 10.0})
+        bench_lambda.logs.print = lambda *a, **k: None
+        bench_lambda.install_fakes(services, user_count=500, pool_size=2000)
+        handler = bench_lambda.lambda_function.lambda_handler
+    else:
+        sys.path.insert(0, os.path.join(ROOT, 'backend'))
+        import lambda_function
+        handler = lambda_function.lambda_handler
+    StandInHandler.handler = staticmethod(handler)
+    # socketserver's default backlog of 5 makes a burst of new connections wait for a SYN retransmit
+    server_class = type('StandInServer', (ThreadingHTTPServer,), {'request_queue_size': 256, 'daemon_threads': True})
+    server = server_class(('127.0.0.1', port), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        op, _, weight = part.partition('=')
+        if op not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {op!r}, expected one of {', '.join(OPERATIONS)}")
+        mix[op] = float(weight or 1)
+    return mix
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent load test of the TacMed HTTP API')
+    parser.add_argument('--url', help='API base URL (default: ApiEndpoint from infrastructure_outputs.json)')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('ask=2,quiz=3,score=3,leaderboard=2'),
+                        help='Relative weights, e.g. ask=2,quiz=3,score=3,leaderboard=2')
+    parser.add_argument('--rate', type=float, default=10.0, help='Target requests per second; 0 for a closed loop')
+    parser.add_argument('--concurrency', type=int, default=32, help='Connections (max requests in flight)')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds of load')
+    parser.add_argument('--ramp', type=float, default=0.0, help='Seconds to ramp linearly up to --rate')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Per-request timeout in seconds')
+    parser.add_argument('--users', type=int, default=200, help='Distinct simulated users')
+    parser.add_argument('--user-prefix', default='loadtest-')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--local', action='store_true', help='Run against a local stand-in wrapping lambda_handler')
+    parser.add_argument('--fake-aws', action='store_true', help='With --local/--serve: in-process AWS fakes (bench_lambda.py)')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='Only run the local stand-in on PORT')
+    parser.add_argument('--hgrm', metavar='DIR', help='Write per-operation .hgrm percentile distributions to DIR')
+    parser.add_argument('--json', metavar='FILE', help='Write the summary as JSON')
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        server = start_stand_in(args.serve, args.fake_aws)
+        print(f"lambda_handler stand-in on http://127.0.0.1:{server.server_address[1]} (Ctrl+C to stop)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    if args.local:
+        server = start_stand_in(0, args.fake_aws)
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+    elif args.url:
+        url = args.url
+    elif os.path.exists(OUTPUTS):
+        with open(OUTPUTS, 'r') as f:
+            url = json.load(f)['ApiEndpoint']
+    else:
+        sys.exit(f"{OUTPUTS} not found: deploy with setup.ps1, or pass --url or --local")
+
+    mode = f"{args.rate:g} req/s open loop, <= {args.concurrency} in flight" if args.rate > 0 \
+        else f"closed loop, {args.concurrency} workers"
+    print(f"Load testing {url}: {mode}, {args.duration:g}s, mix {args.mix}")
+    test = LoadTest(url, args.mix, args.rate, args.concurrency, args.duration, args.ramp, args.timeout,
+                    args.users, args.user_prefix, args.seed)
+    elapsed = test.run()
+    if args.hgrm:
+        os.makedirs(args.hgrm, exist_ok=True)
+    summary = report(test, elapsed, args.hgrm)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'url': url, 'rate': args.rate, 'concurrency': args.concurrency, 'duration_s': round(elapsed, 2),
+                       'mix': args.mix, 'operations': summary}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Cold-start profile of the Lambda, one fresh interpreter per measurement:
+#   import   - importing lambda_function (boto3, our modules, module-level setup)
+#   handler  - the first lambda_handler call for the route, including every client it builds
+# AWS calls never leave the process: a botocore before-send hook answers them with canned responses
+# shaped like the real ones (a user with a score, a filled leaderboard and quiz pool, one KB PDF, a
+# generated answer), so every route runs its success path and the numbers are setup cost, not
+# network time. The children load the KB index and document router that ship in the package
+# (backend/kb_index, built by extract_kb.py, build_kb_index.py and build_doc_router.py; deploy.yml
+# builds it before this step, --kb-index points elsewhere), so /ask pays for loading them as it does
+# in production. Budgets, forbidden clients, extra environment and the KB artifacts a route must
+# load live in cold_start_budget.json, keyed by a label that defaults to the route itself; the
+# script exits 1 when the index is missing, or when any route is over budget, answers with a
+# non-2xx status, builds a forbidden client or does not load what it must.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(ROOT, 'backend')
+
+S3_LISTING = (b'<?xml version="1.0" encoding="UTF-8"?>'
+              b'<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+              b'<Name>tacmed-kb-profile</Name><KeyCount>1</KeyCount><IsTruncated>false</IsTruncated>'
+              b'<Contents><Key>clinical-guidelines-2024-ua.pdf</Key><ETag>&quot;profile&quot;</ETag>'
+              b'<Size>4194304</Size></Contents></ListBucketResult>')
+ANSWER = 'Apply a tourniquet high and tight on the limb and note the time.'
+QUIZ_ITEM = {
+    'Pool': {'S': 'quiz'}, 'QuestionId': {'S': 'profile-0'},
+    'Question': {'S': 'Casualty has bright red spurting bleeding from the thigh. First action?'},
+    'Options': {'L': [{'S': o} for o in ('Tourniquet', 'IV access', 'Airway', 'Splint')]},
+    'CorrectIndex': {'N': '0'}, 'Explanation': {'S': 'Massive hemorrhage comes first in MARCH.'}
+}
+
+def dynamodb_response(target, body):
+    # Wire-format answer per operation and table; anything else gets an empty success
+    table = body.get('TableName', '')
+    key = body.get('Key', {}).get('Key', {}).get('S', '')
+    if target == 'GetItem' and table.endswith('_Users'):
+        return {'Item': {'UserId': {'S': 'profile-medic'}, 'TotalScore': {'N': '500'}}}
+    if target == 'GetItem' and table.endswith('_Leaderboard') and key == '#top':
+        entries = [{'M': {'UserId': {'S': f"medic-{n}"}, 'TotalScore': {'N': str(1000 - n * 100)}}} for n in range(5)]
+        return {'Item': {'Board': {'S': 'alltime'}, 'Key': {'S': '#top'}, 'Entries': {'L': entries}, 'Version': {'N': '3'}}}
+    if target == 'GetItem' and table.endswith('_Leaderboard') and key == '#hist':
+        return {'Item': {'Board': {'S': 'alltime'}, 'Key': {'S': '#hist'}, 's500': {'N': '3'}, 's900': {'N': '2'}, 'Users': {'N': '5'}}}
+    if target == 'Query' and table.endswith('_QuizPool'):
+        # A full page of candidates: the pool is healthy and no refill is triggered
+        items = [{'QuestionId': {'S': f"profile-{n}"}} for n in range(body.get('Limit', 50))]
+        return {'Items': items, 'Count': len(items)}
+    if target == 'Query':
+        return {'Items': [], 'Count': 0}
+    if target == 'DeleteItem' and table.endswith('_QuizPool'):
+        return {'Attributes': QUIZ_ITEM}
+    if target == 'UpdateItem':
+        return {'Attributes': {'TotalScore': {'N': '600'}, 'Score': {'N': '100'}}}
+    if target == 'BatchWriteItem':
+        return {'UnprocessedItems': {}}
+    return {}
+
+def canned_body(request):
+    url = request.url
+    if '.s3.' in url or '//s3.' in url:
+        return S3_LISTING
+    target = request.headers.get('X-Amz-Target', b'')
+    target = target.decode() if isinstance(target, bytes) else target
+    if target.startswith('DynamoDB_'):
+        return json.dumps(dynamodb_response(target.split('.')[-1], json.loads(request.body or b'{}'))).encode()
+    if '/retrieveAndGenerate' in url:
+        return json.dumps({'output': {'text': ANSWER}, 'sessionId': 'profile'}).encode()
+    if '/invoke' in url:
+        return json.dumps({'generation': ANSWER}).encode()
+    return b'{}'
+
+def make_event(route):
+    method, _, target = route.partition(' ')
+    path, _, query = target.partition('?')
+    params = dict(p.split('=', 1) for p in query.split('&')) if query else None
+    return {
+        'rawPath': path,
+        'requestContext': {'http': {'method': method}},
+        'queryStringParameters': params,
+        'body': json.dumps({'userId': 'profile-medic', 'question': 'How to apply a tourniquet?'}) if method == 'POST' else None
+    }
+
+def child(route, body):
+    started = time.perf_counter()
+    sys.path.insert(0, BACKEND)
+    import aws_clients
+    from botocore.awsrequest import AWSResponse
+
+    class Raw:
+        def __init__(self, data):
+            self.data = data
+
+        def stream(self, **kwargs):
+            yield self.data
+
+    def canned_response(request, **kwargs):
+        return AWSResponse(request.url, 200, {}, Raw(canned_body(request)))
+
+    aws_clients.session.events.register('before-send', canned_response)
+    import lambda_function
+    imported = time.perf_counter()
+
+    event = make_event(route)
+    if body is not None:
+        event['body'] = body
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        resp = lambda_function.lambda_handler(event, None)
+    finally:
+        sys.stdout = stdout
+    done = time.perf_counter()
+    print(json.dumps({
+        'import_ms': (imported - started) * 1000,
+        'handler_ms': (done - imported) * 1000,
+        'status': resp.get('statusCode'),
+        'clients': aws_clients.init_ms,
+        'loaded': [name for name, loaded in (('kb_index', lambda_function._local_index['index']),
+                                             ('router', lambda_function._doc_router['router'])) if loaded]
+    }))
+
+def measure(route, spec, runs, kb_index):
+    env = dict(os.environ,
+               AWS_DEFAULT_REGION='eu-central-1', AWS_ACCESS_KEY_ID='profile', AWS_SECRET_ACCESS_KEY='profile',
+               AWS_EC2_METADATA_DISABLED='true', KB_BUCKET='tacmed-kb-profile',
+               KB_INDEX_DIR=kb_index, PYTHONDONTWRITEBYTECODE='1', **spec.get('env', {}))
+    samples = []
+    for _ in range(runs):
+        args = [sys.executable, os.path.abspath(__file__), '--child', spec.get('route', route)]
+        if spec.get('body') is not None:
+            args += ['--body', json.dumps(spec['body'])]
+        out = subprocess.run(args, env=env, capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    median = lambda key: statistics.median(s[key] for s in samples)
+    return {
+        'import_ms': median('import_ms'),
+        'handler_ms': median('handler_ms'),
+        'status': samples[-1]['status'],
+        'clients': samples[-1]['clients'],
+        'loaded': samples[-1]['loaded']
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile Lambda cold starts per route against a budget')
+    parser.add_argument('--budget', default=os.path.join(ROOT, 'cold_start_budget.json'))
+    parser.add_argument('--runs', type=int, default=3, help='Fresh interpreters per route (median is reported)')
+    parser.add_argument('--kb-index', default=os.path.join(BACKEND, 'kb_index'),
+                        help='Built KB index directory with router.json (default: backend/kb_index)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--body', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.body)
+        return
+
+    missing = [name for name in ('meta.json', 'router.json') if not os.path.exists(os.path.join(args.kb_index, name))]
+    if missing:
+        # Without them /ask skips the loads it pays for in production and its time proves nothing
+        print(f"No built KB index in {args.kb_index} (missing {', '.join(missing)}): run extract_kb.py, "
+              f"build_kb_index.py --chunks and build_doc_router.py first, or pass --kb-index")
+        sys.exit(1)
+
+    with open(args.budget, encoding='utf-8') as f:
+        budget = json.load(f)
+
+    failures = []
+    print(f"{'route':<36} {'import':>8} {'handler':>8} {'total':>8} {'budget':>8} {'status':>6}  clients built")
+    for route, spec in budget['routes'].items():
+        result = measure(route, spec, args.runs, args.kb_index)
+        total = result['import_ms'] + result['handler_ms']
+        limit = spec.get('budget_ms', budget.get('default_budget_ms'))
+        clients = ', '.join(f"{name} {ms:.0f}ms" for name, ms in result['clients'].items()) or '-'
+        loaded = ''.join(f", {name} loaded" for name in result['loaded'])
+        print(f"{route:<36} {result['import_ms']:>8.0f} {result['handler_ms']:>8.0f} {total:>8.0f} "
+              f"{limit:>8} {result['status']:>6}  {clients}{loaded}")
+        if not 200 <= (result['status'] or 0) < 300:
+            # An error path skips most of the route's imports and calls; its time proves nothing
+            failures.append(f"{route}: answered {result['status']}, not the success path the budget is for")
+        if limit and total > limit:
+            failures.append(f"{route}: {total:.0f} ms over the {limit} ms budget")
+        built = [c for c in spec.get('forbidden_clients', []) if c in result['clients']]
+        if built:
+            failures.append(f"{route}: built forbidden clients {built}")
+        unloaded = [name for name in spec.get('loads', []) if name not in result['loaded']]
+        if unloaded:
+            failures.append(f"{route}: did not load {unloaded}")
+
+    if failures:
+        print('\nCold-start budget exceeded:\n  ' + '\n  '.join(failures))
+        sys.exit(1)
+    print('\nAll routes within budget.')
+
+if __name__ == '__main__':
+    main()
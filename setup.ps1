@@ -47,18 +47,52 @@ aws s3 website "s3://$s3WebBucket" --index-document index.html --error-document
 # 3. DynamoDB Tables
 Write-Host "Creating DynamoDB Tables..."
 # TacMed_Users
+# On demand: every POST /score writes the user twice (TotalScore, then RankKey) and each write
+# also rewrites the user's entries in both indexes, so provisioned 5 WCU throttled at a few
+# answers per second. See the cost note in backend/leaderboard.py.
 aws dynamodb describe-table --table-name TacMed_Users --region $region >$null 2>&1
 if ($LASTEXITCODE -ne 0) {
     aws dynamodb create-table `
         --table-name TacMed_Users `
         --attribute-definitions AttributeName=UserId, AttributeType=S AttributeName=TotalScore, AttributeType=N `
         --key-schema AttributeName=UserId, KeyType=HASH `
-        --global-secondary-indexes 'IndexName=TotalScoreIndex,KeySchema=[{AttributeName=TotalScore,KeyType=HASH}],Projection={ProjectionType=ALL},ProvisionedThroughput={ReadCapacityUnits=5,WriteCapacityUnits=5}' `
-        --provisioned-throughput ReadCapacityUnits=5, WriteCapacityUnits=5 `
+        --global-secondary-indexes 'IndexName=TotalScoreIndex,KeySchema=[{AttributeName=TotalScore,KeyType=HASH}],Projection={ProjectionType=ALL}' `
+        --billing-mode PAY_PER_REQUEST `
         --region $region | Out-Null
 }
 else {
     Write-Host "Table TacMed_Users already exists."
+    $billing = aws dynamodb describe-table --table-name TacMed_Users --region $region --query "Table.BillingModeSummary.BillingMode" --output text
+    if ($billing -ne "PAY_PER_REQUEST") {
+        aws dynamodb update-table --table-name TacMed_Users --billing-mode PAY_PER_REQUEST --region $region | Out-Null
+    }
+}
+
+# Write-sharded score index used to rebuild the materialized leaderboard
+$shardIndex = aws dynamodb describe-table --table-name TacMed_Users --region $region --query "Table.GlobalSecondaryIndexes[?IndexName=='ScoreShardIndex'].IndexName" --output text
+if (-not $shardIndex) {
+    aws dynamodb wait table-exists --table-name TacMed_Users --region $region
+    aws dynamodb update-table `
+        --table-name TacMed_Users `
+        --attribute-definitions AttributeName=ScoreShard, AttributeType=N AttributeName=RankKey, AttributeType=S `
+        --global-secondary-index-updates 'Create={IndexName=ScoreShardIndex,KeySchema=[{AttributeName=ScoreShard,KeyType=HASH},{AttributeName=RankKey,KeyType=RANGE}],Projection={ProjectionType=INCLUDE,NonKeyAttributes=[TotalScore]}}' `
+        --region $region | Out-Null
+}
+
+# TacMed_Leaderboard (materialized top-N records; daily/weekly windows expire via TTL)
+aws dynamodb describe-table --table-name TacMed_Leaderboard --region $region >$null 2>&1
+if ($LASTEXITCODE -ne 0) {
+    aws dynamodb create-table `
+        --table-name TacMed_Leaderboard `
+        --attribute-definitions AttributeName=Board, AttributeType=S AttributeName=Key, AttributeType=S `
+        --key-schema AttributeName=Board, KeyType=HASH AttributeName=Key, KeyType=RANGE `
+        --billing-mode PAY_PER_REQUEST `
+        --region $region | Out-Null
+    aws dynamodb wait table-exists --table-name TacMed_Leaderboard --region $region
+    aws dynamodb update-time-to-live --table-name TacMed_Leaderboard --time-to-live-specification "Enabled=true, AttributeName=ExpiresAt" --region $region | Out-Null
+}
+else {
+    Write-Host "Table TacMed_Leaderboard already exists."
 }
 
 # TacMed_History
@@ -75,6 +109,86 @@ else {
     Write-Host "Table TacMed_History already exists."
 }
 
+# TacMed_AnswerCache (answers for /ask, expired via TTL)
+aws dynamodb describe-table --table-name TacMed_AnswerCache --region $region >$null 2>&1
+if ($LASTEXITCODE -ne 0) {
+    aws dynamodb create-table `
+        --table-name TacMed_AnswerCache `
+        --attribute-definitions AttributeName=QuestionKey, AttributeType=S `
+        --key-schema AttributeName=QuestionKey, KeyType=HASH `
+        --billing-mode PAY_PER_REQUEST `
+        --region $region | Out-Null
+    aws dynamodb wait table-exists --table-name TacMed_AnswerCache --region $region
+    aws dynamodb update-time-to-live --table-name TacMed_AnswerCache --time-to-live-specification "Enabled=true, AttributeName=ExpiresAt" --region $region | Out-Null
+}
+else {
+    Write-Host "Table TacMed_AnswerCache already exists."
+}
+
+# TacMed_VoiceJobs (asynchronous voice queries, expired via TTL)
+aws dynamodb describe-table --table-name TacMed_VoiceJobs --region $region >$null 2>&1
+if ($LASTEXITCODE -ne 0) {
+    aws dynamodb create-table `
+        --table-name TacMed_VoiceJobs `
+        --attribute-definitions AttributeName=JobId, AttributeType=S `
+        --key-schema AttributeName=JobId, KeyType=HASH `
+        --billing-mode PAY_PER_REQUEST `
+        --region $region | Out-Null
+    aws dynamodb wait table-exists --table-name TacMed_VoiceJobs --region $region
+    aws dynamodb update-time-to-live --table-name TacMed_VoiceJobs --time-to-live-specification "Enabled=true, AttributeName=ExpiresAt" --region $region | Out-Null
+}
+else {
+    Write-Host "Table TacMed_VoiceJobs already exists."
+}
+
+# Browsers upload recordings straight to audio-temp/ through presigned URLs
+$cors = @{
+    CORSRules = @(
+        @{
+            AllowedOrigins = @("*")
+            AllowedMethods = @("PUT")
+            AllowedHeaders = @("*")
+            ExposeHeaders  = @("ETag")
+            MaxAgeSeconds  = 3000
+        }
+    )
+} | ConvertTo-Json -Depth 5
+Set-Content -Path cors.json -Value $cors
+aws s3api put-bucket-cors --bucket $s3KbBucket --cors-configuration file://cors.json
+Remove-Item cors.json
+
+# TacMed_QuizPool (pre-generated quiz questions plus expiring dedupe markers)
+aws dynamodb describe-table --table-name TacMed_QuizPool --region $region >$null 2>&1
+if ($LASTEXITCODE -ne 0) {
+    aws dynamodb create-table `
+        --table-name TacMed_QuizPool `
+        --attribute-definitions AttributeName=Pool, AttributeType=S AttributeName=QuestionId, AttributeType=S `
+        --key-schema AttributeName=Pool, KeyType=HASH AttributeName=QuestionId, KeyType=RANGE `
+        --billing-mode PAY_PER_REQUEST `
+        --region $region | Out-Null
+    aws dynamodb wait table-exists --table-name TacMed_QuizPool --region $region
+    aws dynamodb update-time-to-live --table-name TacMed_QuizPool --time-to-live-specification "Enabled=true, AttributeName=ExpiresAt" --region $region | Out-Null
+}
+else {
+    Write-Host "Table TacMed_QuizPool already exists."
+}
+
+# Expire any voice uploads that were not cleaned up by the completion handler
+$lifecycle = @{
+    Rules = @(
+        @{
+            ID         = "expire-audio-temp"
+            Filter     = @{ Prefix = "audio-temp/" }
+            Status     = "Enabled"
+            Expiration = @{ Days = 1 }
+            AbortIncompleteMultipartUpload = @{ DaysAfterInitiation = 1 }
+        }
+    )
+} | ConvertTo-Json -Depth 5
+Set-Content -Path lifecycle.json -Value $lifecycle
+aws s3api put-bucket-lifecycle-configuration --bucket $s3KbBucket --lifecycle-configuration file://lifecycle.json
+Remove-Item lifecycle.json
+
 # 4. Cognito
 Write-Host "Creating Cognito User Pool..."
 # Check if exists by name? Hard to filter by name reliably without jq/pagination.
@@ -148,9 +262,19 @@ $inlinePolicy = @{
             Action   = @(
                 "bedrock:RetrieveAndGenerate",
                 "bedrock:InvokeModel",
+                "bedrock:InvokeModelWithResponseStream",
                 "transcribe:StartTranscriptionJob",
                 "transcribe:GetTranscriptionJob",
-                "dynamodb:*"
+                "transcribe:DeleteTranscriptionJob",
+                "transcribe:StartStreamTranscription",
+                "s3:ListAllMyBuckets",
+                "s3:ListBucket",
+                "s3:GetObject",
+                "s3:PutObject",
+                "s3:DeleteObject",
+                "s3:AbortMultipartUpload",
+                "dynamodb:*",
+                "lambda:InvokeFunction"
             )
             Resource = "*"
         }
@@ -210,8 +334,10 @@ if ($existingApi) {
     Write-Host "Using existing API: $apiId"
 }
 else {
-    $apiId = aws apigatewayv2 create-api --name $apiName --protocol-type HTTP --cors-configuration AllowOrigins="*", AllowMethods="POST,GET,OPTIONS", AllowHeaders="*" --query 'ApiId' --output text
+    $apiId = aws apigatewayv2 create-api --name $apiName --protocol-type HTTP --cors-configuration AllowOrigins="*", AllowMethods="POST,GET,OPTIONS", AllowHeaders="*", ExposeHeaders="Server-Timing" --query 'ApiId' --output text
 }
+# API Gateway answers CORS itself and drops the Lambda's CORS headers; expose Server-Timing to the frontend
+aws apigatewayv2 update-api --api-id $apiId --cors-configuration AllowOrigins="*", AllowMethods="POST,GET,OPTIONS", AllowHeaders="*", ExposeHeaders="Server-Timing" | Out-Null
 
 $lambdaArn = "arn:aws:lambda:${region}:${accountId}:function:TacMed_Backend"
 
@@ -227,7 +353,7 @@ else {
 }
 
 # Routes
-foreach ($routeKey in @("POST /ask", "POST /quiz", "GET /leaderboard")) {
+foreach ($routeKey in @("POST /ask", "POST /ask/upload", "POST /ask/upload/complete", "POST /ask/stream", "GET /ask/status", "POST /quiz", "GET /leaderboard", "GET /rank", "POST /score", "POST /score/batch", "GET /history")) {
     $routes = aws apigatewayv2 get-routes --api-id $apiId --output json | ConvertFrom-Json
     if (-not ($routes.Items | Where-Object { $_.RouteKey -eq $routeKey })) {
         aws apigatewayv2 create-route --api-id $apiId --route-key $routeKey --target "integrations/$integrationId" | Out-Null
@@ -240,6 +366,22 @@ try {
 }
 catch {}
 
+# Transcribe completion events -> Lambda (drives the asynchronous voice pipeline)
+$ruleArn = aws events put-rule --name TacMed_TranscribeComplete --event-pattern '{"source":["aws.transcribe"],"detail-type":["Transcribe Job State Change"],"detail":{"TranscriptionJobStatus":["COMPLETED","FAILED"]}}' --query 'RuleArn' --output text
+aws events put-targets --rule TacMed_TranscribeComplete --targets "Id=TacMedBackend,Arn=$lambdaArn" | Out-Null
+try {
+    aws lambda add-permission --function-name TacMed_Backend --statement-id transcribe-events --action lambda:InvokeFunction --principal events.amazonaws.com --source-arn $ruleArn 2>$null
+}
+catch {}
+
+# Periodic quiz pool refill (the Lambda also self-triggers a refill when the pool runs low)
+$refillArn = aws events put-rule --name TacMed_QuizPoolRefill --schedule-expression "rate(5 minutes)" --query 'RuleArn' --output text
+aws events put-targets --rule TacMed_QuizPoolRefill --targets "Id=TacMedBackend,Arn=$lambdaArn,Input='{\"source\":\"tacmed.quiz-refill\"}'" | Out-Null
+try {
+    aws lambda add-permission --function-name TacMed_Backend --statement-id quiz-refill --action lambda:InvokeFunction --principal events.amazonaws.com --source-arn $refillArn 2>$null
+}
+catch {}
+
 Write-Host "Setup Complete!"
 Write-Host "Web Bucket: $s3WebBucket"
 Write-Host "KB Bucket: $s3KbBucket"
@@ -0,0 +1,284 @@
+
+import json
+import os
+import tempfile
+
+from bench_lambda import FakeAgentRuntime, FakeBedrockRuntime, FakeS3, Services, http_event, install_fakes, lambda_function
+from doc_router import DocRouter, write_router
+
+# Offline checks of lambda_handler behaviour, on the in-process fakes of bench_lambda.py (no AWS,
+# no latency). Runs under pytest or directly:
+#   python -m pytest -q test_handlers.py
+#   python test_handlers.py
+
+QUESTION = 'How do I pack a junctional wound?'
+
+def setup_fakes():
+    lambda_function.logs.print = lambda *a, **k: None
+    services = Services(dict.fromkeys(('dynamodb', 's3', 'bedrock', 'transcribe', 'lambda'), 0))
+    install_fakes(services, user_count=20, pool_size=5)
+    return services
+
+def ask(question, stream=False):
+    resp = lambda_function.lambda_handler(http_event('POST', '/ask', {'question': question, 'stream': stream}), None)
+    assert resp['statusCode'] == 200
+    return resp
+
+def cached(question):
+    _, manifest = lambda_function.get_kb_resources()
+    return lambda_function.answer_cache.get(question, lambda_function.doc_version(manifest))[0]
+
+class ThrottledAgentRuntime(FakeAgentRuntime):
+    def retrieve_and_generate(self, input, retrieveAndGenerateConfiguration):
+        self.services.call('bedrock')
+        raise RuntimeError('ThrottlingException: Rate exceeded')
+
+class ResetAgentRuntime(FakeAgentRuntime):
+    # Streams two fragments, then the connection drops
+    def retrieve_and_generate_stream(self, input, retrieveAndGenerateConfiguration):
+        self.services.call('bedrock')
+
+        def stream():
+            yield {'output': {'text': 'Apply a '}}
+            yield {'output': {'text': 'tour'}}
+            raise ConnectionResetError('stream reset by peer')
+
+        return {'stream': stream()}
+
+class ResetBedrockRuntime(FakeBedrockRuntime):
+    def invoke_model_with_response_stream(self, modelId, body):
+        self.services.call('bedrock')
+
+        def stream():
+            yield {'chunk': {'bytes': json.dumps({'generation': 'Apply a '}).encode()}}
+            raise ConnectionResetError('stream reset by peer')
+
+        return {'body': stream()}
+
+class RecordingAgentRuntime(FakeAgentRuntime):
+    def __init__(self, services):
+        super().__init__(services)
+        self.sources = []
+
+    def retrieve_and_generate(self, input, retrieveAndGenerateConfiguration):
+        config = retrieveAndGenerateConfiguration['externalSourcesConfiguration']
+        self.sources.append([s['s3Location']['uri'] for s in config['sources']])
+        return super().retrieve_and_generate(input, retrieveAndGenerateConfiguration)
+
+def install_router(path):
+    # Routes over the fake bucket's guide-0.pdf .. guide-3.pdf
+    topics = ['tourniquet hemorrhage limb bleeding', 'airway cricothyroidotomy breathing',
+              'chemical agent decontamination nerve agent', 'casualty evacuation litter helicopter']
+    docs = [{'key': f"guide-{i}.pdf", 'title': f"guide-{i}", 'pages': 10} for i in range(4)]
+    write_router(path, docs, [{'doc': i, 'heading': topic, 'text': topic} for i, topic in enumerate(topics)])
+    lambda_function._doc_router.update(loaded=True, router=DocRouter(path))
+
+def routed_ask(question, mode, passages):
+    services = setup_fakes()
+    agent = lambda_function.bedrock_agent_runtime = RecordingAgentRuntime(services)
+    retrieve, rag_mode = lambda_function.retrieve_passages, lambda_function.KB_RAG_MODE
+    lambda_function.retrieve_passages = lambda question: passages
+    lambda_function.KB_RAG_MODE = mode
+    with tempfile.TemporaryDirectory() as tmp:
+        install_router(os.path.join(tmp, 'router.json'))
+        try:
+            ask(question)
+        finally:
+            lambda_function.retrieve_passages, lambda_function.KB_RAG_MODE = retrieve, rag_mode
+            lambda_function._doc_router.update(loaded=False, router=None)
+    return agent.sources
+
+def test_external_mode_sends_the_routed_documents():
+    # The local index is not consulted, even when it has passages
+    passages = [{'doc': 'guide-0.pdf', 'title': 'guide-0', 'page': 1, 'text': 'Decontaminate with water.'}]
+    assert routed_ask('Nerve agent decontamination steps?', 'external', passages) == [['s3://tacmed-kb-bench/guide-2.pdf']]
+
+def test_local_miss_sends_the_routed_documents():
+    assert routed_ask('When to call a helicopter evacuation?', 'local', []) == [['s3://tacmed-kb-bench/guide-3.pdf']]
+
+class ScriptedBedrockRuntime(FakeBedrockRuntime):
+    # Streams a fixed generation in 24-character chunks
+    def __init__(self, services, text):
+        super().__init__(services)
+        self.text = text
+
+    def invoke_model_with_response_stream(self, modelId, body):
+        self.services.call('bedrock')
+        return {'body': [{'chunk': {'bytes': json.dumps({'generation': self.text[i:i + 24]}).encode()}}
+                         for i in range(0, len(self.text), 24)]}
+
+TRUNCATED_QUIZ = ('[{"question": "First action for spurting thigh bleeding?", "options": ["Tourniquet", "IV", '
+                  '"Airway", "Splint"], "correct_index": 0, "explanation": "Massive hemorrhage comes first')
+
+def test_answer_without_retrieval_is_not_cached():
+    services = setup_fakes()
+    lambda_function.bedrock_agent_runtime = ThrottledAgentRuntime(services)
+    payload = json.loads(ask(QUESTION)['body'])
+    assert payload['answer'] == FakeBedrockRuntime.ANSWER
+    assert cached(QUESTION) is None
+    assert not lambda_function.answer_cache.table.items
+
+def sse_tokens(body):
+    return [json.loads(line[6:]).get('token') for line in body.split('\n') if line.startswith('data: ')][:-1]
+
+def sse_done(body):
+    return json.loads(body.rsplit('data: ', 1)[1])
+
+def test_partial_external_stream_falls_back_to_a_full_answer():
+    services = setup_fakes()
+    lambda_function.bedrock_agent_runtime = ResetAgentRuntime(services)
+    body = ask(QUESTION, stream=True)['body']
+    assert sse_tokens(body) == [FakeBedrockRuntime.ANSWER]
+    assert sse_done(body)['answer'] == FakeBedrockRuntime.ANSWER
+    assert cached(QUESTION) is None
+    assert not lambda_function.answer_cache.table.items
+
+def test_complete_answer_is_cached():
+    setup_fakes()
+    payload = json.loads(ask(QUESTION)['body'])
+    assert cached(QUESTION) == payload
+
+def test_partial_local_stream_falls_back_to_a_full_answer():
+    services = setup_fakes()
+    lambda_function.bedrock_runtime = ResetBedrockRuntime(services)
+    retrieve = lambda_function.retrieve_passages
+    lambda_function.retrieve_passages = lambda question: [
+        {'doc': 'guide-0.pdf', 'title': 'guide-0', 'page': 3, 'text': 'Junctional hemorrhage: pack the wound.'}]
+    try:
+        body = ask(QUESTION, stream=True)['body']
+    finally:
+        lambda_function.retrieve_passages = retrieve
+    # EXTERNAL_SOURCES answers, as on the non-stream path, and the partial local text is gone
+    assert sse_done(body)['answer'].strip() == FakeBedrockRuntime.ANSWER
+    assert sse_tokens(body) == [sse_done(body)['answer']]
+
+def test_upload_rejects_bad_sizes():
+    services = setup_fakes()
+    for size in (1e12, 10 ** 12, 'abc', -1, 0, None, True, [1]):
+        resp = lambda_function.lambda_handler(http_event('POST', '/ask/upload', {'format': 'webm', 'size': size}), None)
+        assert resp['statusCode'] == 400, size
+    assert services.calls['s3'] == 0
+    resp = lambda_function.lambda_handler(http_event('POST', '/ask/upload', {'format': 'webm', 'size': 12 * 2 ** 20}), None)
+    assert resp['statusCode'] == 200
+    assert len(json.loads(resp['body'])['partUrls']) == 3
+
+def test_upload_complete_rejects_bad_parts():
+    services = setup_fakes()
+    key = 'audio-temp/' + '0' * 32 + '.webm'
+    for parts in ([{'PartNumber': 'x', 'ETag': '"a"'}], [{'PartNumber': 0, 'ETag': '"a"'}],
+                  [{'PartNumber': 10001, 'ETag': '"a"'}], [{'PartNumber': 1}], ['part'],
+                  [{'PartNumber': 2, 'ETag': '"a"'}, {'PartNumber': 1, 'ETag': '"b"'}]):
+        resp = lambda_function.lambda_handler(http_event('POST', '/ask/upload/complete', {
+            'audioKey': key, 'uploadId': 'u', 'parts': parts}), None)
+        assert resp['statusCode'] == 400, parts
+    assert services.calls['s3'] == 0
+
+class FailingS3(FakeS3):
+    def list_buckets(self):
+        self.services.call('s3')
+        raise RuntimeError('AccessDenied')
+
+    def get_paginator(self, name):
+        self.services.call('s3')
+        raise RuntimeError('AccessDenied')
+
+def test_kb_listing_failure_is_cached():
+    services = setup_fakes()
+    lambda_function.s3 = FailingS3(services)
+    saved = dict(lambda_function._kb_cache)
+    lambda_function._kb_cache.update(manifest=None, loaded_at=0.0, failed_at=0.0)
+    try:
+        for n in range(3):
+            ask(f"{QUESTION} ({n})")
+        assert services.calls['s3'] == 1
+    finally:
+        lambda_function._kb_cache.update(saved)
+
+def test_kb_bucket_discovery_failure_is_cached_for_uploads():
+    services = setup_fakes()
+    lambda_function.s3 = FailingS3(services)
+    saved, bucket = dict(lambda_function._kb_cache), os.environ.pop('KB_BUCKET')
+    lambda_function._kb_cache.update(bucket=None, manifest=None, loaded_at=0.0, failed_at=0.0)
+    try:
+        for _ in range(3):
+            resp = lambda_function.lambda_handler(http_event('POST', '/ask/upload', {'format': 'webm', 'size': 400000}), None)
+            assert resp['statusCode'] == 500
+        ask(QUESTION)
+        assert services.calls['s3'] == 1
+    finally:
+        os.environ['KB_BUCKET'] = bucket
+        lambda_function._kb_cache.update(saved)
+
+def test_stream_chunk_input_errors_are_400_and_encodings_415():
+    setup_fakes()
+
+    def chunk(**fields):
+        body = dict({'sessionId': 'session-1', 'seq': 0, 'audio': 'QUJD'}, **fields)
+        return lambda_function.lambda_handler(http_event('POST', '/ask/stream', body), None)['statusCode']
+
+    for seq in ('x', -1, 1.5, None, True):
+        assert chunk(seq=seq) == 400, seq
+    assert chunk(audio='not base64!') == 400
+    os.environ['SPEECH_RECOGNIZER'] = 'transcribe'
+    try:
+        assert chunk(encoding='webm') == 415
+    finally:
+        os.environ['SPEECH_RECOGNIZER'] = 'fake'
+
+def test_quiz_pool_refetches_after_a_claim_conflict():
+    setup_fakes()
+    pool = lambda_function.quiz_pool
+    # Candidates another container has already claimed
+    pool._candidates = ['claimed-1', 'claimed-2', 'claimed-3']
+    assert pool.take() is not None
+    assert pool.stats['claim_conflicts'] == 1
+
+def test_quiz_metrics_go_out_as_emf():
+    setup_fakes()
+    lines = []
+    lambda_function.logs.print = lambda line, **k: lines.append(line)
+    resp = lambda_function.lambda_handler(http_event('POST', '/quiz', {}), None)
+    assert resp['statusCode'] == 200
+    record = [json.loads(line) for line in lines if '"_aws"' in line][-1]
+    metrics = {m['Name'] for m in record['_aws']['CloudWatchMetrics'][0]['Metrics']}
+    assert {'QuizServedPool', 'QuizServedLive', 'QuizPoolDepth'} <= metrics
+    assert record['QuizServedPool'] == 1 and record['QuizServedLive'] == 0
+    assert record['QuizPoolDepth'] == 4
+
+def test_quiz_cut_inside_a_field_is_not_repaired_locally():
+    services = setup_fakes()
+    lambda_function.bedrock_runtime = ScriptedBedrockRuntime(services, TRUNCATED_QUIZ)
+    valid, rejected = lambda_function.stream_quiz_objects('prompt', 1000, 1)
+    assert valid == []
+    assert rejected[0][1] == ['truncated JSON']
+
+def test_quiz_cut_between_fields_is_repaired_locally():
+    services = setup_fakes()
+    lambda_function.bedrock_runtime = ScriptedBedrockRuntime(services, TRUNCATED_QUIZ + ' in MARCH."')
+    valid, rejected = lambda_function.stream_quiz_objects('prompt', 1000, 1)
+    assert [quiz['explanation'] for quiz in valid] == ['Massive hemorrhage comes first in MARCH.']
+    assert rejected == []
+
+def test_history_is_written_before_the_handler_returns():
+    setup_fakes()
+    table = lambda_function.history.table
+    before = len(table.items)
+    resp = lambda_function.lambda_handler(http_event('POST', '/score', {'userId': 'bench-user-1', 'question': 'q'}), None)
+    assert resp['statusCode'] == 200
+    assert len(table.items) == before + 1
+    assert not lambda_function.history.summary()['queued']
+
+def test_invalid_score_batch_records_nothing():
+    setup_fakes()
+    table = lambda_function.history.table
+    before = len(table.items)
+    resp = lambda_function.lambda_handler(http_event('POST', '/score/batch', {'userId': 'bench-user-1', 'events': [
+        {'eventId': 'e1', 'correct': False}, {'eventId': 'e2', 'correct': False}, {'correct': True}]}), None)
+    assert resp['statusCode'] == 400
+    assert len(table.items) == before
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"ok  {name}")